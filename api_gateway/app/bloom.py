@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable
+
+from .logs import logger
+
+# Busca uma página de códigos emitidos: (shard, after_id, limit) -> (códigos, maior id da página)
+FetchPage = Callable[[str, int, int], Awaitable[tuple[list[str], int]]]
+# Lista os shards de url_mappings (os ids são sequenciais dentro de cada shard)
+FetchShards = Callable[[], Awaitable[list[str]]]
+# Assina o stream de códigos criados: cada item é uma lista (vazia = inscrição confirmada ou heartbeat)
+FetchStream = Callable[[], AsyncIterator[list[str]]]
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom sobre um bytearray. Responde "com certeza ausente" ou
+    "talvez presente"; nunca tem falso negativo para códigos adicionados.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float, max_bytes: int = 0):
+        ideal_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        if max_bytes > 0:
+            ideal_bits = min(ideal_bits, max_bytes * 8)
+        self.num_bits = max(8, ideal_bits)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.target_fp_rate = fp_rate
+        self.count = 0  # Códigos distintos adicionados (estimativa: adições que mudaram algum bit)
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, code: str):
+        # Double hashing (Kirsch-Mitzenmacher): k posições a partir de dois hashes de 64 bits
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, code: str) -> bool:
+        """Adiciona o código; retorna True se ele ainda não estava (aparentemente) no filtro."""
+        bits = self._bits
+        changed = False
+        for position in self._positions(code):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                changed = True
+        if changed:
+            self.count += 1
+        return changed
+
+    def __contains__(self, code: str) -> bool:
+        bits = self._bits
+        for position in self._positions(code):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_fp_rate(self) -> float:
+        """Taxa de falsos positivos esperada com a ocupação atual."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+
+class CodeFilter:
+    """
+    Filtro de Bloom dos códigos emitidos, carregado em páginas na inicialização
+    e sincronizado periodicamente. Enquanto a carga inicial não termina, todo
+    código é tratado como "talvez presente" (nenhuma requisição é rejeitada).
+
+    Os códigos criados em qualquer lugar (outros workers e réplicas do gateway,
+    importação em massa) chegam pelo stream de criações (`fetch_stream`, ligado ao
+    LISTEN do Redirection Service). A inscrição no stream acontece antes da
+    sincronização que a acompanha, então nada criado entre as duas se perde. Só
+    com o stream ativo um código ausente do filtro é recusado; sem ele, o código
+    pode ter sido criado depois da última sincronização e a ausência é só uma
+    dica: a requisição segue para o Redirection Service.
+
+    A sincronização por id não supõe que os ids sejam commitados em ordem (lotes,
+    importação e group-commit seguram ids por uma transação inteira): cada uma
+    relê desde o maior id visto numa sincronização de pelo menos `reorder_window`
+    segundos antes. Ao (re)conectar o stream, a referência é o instante da queda
+    (ou, na primeira vez, da inscrição), e sem sincronização tão antiga a leitura
+    começa do zero.
+    """
+
+    def __init__(self, fetch_page: FetchPage, fetch_shards: FetchShards, capacity: int, fp_rate: float,
+                 max_bytes: int = 0, sync_interval: float = 2.0, page_size: int = 10000,
+                 reorder_window: float = 60.0, fetch_stream: FetchStream | None = None,
+                 stream_retry: float = 5.0):
+        self._fetch_page = fetch_page
+        self._fetch_shards = fetch_shards
+        self._fetch_stream = fetch_stream
+        self._bloom = BloomFilter(capacity, fp_rate, max_bytes)
+        self._sync_interval = sync_interval
+        self._page_size = page_size
+        self._reorder_window = reorder_window
+        self._stream_retry = stream_retry
+        # Por shard: (instante, maior id visto) de cada sincronização dentro da janela, a mais antiga primeiro
+        self._history: dict[str, deque[tuple[float, int]]] = {}
+        self._sync_lock = asyncio.Lock()
+        self._first_stream_attempt = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.ready = False
+        self.streaming = False
+        self.rejected = 0
+        self.passed_through = 0
+        self.syncs = 0
+        self.sync_errors = 0
+        self.stream_connections = 0
+        self.stream_codes = 0
+        self.stream_errors = 0
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._run()))
+        if self._fetch_stream is not None:
+            self._tasks.append(asyncio.create_task(self._follow_stream()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def add(self, code: str):
+        """Registra um código recém-criado (resposta do Shortening Service)."""
+        self._bloom.add(code)
+
+    def might_exist(self, code: str) -> bool:
+        """False só quando o código com certeza não foi emitido; não faz I/O."""
+        if not self.ready or code in self._bloom:
+            return True
+        if not self.streaming:
+            # O código pode ser mais novo que a última sincronização
+            self.passed_through += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def _rescan_from(self, shard: str, since: float, strict: bool) -> int:
+        """
+        Maior id visto na sincronização mais recente feita até `reorder_window`
+        segundos antes de `since`. Sem nenhuma tão antiga: 0 se `strict`, senão a
+        mais antiga guardada (basta para as sincronizações periódicas, que não
+        sustentam as recusas: com o stream ativo, as criações chegam por ele).
+        """
+        history = self._history.get(shard)
+        if not history:
+            return 0
+        cutoff = since - self._reorder_window
+        found = None
+        for started, last_id in history:
+            if started > cutoff:
+                break
+            found = last_id
+        if found is None:
+            return 0 if strict else history[0][1]
+        return found
+
+    async def sync(self, since: float | None = None):
+        """
+        Busca, em cada shard, os códigos com id acima do ponto de releitura (ver
+        _rescan_from). `since` = instante a partir do qual nada pode faltar
+        (inscrição ou queda do stream); None = sincronização periódica.
+        """
+        async with self._sync_lock:
+            for shard in await self._fetch_shards():
+                started = time.monotonic()
+                after_id = self._rescan_from(shard, started if since is None else since, strict=since is not None)
+                last_seen = after_id
+                while True:
+                    codes, last_id = await self._fetch_page(shard, after_id, self._page_size)
+                    for code in codes:
+                        self._bloom.add(code)
+                    last_seen = max(last_seen, last_id)
+                    after_id = last_id
+                    if len(codes) < self._page_size:
+                        break
+                history = self._history.setdefault(shard, deque())
+                history.append((started, max(last_seen, history[-1][1] if history else 0)))
+                # Guarda o suficiente para uma queda do stream de até uma janela atrás
+                while len(history) > 1 and history[1][0] <= started - 2 * self._reorder_window:
+                    history.popleft()
+            self.syncs += 1
+        if not self.ready:
+            self.ready = True
+            logger.info(f"Filtro de códigos carregado: {self._bloom.count} códigos, {self._bloom.memory_bytes} bytes")
+
+    async def _run(self):
+        # Com stream, a carga inicial é a sincronização feita logo após a inscrição (se ela der certo)
+        if self._fetch_stream is not None:
+            await self._first_stream_attempt.wait()
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.sync_errors += 1
+                logger.error(f"Error syncing code filter: {e}")
+            await asyncio.sleep(self._sync_interval)
+
+    async def _follow_stream(self):
+        covered_until = time.monotonic()  # Até quando as criações foram acompanhadas pelo stream
+        while True:
+            try:
+                async for codes in self._fetch_stream():
+                    for code in codes:
+                        self._bloom.add(code)
+                    self.stream_codes += len(codes)
+                    if not self.streaming:
+                        # Primeira mensagem = inscrito; o que foi criado antes disso vem pela sincronização
+                        self.stream_connections += 1
+                        await self.sync(since=covered_until)
+                        self.streaming = True
+                        self._first_stream_attempt.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stream_errors += 1
+                # Uma vez por queda (sem LISTEN, ex. no SQLite, toda tentativa falha)
+                if self.streaming or not self._first_stream_attempt.is_set():
+                    logger.warning(f"Code filter change stream unavailable, misses go to the backend: {e}")
+            finally:
+                if self.streaming:
+                    covered_until = time.monotonic()
+                self.streaming = False
+                self._first_stream_attempt.set()
+            await asyncio.sleep(self._stream_retry)
+
+    def stats(self) -> dict:
+        bloom = self._bloom
+        return {
+            "ready": int(self.ready),
+            "streaming": int(self.streaming),
+            "codes": bloom.count,
+            "capacity": bloom.capacity,
+            "memory_bytes": bloom.memory_bytes,
+            "num_hashes": bloom.num_hashes,
+            "target_fp_rate": bloom.target_fp_rate,
+            "estimated_fp_rate": bloom.estimated_fp_rate(),
+            "rejected": self.rejected,
+            "passed_through": self.passed_through,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "stream_connections": self.stream_connections,
+            "stream_codes": self.stream_codes,
+            "stream_errors": self.stream_errors,
+            "shards": len(self._history),
+        }
@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+
+class RedirectCache:
+    """
+    Cache LRU em memória com TTL para os redirecionamentos do gateway.
+    Guarda também resultados negativos (404) por um tempo mais curto.
+    """
+
+    # Sentinelas para códigos conhecidamente inexistentes e para links expirados
+    NOT_FOUND = object()
+    GONE = object()
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict = OrderedDict()  # short_code -> (expira_em, valor)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, short_code: str):
+        """Retorna o valor guardado, NOT_FOUND, GONE ou None se não houver entrada válida."""
+        entry = self._entries.get(short_code)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[short_code]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(short_code)
+        if value is self.NOT_FOUND or value is self.GONE:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, short_code: str, long_url: str, ttl: float | None = None):
+        """Armazena um mapeamento encontrado."""
+        self._store(short_code, long_url, self.ttl if ttl is None else ttl)
+
+    def set_not_found(self, short_code: str):
+        """Armazena um resultado negativo (código inexistente)."""
+        self._store(short_code, self.NOT_FOUND, self.negative_ttl)
+
+    def set_gone(self, short_code: str):
+        """Armazena um link expirado (410) pelo mesmo tempo de um resultado negativo."""
+        self._store(short_code, self.GONE, self.negative_ttl)
+
+    def invalidate(self, short_code: str):
+        """Remove um código do cache, se presente."""
+        self._entries.pop(short_code, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _store(self, short_code: str, value, ttl: float):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries[short_code] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(short_code)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Contadores para dimensionar o cache em relação ao conjunto quente."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
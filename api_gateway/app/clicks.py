@@ -0,0 +1,161 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from . import metrics
+from .logs import logger
+
+CLICKS_DROPPED = metrics.Counter(
+    "gateway_clicks_dropped_total",
+    "Cliques descartados antes de chegar ao banco, por motivo.",
+    ("reason",),
+)
+
+
+class ClickPipeline:
+    """
+    Pipeline assíncrono de cliques: o redirecionamento só enfileira o evento
+    (sem aguardar nada) e uma tarefa em segundo plano agrega por código e
+    envia os agregados em lote para o sink periodicamente.
+
+    Com o sink fora do ar, os agregados voltam para o próximo flush, mas com
+    limites: no máximo `max_pending` códigos aguardando (cliques de códigos
+    novos além disso são descartados; os de códigos já pendentes só somam) e
+    `max_attempts` tentativas por agregado (um lote que nunca é aceito não é
+    reenviado para sempre).
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[list[dict]], Awaitable[None]],
+        max_queue: int = 100000,
+        flush_interval: float = 2.0,
+        max_pending: int = 100000,
+        max_attempts: int = 5,
+    ):
+        self._sink = sink
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._high_watermark = max(1, max_queue // 2)
+        self.flush_interval = flush_interval
+        self._pending: dict[str, list] = {}  # short_code -> [count, first_at, last_at, tentativas já falhas]
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.flushed_clicks = 0
+        self.dropped_pending_full = 0
+        self.dropped_after_retries = 0
+
+    def record(self, short_code: str):
+        """Registra um clique sem bloquear; descarta (e conta) se a fila estiver cheia."""
+        try:
+            self._queue.put_nowait((short_code, time.time()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            CLICKS_DROPPED.inc("queue_full")
+            return
+        self.recorded += 1
+        if self._queue.qsize() >= self._high_watermark:
+            self._wake.set()  # Fila enchendo: antecipa o próximo flush
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Para a tarefa de fundo e faz um flush final. A tarefa não é cancelada: um
+        flush em andamento já tirou o lote de _pending e o perderia no meio do envio.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                return  # O flush final é feito por stop()
+            await self.flush()
+
+    def _drain(self):
+        """Move os eventos da fila para os agregados por código."""
+        pending = self._pending
+        while True:
+            try:
+                short_code, clicked_at = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            entry = pending.get(short_code)
+            if entry is None:
+                if len(pending) >= self.max_pending:
+                    # Sink fora do ar há tempo: não deixa os agregados crescerem sem limite
+                    self.dropped_pending_full += 1
+                    CLICKS_DROPPED.inc("pending_full")
+                    continue
+                pending[short_code] = [1, clicked_at, clicked_at, 0]
+            else:
+                entry[0] += 1
+                entry[2] = clicked_at
+
+    async def flush(self):
+        """Envia os agregados acumulados; em caso de falha eles voltam para o próximo flush (até max_attempts)."""
+        self._drain()
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [
+            {"short_code": code, "count": count, "first_at": first_at, "last_at": last_at}
+            for code, (count, first_at, last_at, _) in batch.items()
+        ]
+        try:
+            await self._sink(rows)
+        except Exception as e:
+            self.flush_failures += 1
+            logger.error(f"[Click Pipeline]: Falha ao enviar {len(rows)} agregados de cliques: {e}")
+            given_up = 0
+            for code, (count, first_at, last_at, attempts) in batch.items():
+                if attempts + 1 >= self.max_attempts:
+                    given_up += count
+                    continue
+                entry = self._pending.get(code)
+                if entry is None:
+                    self._pending[code] = [count, first_at, last_at, attempts + 1]
+                else:
+                    entry[0] += count
+                    entry[1] = min(entry[1], first_at)
+                    entry[2] = max(entry[2], last_at)
+                    entry[3] = max(entry[3], attempts + 1)
+            if given_up:
+                self.dropped_after_retries += given_up
+                CLICKS_DROPPED.inc("retries_exhausted", amount=given_up)
+                logger.error(f"[Click Pipeline]: {given_up} cliques descartados após {self.max_attempts} tentativas")
+            return
+        self.flushes += 1
+        self.flushed_clicks += sum(row["count"] for row in rows)
+
+    def stats(self) -> dict:
+        return {
+            "queue_size": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "pending_codes": len(self._pending),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending_max": self.max_pending,
+            "dropped_pending_full": self.dropped_pending_full,
+            "dropped_after_retries": self.dropped_after_retries,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "flushed_clicks": self.flushed_clicks,
+        }
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from fastapi import HTTPException, Request
+
+
+class LocalServices:
+    """
+    Modo monolito: o gateway chama a lógica do Shortening e do Redirection
+    Service no mesmo processo, sem HTTP interno (sem JSON, TCP nem nova
+    validação da resposta). Recebe os módulos `main` de cada serviço já
+    importados (ver monolith/main.py); os lifespans deles rodam antes do gateway.
+    """
+
+    def __init__(self, shortening, redirection):
+        self._shortening = shortening
+        self._redirection = redirection
+
+    async def shorten(self, long_url: str, expires_at: datetime | None, redirect_policy: str | None = None) -> str:
+        """Cria o link com a URL, a expiração e a política já validadas pelo gateway; retorna a URL curta."""
+        service = self._shortening
+        try:
+            async with service.database.get_session() as db:
+                return await service.shorten_url(long_url, expires_at, db, redirect_policy)
+        except HTTPException as e:
+            # Mesma mensagem que o gateway devolve no modo HTTP
+            raise HTTPException(status_code=e.status_code, detail=f"Shortening Service Error: {e.detail}")
+
+    async def shorten_batch(self, request: Request):
+        """Repassa a própria requisição do gateway (corpo e Content-Type) ao POST /shorten/batch."""
+        service = self._shortening
+        async with service.database.get_session() as db:
+            return await service.create_short_urls_batch(request, db)
+
+    async def lookup(self, short_code: str) -> tuple[str, float | None, str | None]:
+        """(URL longa, expiração em epoch, política de redirecionamento); 404/410 chegam como HTTPException."""
+        service = self._redirection
+        return await service.lookup_mapping(service.app.state, short_code, service.LOOKUP_BACKEND)
+
+    async def send_clicks(self, rows: list[dict]):
+        service = self._redirection
+        clicks = [service.models.ClickAggregate(**row) for row in rows]
+        async with service.database.get_session() as db:
+            await service.record_clicks(clicks, db)
+
+    async def code_stream(self):
+        """Códigos criados, direto do LISTEN do Redirection Service (como o GET /codes/stream)."""
+        listener = self._redirection.app.state.change_listener
+        queue = listener.subscribe()
+        if queue is None:
+            raise RuntimeError("Change stream unavailable")
+        try:
+            yield []  # Inscrição confirmada
+            while (codes := await queue.get()) is not None:
+                yield codes
+        finally:
+            listener.unsubscribe(queue)
+
+    async def code_shards(self) -> list[str]:
+        return (await self._redirection.list_code_shards())["shards"]
+
+    async def codes(self, shard: str, after_id: int, limit: int) -> tuple[list[str], int]:
+        data = await self._redirection.list_codes(after_id=after_id, limit=limit, shard=shard)
+        return data["codes"], data["last_id"]
@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel
+
+# Camada de logging compartilhada pelos serviços (cada serviço tem sua cópia deste módulo).
+# Os registros vão para uma fila e são escritos no stderr por uma thread separada,
+# então o event loop nunca faz a escrita síncrona.
+SERVICE_NAME = os.getenv("SERVICE_NAME", "api_gateway")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" ou "text"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # Fração das linhas INFO por requisição
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Sem token, os endpoints administrativos ficam desativados
+
+
+class JSONFormatter(logging.Formatter):
+    """Formata cada registro como uma linha JSON (campos extras em `fields`)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "service": SERVICE_NAME,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento local."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname} [{SERVICE_NAME}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (e conta) registros quando a fila está cheia, sem bloquear."""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+logger = logging.getLogger(f"ushort.{SERVICE_NAME}")
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging():
+    """Configura o logger do serviço uma única vez (idempotente)."""
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JSONFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.handlers[:] = [DroppingQueueHandler(log_queue)]
+    logger.propagate = False
+    set_level(LOG_LEVEL)
+
+
+def set_level(level: str) -> str:
+    """Altera o nível de log em tempo de execução; retorna o nível efetivo."""
+    level = level.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown log level: {level}")
+    logger.setLevel(level)
+    return logging.getLevelName(logger.level)
+
+
+def set_sample_rate(rate: float) -> float:
+    global LOG_SAMPLE_RATE
+    LOG_SAMPLE_RATE = min(1.0, max(0.0, rate))
+    return LOG_SAMPLE_RATE
+
+
+def log_request(msg: str, **fields):
+    """
+    Linha INFO por requisição, amostrada por LOG_SAMPLE_RATE.
+    O sorteio acontece antes de criar o registro, então linhas descartadas quase não custam nada.
+    Com nível DEBUG todas as linhas são emitidas.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, extra={"fields": fields})
+    elif logger.isEnabledFor(logging.INFO) and random.random() < LOG_SAMPLE_RATE:
+        logger.info(msg, extra={"fields": {**fields, "sample_rate": LOG_SAMPLE_RATE}})
+
+
+def stats() -> dict:
+    return {
+        "level": logging.getLevelName(logger.level),
+        "sample_rate": LOG_SAMPLE_RATE,
+        "dropped": DroppingQueueHandler.dropped,
+    }
+
+
+class LogSettings(BaseModel):
+    level: str | None = None
+    sample_rate: float | None = None
+
+
+def admin_router(prefix: str) -> APIRouter:
+    """Rotas para consultar/alterar o logging em tempo de execução (exigem X-Admin-Token)."""
+    router = APIRouter(prefix=prefix)
+
+    def check_token(token: str | None):
+        if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+    @router.get("/logging")
+    async def get_logging(x_admin_token: str | None = Header(None)):
+        check_token(x_admin_token)
+        return stats()
+
+    @router.put("/logging")
+    async def update_logging(settings: LogSettings, x_admin_token: str | None = Header(None)):
+        check_token(x_admin_token)
+        try:
+            if settings.level is not None:
+                set_level(settings.level)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if settings.sample_rate is not None:
+            set_sample_rate(settings.sample_rate)
+        return stats()
+
+    return router
+
+
+setup_logging()
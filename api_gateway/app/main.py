@@ -1,17 +1,59 @@
 import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Literal
+
 import httpx
-import sys # Adicionado para sys.stderr
-from fastapi import FastAPI, HTTPException, Request, status
+import orjson
+from fastapi import FastAPI, Header, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl
+from fastapi.responses import ORJSONResponse, RedirectResponse, Response
+from pydantic import BaseModel, Field, HttpUrl, model_validator
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+from . import logs, metrics, upstream
+from .bloom import CodeFilter
+from .cache import RedirectCache
+from .clicks import ClickPipeline
+from .local_services import LocalServices
+from .logs import logger
+from .ratelimit import REJECTED, AdmissionControl, LoadShedder, RateLimitMiddleware, TokenBucketLimiter
+from .shared_cache import SharedRedirectCache, default_path
+from .singleflight import SingleFlight
+
 load_dotenv()
 
 # Modelos Pydantic
+# O gateway é a entrada do sistema: a URL e a expiração são validadas e normalizadas
+# só aqui; os serviços recebem os dados prontos pelo contrato interno (/internal/*)
 class URLToShortenRequest(BaseModel):
     long_url: HttpUrl
+    # Expiração opcional: data absoluta ou segundos a partir de agora (não os dois)
+    expires_at: datetime | None = None
+    expires_in: int | None = Field(None, gt=0)
+    # Cache do redirecionamento: temporary (padrão), cacheable ou permanent; ver _redirect_response
+    redirect_policy: Literal["temporary", "cacheable", "permanent"] | None = None
+
+    @model_validator(mode="after")
+    def _resolve_expiry(self):
+        if self.expires_in is not None:
+            if self.expires_at is not None:
+                raise ValueError("Use either expires_at or expires_in, not both")
+            self.expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.expires_in)
+            self.expires_in = None
+        elif self.expires_at is not None:
+            if self.expires_at.tzinfo is None:
+                self.expires_at = self.expires_at.replace(tzinfo=timezone.utc)  # Sem fuso = UTC
+            self.expires_at = self.expires_at.astimezone(timezone.utc)
+            if self.expires_at <= datetime.now(timezone.utc):
+                raise ValueError("expires_at must be in the future")
+        if self.redirect_policy == "temporary":
+            self.redirect_policy = None  # O padrão não é enviado nem gravado
+        elif self.redirect_policy == "permanent" and self.expires_at is not None:
+            # Um 301 fica no cache do navegador, que não sabe da expiração
+            raise ValueError("Permanent links cannot expire")
+        return self
 
 class ShortenedURLResponse(BaseModel):
     short_url: HttpUrl
@@ -21,38 +63,272 @@ SHORTENING_SERVICE_URL = os.getenv("SHORTENING_SERVICE_URL")
 REDIRECTION_SERVICE_URL = os.getenv("REDIRECTION_SERVICE_URL")
 BASE_URL_GATEWAY = os.getenv("BASE_URL")
 
-print(f"INFO [API Gateway Startup]: SHORTENING_SERVICE_URL = {SHORTENING_SERVICE_URL}", file=sys.stderr)
-print(f"INFO [API Gateway Startup]: REDIRECTION_SERVICE_URL = {REDIRECTION_SERVICE_URL}", file=sys.stderr)
-print(f"INFO [API Gateway Startup]: BASE_URL_GATEWAY = {BASE_URL_GATEWAY}", file=sys.stderr)
+# Configuração do cache de redirecionamentos (0 desativa)
+REDIRECT_CACHE_MAX_ENTRIES = int(os.getenv("REDIRECT_CACHE_MAX_ENTRIES", "10000"))
+REDIRECT_CACHE_TTL = float(os.getenv("REDIRECT_CACHE_TTL", "300"))
+REDIRECT_CACHE_NEGATIVE_TTL = float(os.getenv("REDIRECT_CACHE_NEGATIVE_TTL", "30"))
+# "memory" (um cache por worker) ou "shared" (uma tabela em memória compartilhada por todos os workers do host)
+REDIRECT_CACHE_BACKEND = os.getenv("REDIRECT_CACHE_BACKEND", "memory").lower()
+REDIRECT_CACHE_SHARED_PATH = os.getenv("REDIRECT_CACHE_SHARED_PATH", "")  # Vazio = default_path, resolvido no lifespan
+
+# Pipeline de cliques (agregados enviados em lote ao Redirection Service)
+CLICK_TRACKING_ENABLED = os.getenv("CLICK_TRACKING_ENABLED", "true").lower() in ("1", "true", "yes")
+CLICK_QUEUE_MAX = int(os.getenv("CLICK_QUEUE_MAX", "100000"))
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "2.0"))
+CLICK_PENDING_MAX = int(os.getenv("CLICK_PENDING_MAX", "100000"))  # Códigos aguardando envio com o sink fora do ar
+CLICK_MAX_FLUSH_ATTEMPTS = int(os.getenv("CLICK_MAX_FLUSH_ATTEMPTS", "5"))  # Tentativas por agregado antes de descartá-lo
+
+# Filtro de Bloom dos códigos emitidos: rejeita códigos inexistentes sem chamar o Redirection Service
+CODE_FILTER_ENABLED = os.getenv("CODE_FILTER_ENABLED", "true").lower() in ("1", "true", "yes")
+CODE_FILTER_CAPACITY = int(os.getenv("CODE_FILTER_CAPACITY", "1000000"))
+CODE_FILTER_FP_RATE = float(os.getenv("CODE_FILTER_FP_RATE", "0.001"))
+CODE_FILTER_MAX_BYTES = int(os.getenv("CODE_FILTER_MAX_BYTES", "0"))  # 0 = sem teto (tamanho pela capacidade/taxa)
+CODE_FILTER_SYNC_INTERVAL = float(os.getenv("CODE_FILTER_SYNC_INTERVAL", "2.0"))
+# Segundos que uma transação pode segurar um id antes do commit (lotes, importação); cada sincronização relê essa janela
+CODE_FILTER_REORDER_WINDOW = float(os.getenv("CODE_FILTER_REORDER_WINDOW", "60"))
+# Stream de criações do Redirection Service (GET /codes/stream): sem ele, o filtro não recusa nenhum código
+CODE_FILTER_STREAM_TIMEOUT = float(os.getenv("CODE_FILTER_STREAM_TIMEOUT", "30"))  # Sem nem heartbeat = conexão morta
+CODE_FILTER_STREAM_RETRY = float(os.getenv("CODE_FILTER_STREAM_RETRY", "5"))
+
+# Lotes grandes levam mais tempo que o timeout de leitura padrão
+SHORTEN_BATCH_TIMEOUT = float(os.getenv("SHORTEN_BATCH_TIMEOUT", "120"))
+
+# Cliente dos serviços internos: timeouts e limites do pool (esperar por uma conexão livre também expira)
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "1.0"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "5.0"))
+UPSTREAM_WRITE_TIMEOUT = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "5.0"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "1.0"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "5.0"))
+
+# Resiliência por upstream: circuit breaker, retries com budget e requisições hedged
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "1"))  # Só chamadas idempotentes (GET)
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.02"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("RETRY_BUDGET_MIN_PER_SEC", "5"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "5"))
+
+# Limite por cliente (token bucket por IP ou pelo cabeçalho RATE_LIMIT_KEY_HEADER), por classe de rota.
+# Taxa em requisições por segundo; 0 desativa a classe. Os limites valem por processo (worker).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_SHORTEN_RATE = float(os.getenv("RATE_LIMIT_SHORTEN_RATE", "5"))
+RATE_LIMIT_SHORTEN_BURST = float(os.getenv("RATE_LIMIT_SHORTEN_BURST", "20"))
+RATE_LIMIT_BATCH_COST = float(os.getenv("RATE_LIMIT_BATCH_COST", "10"))  # Fichas de shorten cobradas por lote
+RATE_LIMIT_REDIRECT_RATE = float(os.getenv("RATE_LIMIT_REDIRECT_RATE", "50"))
+RATE_LIMIT_REDIRECT_BURST = float(os.getenv("RATE_LIMIT_REDIRECT_BURST", "200"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))  # Buckets guardados por classe
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "")  # Só com um proxy que autentique o cabeçalho
+RATE_LIMIT_FORWARDED_HOPS = int(os.getenv("RATE_LIMIT_FORWARDED_HOPS", "0"))  # Proxies confiáveis no X-Forwarded-For
+# Load shedding: chamadas aos serviços da classe em andamento acima disso recebem 503 na hora (0 desativa)
+LOAD_SHED_MAX_INFLIGHT_SHORTEN = int(os.getenv("LOAD_SHED_MAX_INFLIGHT_SHORTEN", "0"))
+LOAD_SHED_MAX_INFLIGHT_REDIRECT = int(os.getenv("LOAD_SHED_MAX_INFLIGHT_REDIRECT", "0"))
+
+# Cache-Control dos redirecionamentos, pela política de cada link (ver _redirect_response)
+REDIRECT_CACHEABLE_MAX_AGE = int(os.getenv("REDIRECT_CACHEABLE_MAX_AGE", "300"))
+REDIRECT_PERMANENT_MAX_AGE = int(os.getenv("REDIRECT_PERMANENT_MAX_AGE", "31536000"))
+REDIRECT_PERMANENT_STATUS = int(os.getenv("REDIRECT_PERMANENT_STATUS", "301"))  # 301 ou 308 (mantém o método)
+# Purge na CDN: URL com {short_code} chamada pelo POST /api/admin/purge/{short_code} (vazio = só o cache local)
+CDN_PURGE_URL = os.getenv("CDN_PURGE_URL", "")
+CDN_PURGE_METHOD = os.getenv("CDN_PURGE_METHOD", "PURGE")
+
+PERMANENT_CACHE_HEADERS = {"Cache-Control": f"public, max-age={REDIRECT_PERMANENT_MAX_AGE}, immutable"}
+
+logger.info(f"[API Gateway Startup]: SHORTENING_SERVICE_URL = {SHORTENING_SERVICE_URL}")
+logger.info(f"[API Gateway Startup]: REDIRECTION_SERVICE_URL = {REDIRECTION_SERVICE_URL}")
+logger.info(f"[API Gateway Startup]: BASE_URL_GATEWAY = {BASE_URL_GATEWAY}")
 
 if not SHORTENING_SERVICE_URL or not REDIRECTION_SERVICE_URL or not BASE_URL_GATEWAY:
-    print("ERRO CRÍTICO [API Gateway Startup]: URLs de serviço ou BASE_URL não configuradas!", file=sys.stderr)
+    logger.critical("[API Gateway Startup]: URLs de serviço ou BASE_URL não configuradas!")
     # Em produção, você pode querer lançar um erro para impedir a inicialização:
     # raise ValueError("Variáveis de ambiente essenciais não configuradas para API Gateway")
 
+def build_admission_control() -> AdmissionControl:
+    """Limiters e shedders configurados por variáveis de ambiente (classes com 0 ficam de fora)."""
+    limiters = {}
+    if RATE_LIMIT_ENABLED:
+        for route_class, rate, burst in (
+            ("shorten", RATE_LIMIT_SHORTEN_RATE, RATE_LIMIT_SHORTEN_BURST),
+            ("redirect", RATE_LIMIT_REDIRECT_RATE, RATE_LIMIT_REDIRECT_BURST),
+        ):
+            if rate > 0:
+                limiters[route_class] = TokenBucketLimiter(rate, max(burst, 1.0), max_clients=RATE_LIMIT_MAX_CLIENTS)
+    shedders = {
+        route_class: LoadShedder(max_inflight)
+        for route_class, max_inflight in (
+            ("shorten", LOAD_SHED_MAX_INFLIGHT_SHORTEN),
+            ("redirect", LOAD_SHED_MAX_INFLIGHT_REDIRECT),
+        )
+        if max_inflight > 0
+    }
+    return AdmissionControl(
+        limiters,
+        shedders,
+        key_header=RATE_LIMIT_KEY_HEADER,
+        forwarded_hops=RATE_LIMIT_FORWARDED_HOPS,
+        batch_cost=RATE_LIMIT_BATCH_COST,
+    )
+
+
+def install_http_client(app: FastAPI, transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """
+    Cria o cliente dos serviços internos (métricas + política de resiliência) e o
+    coloca em app.state. `transport` substitui a rede (ex.: apps ASGI no mesmo processo).
+    """
+    names = upstream.upstream_names(
+        shortening_service=SHORTENING_SERVICE_URL,
+        redirection_service=REDIRECTION_SERVICE_URL,
+        cdn=CDN_PURGE_URL,
+    )
+    instrumented = upstream.InstrumentedTransport(
+        names,
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+    )
+    resilient = upstream.ResilientTransport(
+        instrumented,
+        names,
+        breaker_enabled=CIRCUIT_BREAKER_ENABLED,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+        max_retries=UPSTREAM_MAX_RETRIES,
+        retry_backoff=UPSTREAM_RETRY_BACKOFF,
+        budget_ratio=RETRY_BUDGET_RATIO,
+        budget_min_per_second=RETRY_BUDGET_MIN_PER_SEC,
+        hedge_enabled=HEDGE_ENABLED,
+        hedge_percentile=HEDGE_PERCENTILE,
+        hedge_min_delay=HEDGE_MIN_DELAY_MS / 1000,
+    )
+    app.state.upstream = resilient
+    app.state.http_client = httpx.AsyncClient(
+        transport=resilient,
+        timeout=httpx.Timeout(
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            read=UPSTREAM_READ_TIMEOUT,
+            write=UPSTREAM_WRITE_TIMEOUT,
+            pool=UPSTREAM_POOL_TIMEOUT,
+        ),
+    )
+    upstream.HTTPX_POOL.set_function(resilient.pool_stats)
+    upstream.UPSTREAM_CIRCUIT_STATE.set_function(resilient.circuit_states)
+    return app.state.http_client
+
+
 # Lifespan manager para o cliente HTTPX
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("INFO [API Gateway Lifespan]: Criando cliente HTTPX...", file=sys.stderr)
-    app.state.http_client = httpx.AsyncClient()
-    print("INFO [API Gateway Lifespan]: Cliente HTTPX criado.", file=sys.stderr)
+    logger.info("[API Gateway Lifespan]: Criando cliente HTTPX...")
+    install_http_client(app)
+    logger.info("[API Gateway Lifespan]: Cliente HTTPX criado.")
+    if REDIRECT_CACHE_BACKEND == "shared" and REDIRECT_CACHE_MAX_ENTRIES > 0:
+        app.state.redirect_cache = SharedRedirectCache(
+            REDIRECT_CACHE_SHARED_PATH or default_path("ushorter-gateway-cache"),
+            max_entries=REDIRECT_CACHE_MAX_ENTRIES,
+            ttl=REDIRECT_CACHE_TTL,
+            negative_ttl=REDIRECT_CACHE_NEGATIVE_TTL,
+        )
+    else:
+        app.state.redirect_cache = RedirectCache(
+            max_entries=REDIRECT_CACHE_MAX_ENTRIES,
+            ttl=REDIRECT_CACHE_TTL,
+            negative_ttl=REDIRECT_CACHE_NEGATIVE_TTL,
+        )
+    app.state.lookup_flight = SingleFlight()
+
+    async def send_clicks(rows: list[dict]):
+        if app.state.local_services is not None:
+            return await app.state.local_services.send_clicks(rows)
+        response = await app.state.http_client.post(f"{REDIRECTION_SERVICE_URL}/clicks", json=rows)
+        response.raise_for_status()
+
+    app.state.click_pipeline = None
+    if CLICK_TRACKING_ENABLED:
+        app.state.click_pipeline = ClickPipeline(
+            send_clicks, max_queue=CLICK_QUEUE_MAX, flush_interval=CLICK_FLUSH_INTERVAL,
+            max_pending=CLICK_PENDING_MAX, max_attempts=CLICK_MAX_FLUSH_ATTEMPTS,
+        )
+        app.state.click_pipeline.start()
+
+    async def fetch_code_shards() -> list[str]:
+        if app.state.local_services is not None:
+            return await app.state.local_services.code_shards()
+        response = await app.state.http_client.get(f"{REDIRECTION_SERVICE_URL}/codes/shards")
+        response.raise_for_status()
+        return response.json()["shards"]
+
+    async def fetch_codes(shard: str, after_id: int, limit: int) -> tuple[list[str], int]:
+        if app.state.local_services is not None:
+            return await app.state.local_services.codes(shard, after_id, limit)
+        response = await app.state.http_client.get(
+            f"{REDIRECTION_SERVICE_URL}/codes", params={"shard": shard, "after_id": after_id, "limit": limit}
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["codes"], data["last_id"]
+
+    async def stream_codes():
+        if app.state.local_services is not None:
+            async for codes in app.state.local_services.code_stream():
+                yield codes
+            return
+        async with app.state.http_client.stream(
+            "GET", f"{REDIRECTION_SERVICE_URL}/codes/stream",
+            timeout=httpx.Timeout(UPSTREAM_CONNECT_TIMEOUT, read=CODE_FILTER_STREAM_TIMEOUT),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield orjson.loads(line).get("codes", [])
+
+    app.state.code_filter = None
+    if CODE_FILTER_ENABLED:
+        app.state.code_filter = CodeFilter(
+            fetch_codes,
+            fetch_code_shards,
+            capacity=CODE_FILTER_CAPACITY,
+            fp_rate=CODE_FILTER_FP_RATE,
+            max_bytes=CODE_FILTER_MAX_BYTES,
+            sync_interval=CODE_FILTER_SYNC_INTERVAL,
+            reorder_window=CODE_FILTER_REORDER_WINDOW,
+            fetch_stream=stream_codes,
+            stream_retry=CODE_FILTER_STREAM_RETRY,
+        )
+        app.state.code_filter.start()
+    logger.info(f"API Gateway: Ready {metrics.mark_startup('ready'):.3f}s after process start.")
     yield
-    print("INFO [API Gateway Lifespan]: Fechando cliente HTTPX...", file=sys.stderr)
+    if app.state.code_filter is not None:
+        await app.state.code_filter.stop()
+    if app.state.click_pipeline is not None:
+        logger.info("[API Gateway Lifespan]: Enviando cliques pendentes...")
+        await app.state.click_pipeline.stop()
+    logger.info("[API Gateway Lifespan]: Fechando cliente HTTPX...")
     await app.state.http_client.aclose()
-    print("INFO [API Gateway Lifespan]: Cliente HTTPX fechado.", file=sys.stderr)
+    logger.info("[API Gateway Lifespan]: Cliente HTTPX fechado.")
 
 # Criação da Instância FastAPI
-print("INFO [API Gateway Startup]: Criando instância FastAPI...", file=sys.stderr)
+logger.info("[API Gateway Startup]: Criando instância FastAPI...")
 app = FastAPI(
     title="µShort - API Gateway",
     description="Ponto de entrada único para o serviço µShort.",
     version="0.1.0",
     lifespan=lifespan
 )
-print("INFO [API Gateway Startup]: Instância FastAPI criada.", file=sys.stderr)
+logger.info("[API Gateway Startup]: Instância FastAPI criada.")
+
+# Modo monolito: definido por monolith/main.py antes do lifespan; None = chamadas HTTP aos serviços
+app.state.local_services = None
 
 # Configuração CORS
-print("INFO [API Gateway Startup]: Configurando CORSMiddleware...", file=sys.stderr)
+logger.info("[API Gateway Startup]: Configurando CORSMiddleware...")
 origins = [
     "https://storage.googleapis.com",
     "http://localhost:8080",
@@ -60,7 +336,13 @@ origins = [
     "http://localhost:63342",
     "http://127.0.0.1:63342",
 ]
-print(f"INFO [API Gateway Startup]: Origens CORS permitidas: {origins}", file=sys.stderr)
+logger.info(f"[API Gateway Startup]: Origens CORS permitidas: {origins}")
+
+# Rate limiting antes de qualquer rota; fica dentro do CORS para o 429 ser legível no navegador.
+# O load shedding fica nas rotas, em volta da chamada aos serviços (_call_upstream)
+app.state.admission = build_admission_control()
+if app.state.admission.limiters:
+    app.add_middleware(RateLimitMiddleware, control=app.state.admission)
 
 app.add_middleware(
     CORSMiddleware,
@@ -69,7 +351,67 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-print("INFO [API Gateway Startup]: CORSMiddleware adicionado.", file=sys.stderr)
+logger.info("[API Gateway Startup]: CORSMiddleware adicionado.")
+
+app.include_router(logs.admin_router("/api/admin"))
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Estado interno do gateway exposto como gauges (lidos só na coleta)
+CACHE_STATS = metrics.Gauge("gateway_redirect_cache", "Contadores do cache de redirecionamentos.", ("stat",))
+SINGLEFLIGHT_STATS = metrics.Gauge("gateway_singleflight", "Contadores de coalescência de lookups.", ("stat",))
+CLICK_STATS = metrics.Gauge("gateway_click_pipeline", "Contadores do pipeline de cliques.", ("stat",))
+CODE_FILTER_STATS = metrics.Gauge("gateway_code_filter", "Ocupação, memória e taxa de falsos positivos do filtro de códigos.", ("stat",))
+ADMISSION_STATS = metrics.Gauge("gateway_admission", "Buckets, recusas e requisições em andamento do rate limiting.", ("stat",))
+CDN_PURGES = metrics.Counter("gateway_cdn_purges_total", "Purges pedidos à CDN, por resultado.", ("result",))
+
+
+def _stats_collector(attribute: str):
+    def collect() -> dict:
+        component = getattr(app.state, attribute, None)
+        if component is None:
+            return {}
+        return {(key,): value for key, value in component.stats().items() if isinstance(value, (int, float))}
+    return collect
+
+
+CACHE_STATS.set_function(_stats_collector("redirect_cache"))
+SINGLEFLIGHT_STATS.set_function(_stats_collector("lookup_flight"))
+CLICK_STATS.set_function(_stats_collector("click_pipeline"))
+CODE_FILTER_STATS.set_function(_stats_collector("code_filter"))
+ADMISSION_STATS.set_function(_stats_collector("admission"))
+
+
+async def _call_upstream(request: Request, route_class: str, call: Callable[[], Awaitable]):
+    """
+    Executa a chamada aos serviços ocupando uma vaga do LoadShedder da classe.
+    Sem vaga, responde 503 com Retry-After na hora, sem I/O. Só a chamada
+    conta: hits do cache e seguidores do single-flight não ocupam vaga.
+    """
+    shedder: LoadShedder | None = request.app.state.admission.shedders.get(route_class)
+    if shedder is None:
+        return await call()
+    if not shedder.enter():
+        REJECTED.inc(route_class, "overloaded")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Service overloaded, try again later", headers={"Retry-After": "1"})
+    try:
+        return await call()
+    finally:
+        shedder.exit()
+
+
+def _remember_code(request: Request, short_url: str | None):
+    """
+    Adiciona ao filtro o código de uma URL curta recém-criada e descarta um
+    NOT_FOUND do cache para ele (ex.: código importado consultado antes de existir).
+    """
+    if not short_url:
+        return
+    short_code = short_url.rstrip("/").rsplit("/", 1)[-1]
+    request.app.state.redirect_cache.invalidate(short_code)
+    code_filter: CodeFilter | None = request.app.state.code_filter
+    if code_filter is not None:
+        code_filter.add(short_code)
 
 
 # Rotas da API
@@ -82,20 +424,33 @@ async def shorten_url_endpoint(
     request: Request,
     url_item: URLToShortenRequest
 ):
+    long_url = str(url_item.long_url)
+    local: LocalServices | None = request.app.state.local_services
+    if local is not None:
+        short_url = await _call_upstream(
+            request, "shorten", lambda: local.shorten(long_url, url_item.expires_at, url_item.redirect_policy))
+        logs.log_request("Shorten em processo", route="/api/shorten")
+        _remember_code(request, short_url)
+        # A URL curta é montada pelo serviço a partir do BASE_URL: sem nova validação na saída
+        return ORJSONResponse({"short_url": short_url}, status_code=status.HTTP_201_CREATED)
+
     client: httpx.AsyncClient = request.app.state.http_client
-    target_url = f"{SHORTENING_SERVICE_URL}/shorten"
-    print(f"INFO [API Gateway /api/shorten]: Encaminhando POST para: {target_url}", file=sys.stderr)
+    target_url = f"{SHORTENING_SERVICE_URL}/internal/shorten"
+    expires_at = url_item.expires_at.timestamp() if url_item.expires_at is not None else None
 
     try:
-        response = await client.post(
+        response = await _call_upstream(request, "shorten", lambda: client.post(
             target_url,
-            json={"long_url": str(url_item.long_url)}
-        )
-        print(f"INFO [API Gateway /api/shorten]: Resposta do Shortening Service status: {response.status_code}", file=sys.stderr)
+            content=orjson.dumps({"long_url": long_url, "expires_at": expires_at, "redirect_policy": url_item.redirect_policy}),
+            headers={"Content-Type": "application/json"},
+        ))
+        logs.log_request("Shorten encaminhado", route="/api/shorten", upstream_status=response.status_code)
         response.raise_for_status()
-        return response.json()
+        data = orjson.loads(response.content)
+        _remember_code(request, data.get("short_url"))
+        return ORJSONResponse(data, status_code=status.HTTP_201_CREATED)
     except httpx.RequestError as exc:
-        print(f"ERRO [API Gateway /api/shorten]: Falha na requisição para Shortening Service: {exc}", file=sys.stderr)
+        logger.error(f"[API Gateway /api/shorten]: Falha na requisição para Shortening Service: {exc}")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Shortening service is unavailable: {exc}"
@@ -109,43 +464,173 @@ async def shorten_url_endpoint(
                  detail = f"Shortening Service Error: {service_detail}"
         except Exception:
              pass
-        print(f"ERRO [API Gateway /api/shorten]: Shortening Service retornou status {status_code}: {detail}", file=sys.stderr)
+        logger.error(f"[API Gateway /api/shorten]: Shortening Service retornou status {status_code}: {detail}")
         raise HTTPException(status_code=status_code, detail=detail)
 
 
-@app.get("/{short_code}")
-async def redirect_endpoint(
-    request: Request,
-    short_code: str
-):
+@app.post("/api/shorten/batch")
+async def shorten_batch_endpoint(request: Request):
+    """
+    Encaminha um lote (lista JSON ou NDJSON) para o Shortening Service.
+    O corpo é repassado sem decodificação; a resposta só é lida para registrar
+    os códigos criados (filtro e cache negativo, ver _remember_code).
+    """
+    local: LocalServices | None = request.app.state.local_services
+    if local is not None:
+        batch = await _call_upstream(request, "shorten", lambda: local.shorten_batch(request))
+        for result in orjson.loads(batch.body)["results"]:
+            _remember_code(request, result.get("short_url"))
+        return batch
+
     client: httpx.AsyncClient = request.app.state.http_client
-    target_url = f"{REDIRECTION_SERVICE_URL}/lookup/{short_code}"
-    print(f"INFO [API Gateway /{short_code}]: Encaminhando GET para: {target_url}", file=sys.stderr)
+    target_url = f"{SHORTENING_SERVICE_URL}/shorten/batch"
+    body = await request.body()
+
+    try:
+        response = await _call_upstream(request, "shorten", lambda: client.post(
+            target_url,
+            content=body,
+            headers={"Content-Type": request.headers.get("content-type", "application/json")},
+            timeout=SHORTEN_BATCH_TIMEOUT,
+        ))
+    except httpx.RequestError as exc:
+        logger.error(f"[API Gateway /api/shorten/batch]: Falha na requisição para Shortening Service: {exc}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Shortening service is unavailable: {exc}"
+        )
+    logs.log_request("Lote encaminhado ao Shortening Service", route="/api/shorten/batch", upstream_status=response.status_code)
+    if response.status_code == 200:
+        for result in orjson.loads(response.content).get("results", []):
+            _remember_code(request, result.get("short_url"))
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json"),
+    )
+
+
+@app.get("/api/cache/stats")
+async def cache_stats(request: Request):
+    """Contadores do cache de redirecionamentos."""
+    return request.app.state.redirect_cache.stats()
+
+
+@app.get("/api/clicks/stats")
+async def click_stats(request: Request):
+    """Contadores do pipeline de cliques (fila, descartes, flushes)."""
+    pipeline: ClickPipeline | None = request.app.state.click_pipeline
+    if pipeline is None:
+        return {"enabled": False}
+    return {"enabled": True, **pipeline.stats()}
+
+
+@app.get("/api/upstream/stats")
+async def upstream_stats(request: Request):
+    """Estado do circuit breaker, fichas do retry budget e atraso de hedge de cada upstream."""
+    return request.app.state.upstream.stats()
+
+
+@app.get("/api/code-filter/stats")
+async def code_filter_stats(request: Request):
+    """Ocupação, memória e taxa estimada de falsos positivos do filtro de códigos."""
+    code_filter: CodeFilter | None = request.app.state.code_filter
+    if code_filter is None:
+        return {"enabled": False}
+    return {"enabled": True, **code_filter.stats()}
+
+
+@app.get("/api/singleflight/stats")
+async def singleflight_stats(request: Request):
+    """Contadores de coalescência dos lookups concorrentes."""
+    return request.app.state.lookup_flight.stats()
+
+
+@app.get("/api/ratelimit/stats")
+async def ratelimit_stats(request: Request):
+    """Buckets por classe de rota, requisições recusadas (429/503) e em andamento."""
+    admission: AdmissionControl = request.app.state.admission
+    return {"enabled": admission.enabled, **admission.stats()}
+
+
+@app.post("/api/admin/purge/{short_code}")
+async def purge_endpoint(request: Request, short_code: str, x_admin_token: str | None = Header(None)):
+    """
+    Tira um link do cache do gateway e, com CDN_PURGE_URL, da CDN (ex.: depois de
+    editá-lo ou apagá-lo no banco). Cada worker tem o próprio cache em memória; o
+    backend shared é limpo para todos. Um 301 já guardado por um navegador não é alcançado.
+    """
+    if not logs.ADMIN_TOKEN or x_admin_token != logs.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    request.app.state.redirect_cache.invalidate(short_code)
+    if not CDN_PURGE_URL:
+        return {"short_code": short_code, "cdn": None}
+
+    client: httpx.AsyncClient = request.app.state.http_client
+    try:
+        response = await client.request(CDN_PURGE_METHOD, CDN_PURGE_URL.format(short_code=short_code))
+    except httpx.RequestError as exc:
+        CDN_PURGES.inc("error")
+        logger.error(f"[API Gateway /api/admin/purge]: Falha no purge da CDN: {exc}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"CDN purge failed: {exc}")
+    # 404: a CDN não tinha o link guardado, o que também serve
+    if response.status_code >= 400 and response.status_code != status.HTTP_404_NOT_FOUND:
+        CDN_PURGES.inc("error")
+        logger.error(f"[API Gateway /api/admin/purge]: CDN retornou status {response.status_code} para {short_code}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail=f"CDN purge failed (status {response.status_code})")
+    CDN_PURGES.inc("ok")
+    logs.log_request("Purge na CDN", short_code=short_code, upstream_status=response.status_code)
+    return {"short_code": short_code, "cdn": response.status_code}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas do gateway no formato texto do Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# (URL longa, expiração em epoch ou None, política de redirecionamento ou None), como guardado no cache
+Mapping = tuple[str, float | None, str | None]
+
+
+async def _lookup_long_url(client: httpx.AsyncClient, cache: RedirectCache, short_code: str) -> Mapping:
+    """Consulta o Redirection Service e atualiza o cache; erros viram HTTPException."""
+    # Contrato interno: URL em texto puro no corpo, expiração (epoch) em X-Expires-At e
+    # política em X-Redirect-Policy (ausente = temporary), sem JSON
+    target_url = f"{REDIRECTION_SERVICE_URL}/internal/lookup/{short_code}"
 
     try:
         response_lookup = await client.get(target_url)
-        print(f"INFO [API Gateway /{short_code}]: Resposta do Redirection Service status: {response_lookup.status_code}", file=sys.stderr)
+        logs.log_request("Lookup no Redirection Service", short_code=short_code, upstream_status=response_lookup.status_code)
         response_lookup.raise_for_status()
-        data = response_lookup.json()
-        long_url = data.get("long_url")
+        long_url = response_lookup.text
 
         if not long_url:
-             print(f"ERRO [API Gateway /{short_code}]: Redirection Service não retornou URL longa válida.", file=sys.stderr)
+             logger.error(f"[API Gateway /{short_code}]: Redirection Service não retornou URL longa válida.")
              raise HTTPException(status_code=500, detail="Redirection service did not return a valid URL")
 
-        print(f"INFO [API Gateway /{short_code}]: Redirecionando para {long_url}", file=sys.stderr)
-        from fastapi.responses import RedirectResponse
-        return RedirectResponse(url=long_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+        # A entrada nunca vive além da expiração do link
+        expires_header = response_lookup.headers.get("x-expires-at")
+        expires_at = float(expires_header) if expires_header else None
+        mapping = (long_url, expires_at, response_lookup.headers.get("x-redirect-policy"))
+        cache.set(short_code, mapping, ttl=None if expires_at is None else min(cache.ttl, expires_at - time.time()))
+        return mapping
     except httpx.RequestError as exc:
-        print(f"ERRO [API Gateway /{short_code}]: Falha na requisição para Redirection Service: {exc}", file=sys.stderr)
+        logger.error(f"[API Gateway /{short_code}]: Falha na requisição para Redirection Service: {exc}")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Redirection service is unavailable: {exc}"
         )
     except httpx.HTTPStatusError as exc:
         if exc.response.status_code == status.HTTP_404_NOT_FOUND:
-            print(f"INFO [API Gateway /{short_code}]: Código não encontrado pelo Redirection Service.", file=sys.stderr)
+            logs.log_request("Código não encontrado pelo Redirection Service", short_code=short_code)
+            cache.set_not_found(short_code)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short URL not found")
+        elif exc.response.status_code == status.HTTP_410_GONE:
+            logs.log_request("Link expirado", short_code=short_code)
+            cache.set_gone(short_code)
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="Short URL has expired")
         else:
             status_code = exc.response.status_code
             detail = f"Error from redirection service (status {status_code})"
@@ -155,12 +640,97 @@ async def redirect_endpoint(
                     detail = f"Redirection Service Error: {service_detail}"
             except Exception:
                 pass
-            print(f"ERRO [API Gateway /{short_code}]: Redirection Service retornou status {status_code}: {detail}", file=sys.stderr)
+            logger.error(f"[API Gateway /{short_code}]: Redirection Service retornou status {status_code}: {detail}")
             raise HTTPException(status_code=status_code, detail=detail)
 
+
+async def _lookup_long_url_local(local: LocalServices, cache: RedirectCache, short_code: str) -> Mapping:
+    """Modo monolito: mesma lógica do /lookup do Redirection Service, sem a volta por HTTP."""
+    try:
+        mapping = await local.lookup(short_code)
+    except HTTPException as exc:
+        if exc.status_code == status.HTTP_404_NOT_FOUND:
+            cache.set_not_found(short_code)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short URL not found")
+        if exc.status_code == status.HTTP_410_GONE:
+            cache.set_gone(short_code)
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="Short URL has expired")
+        raise
+    expires_at = mapping[1]
+    cache.set(short_code, mapping, ttl=None if expires_at is None else min(cache.ttl, expires_at - time.time()))
+    return mapping
+
+
+def _redirect_response(mapping: Mapping) -> RedirectResponse:
+    """
+    Redirecionamento com o Cache-Control da política do link. Um redirecionamento
+    servido por um cache (CDN ou navegador) não passa pelo gateway nem conta clique.
+      * temporary: 307 sem Cache-Control (nada guarda o redirecionamento);
+      * cacheable: 307 com `public, max-age` de até REDIRECT_CACHEABLE_MAX_AGE,
+        nunca além da expiração do link (a CDN pode ser limpa pelo purge);
+      * permanent: REDIRECT_PERMANENT_STATUS (301/308) com max-age longo e
+        `immutable`. O navegador guarda o 301 sem volta: nenhum purge o alcança.
+    """
+    long_url, expires_at, policy = mapping
+    if policy == "permanent" and expires_at is None:
+        return RedirectResponse(url=long_url, status_code=REDIRECT_PERMANENT_STATUS, headers=PERMANENT_CACHE_HEADERS)
+    if policy in ("cacheable", "permanent"):  # permanent com expiração (ex.: editado no banco) vira cacheable
+        max_age = REDIRECT_CACHEABLE_MAX_AGE
+        if expires_at is not None:
+            max_age = min(max_age, int(expires_at - time.time()))
+        if max_age > 0:
+            return RedirectResponse(url=long_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+                                    headers={"Cache-Control": f"public, max-age={max_age}"})
+    return RedirectResponse(url=long_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+
+def _record_click(request: Request, short_code: str):
+    """Enfileira o clique; nunca aguarda a escrita no banco."""
+    pipeline: ClickPipeline | None = request.app.state.click_pipeline
+    if pipeline is not None:
+        pipeline.record(short_code)
+
+
+@app.get("/{short_code}")
+async def redirect_endpoint(
+    request: Request,
+    short_code: str
+):
+    cache: RedirectCache = request.app.state.redirect_cache
+    cached = cache.get(short_code)
+    if cached is RedirectCache.NOT_FOUND:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short URL not found")
+    if cached is RedirectCache.GONE:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Short URL has expired")
+    if cached is not None:
+        _record_click(request, short_code)
+        return _redirect_response(cached)
+
+    code_filter: CodeFilter | None = request.app.state.code_filter
+    if code_filter is not None and not code_filter.might_exist(short_code):
+        # Código nunca emitido (scanners, erros de digitação): 404 sem I/O
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short URL not found")
+
+    flight: SingleFlight = request.app.state.lookup_flight
+    local: LocalServices | None = request.app.state.local_services
+    # Requisições simultâneas para o mesmo código compartilham uma única chamada (e uma vaga do shedder)
+    if local is not None:
+        mapping = await flight.do(short_code, lambda: _call_upstream(
+            request, "redirect", lambda: _lookup_long_url_local(local, cache, short_code)))
+    else:
+        client: httpx.AsyncClient = request.app.state.http_client
+        mapping = await flight.do(short_code, lambda: _call_upstream(
+            request, "redirect", lambda: _lookup_long_url(client, cache, short_code)))
+
+    _record_click(request, short_code)
+    logs.log_request("Redirecionando", short_code=short_code)
+    return _redirect_response(mapping)
+
+
 @app.get("/")
 async def root():
-    print("INFO [API Gateway /]: Rota raiz acessada.", file=sys.stderr)
+    logs.log_request("Rota raiz acessada")
     return {"message": "Welcome to µShort API Gateway!"}
 
-print("INFO [API Gateway Startup]: Módulo main.py carregado e rotas definidas.", file=sys.stderr)
\ No newline at end of file
+logger.info(f"[API Gateway Startup]: Módulo main.py carregado e rotas definidas "
+            f"({metrics.mark_startup('imported'):.3f}s após o início do processo).")
\ No newline at end of file
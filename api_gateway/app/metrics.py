@@ -0,0 +1,244 @@
+import bisect
+import functools
+import os
+import time
+from typing import Callable
+
+# Métricas em processo no formato texto do Prometheus (cada serviço tem sua cópia deste módulo).
+# Registrar um valor custa uma busca em dict e alguns incrementos, então pode ficar ligado em produção.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico com labels posicionais."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge com valores definidos via set() ou lidos na hora da coleta por uma
+    função que retorna {labelvalues: valor}.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 collect: Callable[[], dict] | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._collect = collect
+        _registry.append(self)
+
+    def set(self, value: float, *labelvalues):
+        self._values[labelvalues] = value
+
+    def set_function(self, collect: Callable[[], dict]):
+        self._collect = collect
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        values = dict(self._values)
+        if self._collect is not None:
+            try:
+                values.update(self._collect())
+            except Exception:
+                pass  # A coleta nunca deve quebrar o /metrics
+        for labelvalues, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Histograma com buckets fixos; contagens por bucket acumuladas só na renderização."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # labelvalues -> [contagens por bucket..., +Inf, soma]
+        _registry.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labelvalues) -> "_Timer":
+        """Context manager que observa a duração do bloco em segundos."""
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues) -> int:
+        series = self._series.get(labelvalues)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labelvalues", "_start")
+
+    def __init__(self, histogram: Histogram, labelvalues: tuple):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labelvalues)
+        return False
+
+
+def timed(histogram: Histogram, *labelvalues):
+    """Decorator para funções async: observa a duração de cada chamada no histograma."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labelvalues)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    """Todas as métricas registradas no formato texto do Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Métricas HTTP comuns a todos os serviços ---
+HTTP_REQUESTS = Counter("http_requests_total", "Requisições HTTP recebidas.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Latência das requisições HTTP.", ("method", "route", "status"))
+
+# --- Tempo de startup ---
+# Segundos desde o início do processo (no container, o próprio start) até cada fase:
+# "imported" (módulos carregados), "ready" (lifespan concluído) e "first_request"
+# (primeira resposta com status < 400, marcada pelo MetricsMiddleware).
+STARTUP = Gauge("process_startup_seconds", "Segundos desde o início do processo até cada fase do startup.", ("phase",))
+_IMPORTED_AT = time.monotonic()
+
+
+def process_uptime() -> float:
+    """Idade do processo pelo /proc (Linux); fora dele, desde a importação deste módulo."""
+    try:
+        with open("/proc/self/stat") as f:
+            # O nome do processo (campo 2) pode ter espaços; os campos seguintes vêm após o ")"
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+def mark_startup(phase: str) -> float:
+    """Registra a fase (só a primeira vez) e retorna os segundos desde o início do processo."""
+    if (phase,) not in STARTUP._values:
+        STARTUP.set(round(process_uptime(), 3), phase)
+    return STARTUP._values[(phase,)]
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que registra contagem e latência por rota (template, não o
+    caminho real, para não criar uma série por código curto) e status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._first_request_seen = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            labels = (scope["method"], route_path, str(status_holder[0]))
+            HTTP_REQUESTS.inc(*labels)
+            HTTP_LATENCY.observe(time.perf_counter() - start, *labels)
+            if not self._first_request_seen and status_holder[0] < 400:
+                self._first_request_seen = True
+                mark_startup("first_request")
+
+
+def sqlalchemy_pool_stats(engine) -> dict:
+    """Leitura do pool da engine SQLAlchemy para um Gauge com label 'state'."""
+    pool = engine.pool
+    return {
+        ("size",): pool.size(),
+        ("checked_in",): pool.checkedin(),
+        ("checked_out",): pool.checkedout(),
+        ("overflow",): pool.overflow(),
+    }
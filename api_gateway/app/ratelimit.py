@@ -0,0 +1,215 @@
+import math
+import time
+
+import orjson
+
+from . import metrics
+
+REJECTED = metrics.Counter(
+    "gateway_admission_rejected_total",
+    "Requisições recusadas na entrada do gateway (429 = limite do cliente, 503 = sobrecarga).",
+    ("route_class", "reason"),
+)
+
+# Caminhos de um segmento que não são redirecionamentos
+EXEMPT_PATHS = frozenset(("/", "/metrics", "/docs", "/redoc", "/openapi.json"))
+
+
+class TokenBucketLimiter:
+    """
+    Um token bucket por cliente: `rate` fichas por segundo, até `burst` acumuladas.
+
+    Os buckets ficam em `shards` dicts (pelo hash da chave), cada um em ordem de
+    último uso (a chave é reinserida a cada acesso). Assim, o bucket parado há
+    mais tempo de um shard é sempre o primeiro: a cada chamada ele é removido se
+    já teria se enchido de novo (remover não muda nada para o cliente), e, com o
+    shard cheio, um cliente novo tira o lugar dele. A memória fica limitada a
+    `max_clients` buckets sem varredura em segundo plano.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 100000, shards: int = 16):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._idle_after = burst / rate  # Tempo para um bucket vazio se encher
+        self._shard_capacity = max(1, math.ceil(max_clients / shards))
+        self._shards: list[dict] = [{} for _ in range(shards)]
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def acquire(self, key: str, cost: float = 1.0, now: float | None = None) -> float:
+        """Consome `cost` fichas; retorna 0.0 se a requisição entra, senão os segundos até haver fichas."""
+        if now is None:
+            now = time.monotonic()
+        cost = min(cost, self.burst)  # Um custo acima do burst nunca passaria
+        shard = self._shards[hash(key) % len(self._shards)]
+        bucket = shard.pop(key, None)
+        if bucket is None:
+            if len(shard) >= self._shard_capacity:
+                del shard[next(iter(shard))]
+                self.evictions += 1
+            tokens = self.burst
+            bucket = [tokens, now]
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        shard[key] = bucket
+        oldest = next(iter(shard))
+        if now - shard[oldest][1] >= self._idle_after:
+            del shard[oldest]
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            self.allowed += 1
+            return 0.0
+        bucket[0] = tokens
+        self.limited += 1
+        return (cost - tokens) / self.rate
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "clients": len(self),
+            "max_clients": self.max_clients,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evictions": self.evictions,
+        }
+
+
+class LoadShedder:
+    """
+    Conta as chamadas aos serviços em andamento e recusa as novas acima de
+    `max_inflight`. A vaga é ocupada só em volta da chamada (ver
+    main._call_upstream): hits do cache e lookups coalescidos não contam.
+    """
+
+    def __init__(self, max_inflight: int):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.peak = 0
+        self.shed = 0
+
+    def enter(self) -> bool:
+        if self.inflight >= self.max_inflight:
+            self.shed += 1
+            return False
+        self.inflight += 1
+        if self.inflight > self.peak:
+            self.peak = self.inflight
+        return True
+
+    def exit(self):
+        self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {"max_inflight": self.max_inflight, "inflight": self.inflight, "peak": self.peak, "shed": self.shed}
+
+
+class AdmissionControl:
+    """
+    Limiters e shedders por classe de rota: "shorten" (POST /api/shorten e
+    /api/shorten/batch) e "redirect" (GET /{short_code}). Os limiters são
+    aplicados na entrada pelo RateLimitMiddleware; os shedders, pelas rotas, em
+    volta da chamada aos serviços. Classes sem limiter/shedder passam direto.
+
+    O cliente é o valor do cabeçalho `key_header` (ex.: uma API key já
+    autenticada por um proxy na frente) ou o IP. Com `forwarded_hops` > 0, o IP
+    vem do X-Forwarded-For, na posição acrescentada pelo proxy mais externo
+    confiável (as anteriores podem ter sido forjadas pelo cliente).
+    """
+
+    def __init__(self, limiters: dict[str, TokenBucketLimiter], shedders: dict[str, LoadShedder],
+                 key_header: str = "", forwarded_hops: int = 0, batch_cost: float = 1.0):
+        self.limiters = limiters
+        self.shedders = shedders
+        self._key_header = key_header.lower().encode()
+        self._forwarded_hops = forwarded_hops
+        self.batch_cost = batch_cost
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limiters or self.shedders)
+
+    @staticmethod
+    def classify(method: str, path: str) -> str | None:
+        if method == "GET":
+            if path.count("/") == 1 and path not in EXEMPT_PATHS:
+                return "redirect"
+        elif method == "POST" and path in ("/api/shorten", "/api/shorten/batch"):
+            return "shorten"
+        return None
+
+    def client_key(self, scope) -> str:
+        forwarded = None
+        for name, value in scope["headers"]:
+            if self._key_header and name == self._key_header:
+                return "key:" + value.decode("latin-1")
+            if self._forwarded_hops and name == b"x-forwarded-for":
+                forwarded = value
+        if forwarded is not None:
+            hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",")]
+            return "ip:" + hops[max(0, len(hops) - self._forwarded_hops)]
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    def stats(self) -> dict:
+        """Contadores achatados ("<classe>_<contador>"), prontos para um Gauge."""
+        result = {}
+        for route_class, limiter in self.limiters.items():
+            result.update({f"{route_class}_{key}": value for key, value in limiter.stats().items()})
+        for route_class, shedder in self.shedders.items():
+            result.update({f"{route_class}_{key}": value for key, value in shedder.stats().items()})
+        return result
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que aplica os limiters do AdmissionControl antes de
+    qualquer rota (e, portanto, antes de qualquer chamada aos serviços).
+    Responde 429 com Retry-After na hora, sem ler o corpo, quando o cliente
+    esgotou suas fichas.
+    """
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        control = self.control
+        path = scope["path"]
+        route_class = control.classify(scope["method"], path)
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = control.limiters.get(route_class)
+        if limiter is not None:
+            cost = control.batch_cost if path == "/api/shorten/batch" else 1.0
+            wait = limiter.acquire(control.client_key(scope), cost)
+            if wait:
+                REJECTED.inc(route_class, "rate_limited")
+                await _reject(send, 429, "Too many requests", wait)
+                return
+        await self.app(scope, receive, send)
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    Agrupa chamadas concorrentes com a mesma chave: enquanto uma busca está
+    em andamento, as demais aguardam o mesmo resultado em vez de repeti-la.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.leaders = 0  # Chamadas que realmente executaram a busca
+        self.coalesced = 0  # Chamadas que reaproveitaram uma busca em andamento
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Executa fn() uma única vez por chave em andamento; exceções também são compartilhadas."""
+        future = self._inflight.get(key)
+        while future is not None:
+            self.coalesced += 1
+            try:
+                # shield: o cancelamento de um seguidor não cancela a busca dos demais
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # O próprio seguidor foi cancelado
+                # A busca líder foi cancelada: tenta de novo (possivelmente como líder)
+                future = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Evita o aviso "exception was never retrieved" quando não há seguidores
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,346 @@
+import asyncio
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import metrics
+
+UPSTREAM_LATENCY = metrics.Histogram(
+    "gateway_upstream_request_duration_seconds",
+    "Latência das chamadas do gateway aos serviços internos.",
+    ("upstream", "method", "status"),
+)
+HTTPX_POOL = metrics.Gauge(
+    "gateway_httpx_pool_connections",
+    "Conexões do pool do httpx.AsyncClient por estado.",
+    ("state",),
+)
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transporte httpx que mede cada chamada ao upstream (inclusive falhas de conexão)."""
+
+    def __init__(self, upstream_names: dict[str, str], transport: httpx.AsyncBaseTransport | None = None,
+                 **transport_kwargs):
+        self._transport = transport if transport is not None else httpx.AsyncHTTPTransport(**transport_kwargs)
+        self._upstream_names = upstream_names  # netloc -> nome do serviço
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        upstream = self._upstream_names.get(request.url.netloc.decode(), request.url.host)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream, request.method, status)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def pool_stats(self) -> dict:
+        """Conexões ativas/ociosas do pool do httpcore (atributo interno, lido só na coleta)."""
+        if not isinstance(self._transport, httpx.AsyncHTTPTransport):
+            return {}
+        connections = list(getattr(self._transport, "_pool").connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {("idle",): idle, ("active",): len(connections) - idle}
+
+
+def upstream_names(**service_urls: str | None) -> dict[str, str]:
+    """Mapeia o host:porta de cada serviço interno para o seu nome (label das métricas)."""
+    return {urlsplit(url).netloc: name for name, url in service_urls.items() if url}
+
+
+UPSTREAM_CIRCUIT_STATE = metrics.Gauge(
+    "gateway_upstream_circuit_state",
+    "Estado do circuit breaker por upstream (0 = fechado, 1 = meio-aberto, 2 = aberto).",
+    ("upstream",),
+)
+UPSTREAM_CIRCUIT_REJECTIONS = metrics.Counter(
+    "gateway_upstream_circuit_rejections_total",
+    "Chamadas recusadas na hora porque o circuito do upstream estava aberto.",
+    ("upstream",),
+)
+UPSTREAM_RETRIES = metrics.Counter(
+    "gateway_upstream_retries_total",
+    "Novas tentativas de chamadas idempotentes (sent) e as negadas pelo retry budget (budget_exhausted).",
+    ("upstream", "outcome"),
+)
+UPSTREAM_HEDGES = metrics.Counter(
+    "gateway_upstream_hedges_total",
+    "Requisições hedged: cópias enviadas (sent), cópias que responderam primeiro (won) e negadas pelo budget.",
+    ("upstream", "outcome"),
+)
+
+# Métodos seguros para repetir ou duplicar (o POST /clicks, por exemplo, soma contadores)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Respostas que indicam upstream indisponível (contam como falha no breaker e podem ser repetidas)
+RETRYABLE_STATUS = frozenset({502, 503, 504})
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Chamada recusada sem I/O: o circuito do upstream está aberto."""
+
+
+class CircuitBreaker:
+    """
+    Abre após failure_threshold falhas seguidas e recusa chamadas por
+    reset_timeout segundos; depois deixa passar uma única chamada de teste
+    (meio-aberto), que fecha o circuito se der certo ou o reabre se falhar.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half_open", OPEN: "open"}
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Chamada abandonada sem resultado (cópia hedged perdedora): libera a vaga de teste."""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.STATE_NAMES[self.state],
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class RetryBudget:
+    """
+    Limita novas tentativas (e cópias hedged) a uma fração das requisições:
+    cada requisição deposita `ratio` fichas, cada tentativa extra gasta uma.
+    min_per_second fichas entram por segundo para permitir retries com pouco tráfego.
+    Assim um upstream lento não recebe uma tempestade de retries.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 5.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max(10.0, min_per_second * 10)
+        self.tokens = self.max_tokens
+        self._refilled_at = time.monotonic()
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LatencyTracker:
+    """Percentil das latências recentes de um upstream (janela deslizante, recalculado a cada `every` amostras)."""
+
+    def __init__(self, percentile: float = 0.95, window: int = 1000, min_samples: int = 100, every: int = 50):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._every = every
+        self._since_update = 0
+        self.value: float | None = None  # None até haver amostras suficientes
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._since_update += 1
+        if self._since_update >= self._every and len(self._samples) >= self.min_samples:
+            self._since_update = 0
+            ordered = sorted(self._samples)
+            self.value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+    Política de resiliência por upstream em volta do transporte instrumentado:
+    circuit breaker (falha rápida com CircuitOpenError), retries de chamadas
+    idempotentes limitados por um retry budget e, opcionalmente, requisições
+    hedged: se uma chamada idempotente não responder dentro do p95 recente, uma
+    segunda cópia é enviada e vale a primeira resposta.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, upstream_names: dict[str, str],
+                 breaker_enabled: bool = True, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 max_retries: int = 1, retry_backoff: float = 0.02, budget_ratio: float = 0.1,
+                 budget_min_per_second: float = 5.0, hedge_enabled: bool = False,
+                 hedge_percentile: float = 0.95, hedge_min_delay: float = 0.005):
+        self._transport = transport
+        self._upstream_names = upstream_names
+        self._breaker_enabled = breaker_enabled
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._budget_ratio = budget_ratio
+        self._budget_min_per_second = budget_min_per_second
+        self._hedge_enabled = hedge_enabled
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_delay = hedge_min_delay
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.budgets: dict[str, RetryBudget] = {}
+        self.latencies: dict[str, LatencyTracker] = {}
+
+    def _policy(self, upstream: str) -> tuple[CircuitBreaker, RetryBudget, LatencyTracker]:
+        breaker = self.breakers.get(upstream)
+        if breaker is None:
+            breaker = self.breakers[upstream] = CircuitBreaker(self._failure_threshold, self._reset_timeout)
+            self.budgets[upstream] = RetryBudget(self._budget_ratio, self._budget_min_per_second)
+            self.latencies[upstream] = LatencyTracker(self._hedge_percentile)
+        return breaker, self.budgets[upstream], self.latencies[upstream]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        upstream = self._upstream_names.get(request.url.netloc.decode(), request.url.host)
+        breaker, budget, latency = self._policy(upstream)
+        budget.deposit()
+        idempotent = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                if idempotent and self._hedge_enabled and latency.value is not None:
+                    response = await self._send_hedged(request, upstream, breaker, budget, latency)
+                else:
+                    response = await self._send(request, upstream, breaker, latency)
+            except CircuitOpenError:
+                raise
+            except httpx.TransportError:
+                if not await self._should_retry(idempotent, attempt, upstream, budget):
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS \
+                        or not await self._should_retry(idempotent, attempt, upstream, budget):
+                    return response
+                await response.aclose()
+            attempt += 1
+
+    async def _should_retry(self, idempotent: bool, attempt: int, upstream: str, budget: RetryBudget) -> bool:
+        if not idempotent or attempt >= self._max_retries:
+            return False
+        if not budget.withdraw():
+            UPSTREAM_RETRIES.inc(upstream, "budget_exhausted")
+            return False
+        UPSTREAM_RETRIES.inc(upstream, "sent")
+        # Jitter para que os retries de várias requisições não cheguem juntos
+        await asyncio.sleep(random.uniform(0, self._retry_backoff))
+        return True
+
+    async def _send(self, request: httpx.Request, upstream: str, breaker: CircuitBreaker,
+                    latency: LatencyTracker) -> httpx.Response:
+        """Uma tentativa, contabilizada no breaker e na latência do upstream."""
+        if self._breaker_enabled and not breaker.allow():
+            UPSTREAM_CIRCUIT_REJECTIONS.inc(upstream)
+            raise CircuitOpenError(f"Circuit open for upstream {upstream}", request=request)
+        start = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        if response.status_code in RETRYABLE_STATUS:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            latency.observe(time.perf_counter() - start)
+        return response
+
+    async def _send_hedged(self, request: httpx.Request, upstream: str, breaker: CircuitBreaker,
+                           budget: RetryBudget, latency: LatencyTracker) -> httpx.Response:
+        tasks = [asyncio.create_task(self._send(request, upstream, breaker, latency))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(self._hedge_min_delay, latency.value))
+            # Sem cópia com o circuito meio-aberto (a chamada de teste já está em andamento) ou sem budget
+            if not done and (not self._breaker_enabled or breaker.state == CircuitBreaker.CLOSED):
+                if budget.withdraw():
+                    UPSTREAM_HEDGES.inc(upstream, "sent")
+                    tasks.append(asyncio.create_task(self._send(request, upstream, breaker, latency)))
+                else:
+                    UPSTREAM_HEDGES.inc(upstream, "budget_exhausted")
+            pending = set(tasks)
+            while winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Vale a primeira resposta; uma cópia que falhou espera pela outra
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is None and not pending:
+                    winner = done.pop()
+            if len(tasks) > 1 and winner is tasks[1] and winner.exception() is None:
+                UPSTREAM_HEDGES.inc(upstream, "won")
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    task.add_done_callback(_close_abandoned_response)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def pool_stats(self) -> dict:
+        return self._transport.pool_stats()
+
+    def circuit_states(self) -> dict:
+        return {(name,): breaker.state for name, breaker in self.breakers.items()}
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                **breaker.stats(),
+                "retry_budget_tokens": round(self.budgets[name].tokens, 2),
+                "retry_budget_exhausted": self.budgets[name].exhausted,
+                "hedge_delay": self.latencies[name].value,
+            }
+            for name, breaker in self.breakers.items()
+        }
+
+
+def _close_abandoned_response(task: asyncio.Task):
+    """Fecha a resposta de uma cópia hedged que terminou depois de perder a corrida."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    asyncio.get_running_loop().create_task(task.result().aclose())
@@ -0,0 +1,94 @@
+"""
+Redirecionamentos através de uma CDN (a LocalCDN de cdn.py) para cada política
+de cache dos links: temporary (307 sem Cache-Control), cacheable (307 com
+max-age curto) e permanent (301 com max-age longo).
+
+Para cada política, cria --keys links com ela e faz --requests redirecionamentos
+com distribuição Zipf através da CDN, que fica na frente do gateway. Mede
+throughput e latências e quantas requisições chegaram ao gateway: as servidas
+pela CDN não custam nada à origem, mas também não contam clique.
+
+Uso:
+    python benchmarks/bench_cdn.py --requests 20000 --keys 1000 --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import loadtest  # noqa: E402
+from cdn import LocalCDN  # noqa: E402
+
+POLICIES = ("temporary", "cacheable", "permanent")
+
+
+async def seed_links(client, count: int, policy: str) -> list[str]:
+    codes = []
+    for start in range(0, count, 1000):
+        items = [{"long_url": f"https://example.com/{policy}/{i}", "redirect_policy": policy}
+                 for i in range(start, min(count, start + 1000))]
+        response = await client.post("/api/shorten/batch", json=items)
+        response.raise_for_status()
+        codes.extend(result["short_url"].rsplit("/", 1)[-1] for result in response.json()["results"])
+    return codes
+
+
+async def run(gateway_app, codes: list[str], args) -> tuple[dict, LocalCDN]:
+    cdn = LocalCDN(httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway_app), base_url=harness.BASE_URL))
+    rng = random.Random(args.seed)
+    zipf = loadtest.ZipfSampler(len(codes), args.zipf_s, rng)
+    targets = [codes[zipf.sample()] for _ in range(args.requests)]
+    latencies, errors = [], 0
+    next_index = itertools.count()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cdn), base_url=harness.BASE_URL) as client:
+        async def worker():
+            nonlocal errors
+            for i in iter(lambda: next(next_index), None):
+                if i >= args.requests:
+                    return
+                started = time.perf_counter()
+                response = await client.get(f"/{targets[i]}")
+                if response.status_code in (301, 307, 308):
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return loadtest.summarize(latencies, errors, elapsed), cdn
+
+
+async def main_async(args):
+    print(f"{'política':>10} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'no gateway':>11} {'servidas pela CDN':>18} {'erros':>6}")
+    async with harness.running_stack({"CLICK_TRACKING_ENABLED": "false"}, mode=args.mode) as client:
+        gateway_app = sys.modules["bench_gateway_app.main"].app
+        for policy in POLICIES:
+            codes = await seed_links(client, args.keys, policy)
+            result, cdn = await run(gateway_app, codes, args)
+            print(f"{policy:>10} {result['throughput_rps']:>9.1f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                  f"{cdn.misses:>11} {cdn.hits / args.requests:>17.1%} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--mode", choices=harness.MODES, default="asgi")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Throughput de `POST /api/shorten` com e sem group-commit, por nível de concorrência.
+
+Cada configuração sobe a pilha do zero (ver harness.py) e executa uma carga
+só de encurtamentos. Sem group-commit cada requisição faz sua própria
+transação; com ele, requisições concorrentes dentro da janela dividem um
+único INSERT multi-linha e um único commit.
+
+Uso:
+    python benchmarks/bench_group_commit.py --requests 2000 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import loadtest  # noqa: E402
+
+
+async def run(env: dict, concurrency: int, args) -> dict:
+    workload = argparse.Namespace(
+        requests=args.requests, concurrency=concurrency, shorten_ratio=1.0, zipf_s=1.0, seed=args.seed
+    )
+    async with harness.running_stack(env) as client:
+        codes = await loadtest.seed_links(client, 10)
+        await loadtest.run_workload(client, codes, argparse.Namespace(**{**vars(workload), "requests": args.warmup}))
+        return (await loadtest.run_workload(client, codes, workload))["shorten"]
+
+
+async def main_async(args):
+    modes = {
+        "por requisição": {"SHORTEN_GROUP_COMMIT": "false"},
+        "group-commit": {
+            "SHORTEN_GROUP_COMMIT": "true",
+            "SHORTEN_GROUP_COMMIT_WINDOW_MS": str(args.window_ms),
+            "SHORTEN_GROUP_COMMIT_MAX_BATCH": str(args.max_batch),
+        },
+    }
+    print(f"{'concorrência':>12} {'modo':>15} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for concurrency in args.concurrency:
+        for mode, env in modes.items():
+            result = await run({**env, "CLICK_TRACKING_ENABLED": "false"}, concurrency, args)
+            print(f"{concurrency:>12} {mode:>15} {result['throughput_rps']:>9.1f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+CPU por requisição do contrato interno (validação única + orjson/texto puro)
+comparado ao contrato anterior (JSON da stdlib + modelos Pydantic em cada salto).
+
+Duas medições:
+
+1. Codificação: só os passos de serialização/validação de um salto
+   gateway → serviço → gateway, sem I/O (timeit).
+2. Serviço: CPU (time.process_time) por chamada aos endpoints antigos, que
+   continuam existindo (`/lookup`, `/shorten`), e aos internos
+   (`/internal/lookup`, `/internal/shorten`), pelo transporte ASGI em memória.
+
+Uso:
+    python benchmarks/bench_internal_protocol.py --requests 2000 --rounds 5
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import timeit
+
+import httpx
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+LONG_URL = "https://example.com/campanhas/2024/primavera?utm_source=newsletter&utm_medium=email&id=12345"
+
+
+def codec_steps(shortening, gateway, short_url: str) -> dict:
+    """Pares (antes, depois) de funções que fazem o trabalho de codificação de uma requisição."""
+    request_item = gateway.URLToShortenRequest(long_url=LONG_URL)
+
+    def redirect_before():
+        # Serviço serializa {"long_url", "expires_at"} em JSON; gateway decodifica
+        body = json.dumps({"long_url": LONG_URL, "expires_at": None}).encode()
+        data = json.loads(body)
+        return data["long_url"], data["expires_at"]
+
+    def redirect_after():
+        # URL em texto puro no corpo; expiração (quando houver) em cabeçalho
+        return LONG_URL.encode().decode(), None
+
+    def shorten_before():
+        body = json.dumps(request_item.model_dump(mode="json", exclude_none=True)).encode()
+        url_item = shortening.models.URLBase.model_validate(json.loads(body))
+        shortening.models.URLCreate(long_url=url_item.long_url, short_code="abc123", expires_at=url_item.expires_at)
+        service_response = shortening.models.URLShortResponse(short_url=short_url)
+        response_body = json.dumps(service_response.model_dump(mode="json")).encode()
+        data = json.loads(response_body)
+        return json.dumps(gateway.ShortenedURLResponse(**data).model_dump(mode="json"))
+
+    def shorten_after():
+        body = orjson.dumps({"long_url": str(request_item.long_url), "expires_at": None})
+        payload = orjson.loads(body)
+        shortening.models.URLCreate.model_construct(long_url=payload["long_url"], short_code="abc123", expires_at=None)
+        data = orjson.loads(orjson.dumps({"short_url": short_url}))
+        return orjson.dumps(data)
+
+    assert redirect_before() == redirect_after()
+    return {"redirect": (redirect_before, redirect_after), "shorten": (shorten_before, shorten_after)}
+
+
+async def service_cpu(client: httpx.AsyncClient, send, requests: int) -> float:
+    """CPU média (µs) por chamada, incluindo a decodificação da resposta pelo cliente."""
+    gc.collect()
+    started = time.process_time()
+    for _ in range(requests):
+        await send(client)
+    return (time.process_time() - started) / requests * 1e6
+
+
+async def main_async(args):
+    async with harness.running_stack({"REDIRECT_CACHE_MAX_ENTRIES": "0", "CLICK_TRACKING_ENABLED": "false"}) as client:
+        shortening = sys.modules["bench_shortening_app.main"]
+        redirection = sys.modules["bench_redirection_app.main"]
+        gateway = sys.modules["bench_gateway_app.main"]
+        short_url = (await client.post("/api/shorten", json={"long_url": LONG_URL})).json()["short_url"]
+        code = short_url.rsplit("/", 1)[-1]
+
+        print("1. Codificação por requisição (sem I/O)")
+        print(f"{'operação':>10} {'antes µs':>10} {'depois µs':>10} {'economia':>9}")
+        for name, (before, after) in codec_steps(shortening, gateway, short_url).items():
+            times = [min(timeit.repeat(fn, number=args.codec_loops, repeat=5)) / args.codec_loops * 1e6
+                     for fn in (before, after)]
+            print(f"{name:>10} {times[0]:>10.1f} {times[1]:>10.1f} {1 - times[1] / times[0]:>9.0%}")
+
+        async def lookup_before(c):
+            response = await c.get(f"/lookup/{code}")
+            return response.json()["long_url"]
+
+        async def lookup_after(c):
+            response = await c.get(f"/internal/lookup/{code}")
+            return response.text, response.headers.get("x-expires-at")
+
+        async def shorten_before(c):
+            response = await c.post("/shorten", json={"long_url": LONG_URL})
+            return response.json()["short_url"]
+
+        async def shorten_after(c):
+            response = await c.post("/internal/shorten", content=orjson.dumps({"long_url": LONG_URL, "expires_at": None}),
+                                    headers={"Content-Type": "application/json"})
+            return orjson.loads(response.content)["short_url"]
+
+        print(f"\n2. CPU por chamada ao serviço ({args.requests} chamadas, ASGI em memória)")
+        print(f"{'operação':>10} {'antes µs':>10} {'depois µs':>10} {'economia':>9}")
+        cases = {
+            "redirect": (redirection.app, lookup_before, lookup_after, args.requests),
+            # Domina o INSERT + commit no SQLite; a diferença de codificação aparece na medição 1
+            "shorten": (shortening.app, shorten_before, shorten_after, max(1, args.requests // 5)),
+        }
+        for name, (app, before, after, requests) in cases.items():
+            cpu = [float("inf"), float("inf")]
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service") as c:
+                # Rodadas alternadas; o mínimo descarta ruído de GC e do escalonador
+                for _ in range(args.rounds):
+                    for i, fn in enumerate((before, after)):
+                        cpu[i] = min(cpu[i], await service_cpu(c, fn, requests))
+            print(f"{name:>10} {cpu[0]:>10.1f} {cpu[1]:>10.1f} {1 - cpu[1] / cpu[0]:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--codec-loops", type=int, default=2000)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
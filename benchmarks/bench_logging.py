@@ -0,0 +1,136 @@
+"""
+Mede quanto throughput de redirecionamento o logging em fila/amostrado recupera
+em relação aos print() síncronos por requisição.
+
+Roda o API Gateway em processo (ASGI), com o Redirection Service simulado por um
+transporte httpx em memória e o cache desativado, para que cada requisição
+percorra o caminho completo do lookup. O stderr é redirecionado para um arquivo
+para que o custo medido seja o da escrita, e não o do terminal.
+
+Uso:
+    python benchmarks/bench_logging.py [--requests 8000] [--concurrency 50] [--sink pipe|file]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api_gateway"))
+os.environ.setdefault("SHORTENING_SERVICE_URL", "http://shortening")
+os.environ.setdefault("REDIRECTION_SERVICE_URL", "http://redirection")
+os.environ.setdefault("BASE_URL", "http://localhost:8000")
+os.environ["REDIRECT_CACHE_MAX_ENTRIES"] = "0"
+os.environ["CLICK_TRACKING_ENABLED"] = "false"
+
+import httpx  # noqa: E402
+
+LONG_URL = "https://www.example.com/campanha/2024/produto?utm_source=newsletter&utm_medium=email&utm_campaign=lancamento"
+
+
+def _legacy_log_request(msg: str, **fields):
+    """Reproduz o comportamento antigo: print() síncrono no stderr com a URL longa."""
+    short_code = fields.get("short_code", "")
+    if msg.startswith("Lookup"):
+        # O gateway antigo registrava também a URL de destino antes da chamada
+        print(f"INFO [API Gateway /{short_code}]: Encaminhando GET para: http://redirection/lookup/{short_code}", file=sys.stderr)
+    print(f"INFO [API Gateway /{short_code}]: {msg}: {fields} -> {LONG_URL}", file=sys.stderr)
+
+
+async def _upstream(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"long_url": LONG_URL})
+
+
+async def _run(main, requests: int, concurrency: int) -> float:
+    async with main.lifespan(main.app):
+        main.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(i: int):
+                async with semaphore:
+                    response = await client.get(f"/code{i % 1000}")
+                    assert response.status_code == 307
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests)))
+            return time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def _open_sink(kind: str):
+    """Destino do stderr: arquivo temporário ou pipe lido por outra thread (como o log driver do Docker)."""
+    if kind == "file":
+        with tempfile.TemporaryFile("w", buffering=1) as sink:
+            yield sink
+        return
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        while os.read(read_fd, 65536):
+            pass
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    with open(write_fd, "w", buffering=1) as sink:
+        yield sink
+    reader.join()
+    os.close(read_fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=100000, help="Chamadas no microbenchmark de log")
+    parser.add_argument("--sink", choices=("pipe", "file"), default="pipe")
+    args = parser.parse_args()
+
+    real_stderr = sys.stderr
+    # Line-buffered, como o stderr de um container com PYTHONUNBUFFERED=1
+    with _open_sink(args.sink) as sink:
+        sys.stderr = sink
+        try:
+            from app import logs, main as gateway_main
+
+            new_log_request = logs.log_request
+
+            # Custo isolado de uma chamada de log por requisição
+            per_call = {}
+            for mode, fn in (("legacy_print", _legacy_log_request), ("queued_sampled", new_log_request)):
+                started = time.perf_counter()
+                for i in range(args.calls):
+                    fn("Lookup no Redirection Service", short_code="abc123", upstream_status=200)
+                per_call[mode] = (time.perf_counter() - started) / args.calls * 1e6
+
+            results = {"legacy_print": 0.0, "queued_sampled": 0.0}
+            asyncio.run(_run(gateway_main, args.requests // 10, args.concurrency))  # Aquecimento
+            for _ in range(args.rounds):  # Rodadas alternadas reduzem o efeito de ruído
+                for mode in results:
+                    if mode == "legacy_print":
+                        logs.log_request = _legacy_log_request
+                    else:
+                        logs.log_request = new_log_request
+                    elapsed = asyncio.run(_run(gateway_main, args.requests, args.concurrency))
+                    results[mode] = max(results[mode], args.requests / elapsed)
+        finally:
+            sys.stderr = real_stderr
+
+    print("Custo por chamada de log:")
+    for mode, micros in per_call.items():
+        print(f"{mode:>16}: {micros:10.2f} µs")
+    print("Throughput de redirecionamento (gateway em processo, upstream simulado):")
+    for mode, rps in results.items():
+        print(f"{mode:>16}: {rps:10.1f} req/s")
+    gain = results["queued_sampled"] / results["legacy_print"] - 1
+    print(f"{'recuperado':>16}: {gain * 100:+9.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Latência de `GET /{short_code}` na topologia de microsserviços e no modo monolito.
+
+Cada modo sobe a pilha do zero (ver harness.py) com o cache de redirecionamentos
+do gateway desligado, para que todo redirecionamento passe pelo caminho
+gateway → Redirection Service:
+
+    tcp        HTTP de verdade entre o gateway e os serviços (uvicorn em portas locais)
+    asgi       HTTP em memória (mesma codificação JSON e validação, sem rede)
+    monolith   chamadas diretas, sem HTTP interno (monolith/main.py)
+
+Uso:
+    python benchmarks/bench_monolith.py --requests 3000 --concurrency 1 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import loadtest  # noqa: E402
+
+
+async def run(mode: str, concurrency: int, args) -> dict:
+    workload = argparse.Namespace(
+        requests=args.requests, concurrency=concurrency, shorten_ratio=0.0, zipf_s=args.zipf_s, seed=args.seed
+    )
+    env = {"REDIRECT_CACHE_MAX_ENTRIES": "0", "CLICK_TRACKING_ENABLED": "false"}
+    async with harness.running_stack(env, mode=mode) as client:
+        codes = await loadtest.seed_links(client, args.keys)
+        await loadtest.run_workload(client, codes, argparse.Namespace(**{**vars(workload), "requests": args.warmup}))
+        return (await loadtest.run_workload(client, codes, workload))["redirect"]
+
+
+async def main_async(args):
+    print(f"{'concorrência':>12} {'modo':>10} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for concurrency in args.concurrency:
+        for mode in args.modes:
+            result = await run(mode, concurrency, args)
+            print(f"{concurrency:>12} {mode:>10} {result['throughput_rps']:>9.1f} {result['p50_ms']:>8.2f} "
+                  f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--modes", nargs="+", choices=harness.MODES, default=["tcp", "asgi", "monolith"])
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
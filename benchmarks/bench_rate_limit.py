@@ -0,0 +1,105 @@
+"""
+Custo do rate limiting do gateway por requisição, sem I/O.
+
+  * TokenBucketLimiter.acquire com um cliente só, com --clients clientes em
+    rodízio (todos cabem nos buckets) e com clientes sempre novos acima de
+    RATE_LIMIT_MAX_CLIENTS (cada chamada despeja um bucket);
+  * o RateLimitMiddleware inteiro (classificação da rota, chave do cliente pelos
+    cabeçalhos e bucket) em volta de um app ASGI que só responde 200, comparado
+    ao mesmo app sem o middleware.
+
+Uso:
+    python benchmarks/bench_rate_limit.py --clients 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api_gateway"))
+
+from app.ratelimit import AdmissionControl, RateLimitMiddleware, TokenBucketLimiter  # noqa: E402
+
+HEADERS = [
+    (b"host", b"gateway.local"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0"),
+    (b"accept", b"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    (b"accept-language", b"pt-BR,pt;q=0.9,en;q=0.8"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"x-forwarded-for", b"203.0.113.7, 10.0.0.2"),
+    (b"connection", b"keep-alive"),
+]
+
+
+def per_call_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def bench_limiter(clients: int, number: int):
+    # Taxa alta: todas as chamadas entram, o que mede o caminho comum
+    limiter = TokenBucketLimiter(rate=1e9, burst=1e9, max_clients=clients)
+    print(f"acquire, 1 cliente:            {per_call_us(lambda: limiter.acquire('ip:203.0.113.7'), number):6.2f}µs")
+
+    keys = [f"ip:10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(clients)]
+    position = iter(range(10**12))
+
+    def rotating():
+        limiter.acquire(keys[next(position) % clients])
+
+    for key in keys:
+        limiter.acquire(key)
+    print(f"acquire, {clients} clientes:      {per_call_us(rotating, number):6.2f}µs")
+
+    churn = TokenBucketLimiter(rate=1e9, burst=1e9, max_clients=clients)
+    fresh = iter(range(10**12))
+    print(f"acquire, clientes novos:       {per_call_us(lambda: churn.acquire(f'ip:{next(fresh)}'), number):6.2f}µs"
+          f"  ({len(churn)} buckets guardados, {churn.evictions} despejados)")
+
+
+async def bench_middleware(number: int):
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 307, "headers": [(b"location", b"https://example.com")]})
+        await send({"type": "http.response.body", "body": b""})
+
+    control = AdmissionControl(
+        {"redirect": TokenBucketLimiter(rate=1e9, burst=1e9)},
+        {},
+        forwarded_hops=1,
+    )
+    wrapped = RateLimitMiddleware(endpoint, control)
+    scope = {"type": "http", "method": "GET", "path": "/Na26XA", "headers": HEADERS, "client": ("10.0.0.2", 50000)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run(app) -> float:
+        best = float("inf")
+        for _ in range(5):
+            started = time.perf_counter()
+            for _ in range(number):
+                await app(scope, receive, send)
+            best = min(best, time.perf_counter() - started)
+        return best / number * 1e6
+
+    bare, limited = await run(endpoint), await run(wrapped)
+    print(f"app ASGI sem middleware:       {bare:6.2f}µs")
+    print(f"com RateLimitMiddleware:       {limited:6.2f}µs  (+{limited - bare:.2f}µs por requisição)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+    bench_limiter(args.clients, args.number)
+    asyncio.run(bench_middleware(args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cache de lookups por worker (RedirectCache) contra o cache em memória
+compartilhada (SharedRedirectCache), com N processos (--workers) como no
+`uvicorn --workers N`.
+
+Mede, para cada backend:
+  * custo de get/set em um processo (µs por operação);
+  * memória somada dos workers depois de cada um ler --entries códigos
+    (Pss de /proc/self/smaps_rollup: páginas compartilhadas são divididas
+    entre os processos que as mapeiam, então a soma é a memória real);
+  * hit ratio de um worker novo nas primeiras --probes leituras, depois que os
+    outros já aqueceram o cache.
+
+Uso:
+    python benchmarks/bench_shared_cache.py --workers 4 8 --entries 50000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "redirection_service"))
+
+from app.cache import RedirectCache  # noqa: E402
+from app.shared_cache import SHARED_CACHE_DIR, SharedRedirectCache  # noqa: E402
+
+BACKENDS = ("memory", "shared")
+
+
+def make_cache(backend: str, path: str, entries: int):
+    if backend == "shared":
+        return SharedRedirectCache(path, max_entries=entries, ttl=3600)
+    return RedirectCache(max_entries=entries, ttl=3600)
+
+
+def long_url(index: int) -> str:
+    return f"https://example.com/produtos/categoria/{index % 97}/item/{index}?utm_source=newsletter&utm_medium=email"
+
+
+def pss_kb() -> int:
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+
+def fill_worker(backend: str, path: str, entries: int, barrier) -> int:
+    """Lê todos os códigos pelo cache (miss -> set) e retorna o aumento de Pss em KiB."""
+    before = pss_kb()
+    cache = make_cache(backend, path, entries)
+    for index in range(entries):
+        code = f"c{index:07d}"
+        if cache.get(code) is None:
+            cache.set(code, (long_url(index), None, None))
+    # Mede com todos os workers ainda vivos, para o Pss dividir as páginas compartilhadas entre eles
+    barrier.wait()
+    after = pss_kb()
+    barrier.wait()
+    return after - before
+
+
+def probe_worker(backend: str, path: str, entries: int, probes: int) -> float:
+    cache = make_cache(backend, path, entries)
+    step = max(1, entries // probes)
+    hits = sum(cache.get(f"c{index:07d}") is not None for index in range(0, step * probes, step))
+    return hits / probes
+
+
+def single_process_costs(backend: str, path: str, entries: int) -> tuple[float, float]:
+    cache = make_cache(backend, path, entries)
+    codes = [f"c{index:07d}" for index in range(min(entries, 10000))]
+    urls = [(long_url(index), None, None) for index in range(len(codes))]
+
+    def sets():
+        for code, url in zip(codes, urls):
+            cache.set(code, url)
+
+    def gets():
+        for code in codes:
+            cache.get(code)
+
+    set_us = min(timeit.repeat(sets, number=1, repeat=5)) / len(codes) * 1e6
+    get_us = min(timeit.repeat(gets, number=1, repeat=5)) / len(codes) * 1e6
+    return get_us, set_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[4])
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--probes", type=int, default=1000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'workers':>7} {'backend':>8} {'get':>8} {'set':>8} {'memória (soma)':>15} {'hit ratio worker novo':>22}")
+    with tempfile.TemporaryDirectory(dir=SHARED_CACHE_DIR) as tmp:
+        costs = {backend: single_process_costs(backend, os.path.join(tmp, "costs"), args.entries) for backend in BACKENDS}
+        for workers in args.workers:
+            for backend in BACKENDS:
+                path = os.path.join(tmp, f"cache-{workers}")
+                manager = context.Manager()
+                barrier = manager.Barrier(workers)
+                with context.Pool(workers) as pool:
+                    deltas = pool.starmap(fill_worker, [(backend, path, args.entries, barrier)] * workers)
+                with context.Pool(1) as pool:
+                    hit_ratio = pool.apply(probe_worker, (backend, path, args.entries, args.probes))
+                manager.shutdown()
+                get_us, set_us = costs[backend]
+                print(f"{workers:>7} {backend:>8} {get_us:>6.2f}µs {set_us:>6.2f}µs "
+                      f"{sum(deltas) / 1024:>12.1f}MiB {hit_ratio:>21.0%}")
+
+if __name__ == "__main__":
+    main()
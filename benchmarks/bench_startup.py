@@ -0,0 +1,96 @@
+"""
+Tempo de cold start de cada serviço: do início do processo (uvicorn em um
+subprocesso, como no container) até a primeira resposta 200 (GET /health nos
+serviços, GET / no gateway).
+
+Cada serviço sobe --runs vezes sobre o mesmo SQLite temporário: na primeira
+subida do Shortening Service o schema é criado pelas migrações; nas demais só
+a verificação de versão roda. Além do tempo medido de fora, mostra as fases que o próprio serviço
+registra em process_startup_seconds (imported, ready, first_request).
+
+Uso:
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+SERVICES = {"shortening_service": "/health", "redirection_service": "/health", "api_gateway": "/"}
+PHASES = ("imported", "ready", "first_request")
+
+
+def start_once(service: str, probe: str, env: dict, timeout: float) -> tuple[float, dict]:
+    """Sobe o serviço, espera o primeiro 200 em `probe` e retorna (segundos, fases)."""
+    port = harness._free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.join(harness.ROOT, service), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            while True:
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"{service} did not answer {probe} within {timeout}s")
+                try:
+                    if client.get(probe).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            metrics_text = client.get("/metrics").text
+    finally:
+        process.terminate()
+        process.wait()
+    phases = {
+        match.group(1): float(match.group(2))
+        for match in re.finditer(r'process_startup_seconds\{phase="(\w+)"\} ([\d.e+-]+)', metrics_text)
+    }
+    return elapsed, phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "SQLALCHEMY_DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(tmp, 'startup.db')}",
+            "BASE_URL": harness.BASE_URL,
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+            # O gateway não precisa dos serviços para responder GET /
+            "CODE_FILTER_ENABLED": "false",
+        })
+        env.update(item.split("=", 1) for item in args.env)
+
+        print(f"{'serviço':>20} {'1ª (migra)':>11} {'seguintes':>10} " + " ".join(f"{p:>13}" for p in PHASES))
+        for service, probe in SERVICES.items():
+            results = [start_once(service, probe, env, args.timeout) for _ in range(args.runs)]
+            first = results[0][0]
+            rest = [elapsed for elapsed, _ in results[1:]] or [first]
+            phase_medians = [
+                statistics.median(phases.get(phase, float("nan")) for _, phases in results) for phase in PHASES
+            ]
+            print(f"{service:>20} {first * 1000:>9.0f}ms {statistics.median(rest) * 1000:>8.0f}ms "
+                  + " ".join(f"{value * 1000:>11.0f}ms" for value in phase_medians))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+CDN local para desenvolvimento e benchmarks: proxy reverso ASGI com cache na
+frente do gateway, no lugar de uma CDN de verdade.
+
+  * a resposta de um GET à origem (CDN_ORIGIN) é guardada pelo tempo do
+    Cache-Control (`s-maxage` ou `max-age`) se for `public` e não tiver
+    `private`, `no-store` nem `no-cache`; sem Cache-Control nada é guardado;
+  * uma resposta guardada é servida (a GET e HEAD) sem tocar a origem, com
+    `X-Cache: HIT` e `Age`;
+  * `PURGE /<caminho>` remove a entrada do caminho (200, ou 404 se não havia),
+    como esperado pelo CDN_PURGE_URL do gateway;
+  * os demais métodos passam direto.
+
+Uso:
+    CDN_ORIGIN=http://localhost:8000 uvicorn cdn:app --app-dir benchmarks --port 8081
+    # no gateway: CDN_PURGE_URL=http://localhost:8081/{short_code}
+"""
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+CACHEABLE_METHODS = ("GET", "HEAD")
+# Cabeçalhos que não passam de um salto para o outro (ou que o proxy recalcula)
+HOP_HEADERS = frozenset((b"connection", b"keep-alive", b"transfer-encoding", b"content-length",
+                         b"content-encoding", b"host", b"age", b"x-cache"))
+
+
+def freshness(headers: httpx.Headers) -> float:
+    """Segundos que a resposta pode ficar guardada numa cache compartilhada (0 = não guardar)."""
+    directives = {}
+    for part in headers.get("cache-control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name] = value
+    if "public" not in directives or directives.keys() & {"private", "no-store", "no-cache"}:
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name, "").isdigit():
+            return float(directives[name])
+    return 0.0
+
+
+class LocalCDN:
+    """App ASGI; `origin` é um cliente httpx com o base_url da origem (ou um transporte em memória)."""
+
+    def __init__(self, origin: httpx.AsyncClient, max_entries: int = 100000):
+        self.origin = origin
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple] = OrderedDict()  # caminho -> (validade, guardada em, status, headers, body)
+        self.hits = 0
+        self.misses = 0
+        self.purges = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await self.origin.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        method = scope["method"]
+        key = scope["path"] + ("?" + scope["query_string"].decode() if scope["query_string"] else "")
+
+        if method == "PURGE":
+            found = self._entries.pop(key, None) is not None
+            self.purges += found
+            await _respond(send, 200 if found else 404, [(b"content-type", b"text/plain")],
+                           b"purged" if found else b"not cached")
+            return
+
+        if method in CACHEABLE_METHODS:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                age = str(int(now - entry[1])).encode()
+                await _respond(send, entry[2], entry[3] + [(b"x-cache", b"HIT"), (b"age", age)],
+                               b"" if method == "HEAD" else entry[4])
+                return
+            self.misses += 1
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        headers = [(name, value) for name, value in scope["headers"] if name not in HOP_HEADERS]
+        response = await self.origin.request(method, key, headers=headers, content=body)
+        response_headers = [(name, value) for name, value in response.headers.raw if name.lower() not in HOP_HEADERS]
+
+        ttl = freshness(response.headers) if method == "GET" else 0.0  # HEAD não traz o corpo
+        if ttl > 0:
+            now = time.monotonic()
+            self._entries[key] = (now + ttl, now, response.status_code, response_headers, response.content)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        await _respond(send, response.status_code, response_headers + [(b"x-cache", b"MISS")],
+                       b"" if method == "HEAD" else response.content)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "purges": self.purges}
+
+
+async def _respond(send, status_code: int, headers: list, body: bytes):
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": headers + [(b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+app = LocalCDN(httpx.AsyncClient(base_url=os.getenv("CDN_ORIGIN", "http://localhost:8000")))
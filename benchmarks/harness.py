@@ -0,0 +1,132 @@
+"""
+Sobe o API Gateway e os dois serviços no mesmo processo, sem Docker nem Postgres.
+
+Cada serviço é importado como um pacote próprio (todos se chamam `app` no disco),
+o banco é um arquivo SQLite (aiosqlite) compartilhado pelos dois serviços e as
+chamadas internas do gateway vão direto para os apps ASGI por um transporte
+httpx em memória (ou por TCP local, ou sem HTTP no modo monolito; ver running_stack).
+"""
+import asyncio
+import contextlib
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from monolith.loader import load_service  # noqa: E402
+
+SHORTENING_HOST = "shortening.local"
+REDIRECTION_HOST = "redirection.local"
+BASE_URL = "http://gateway.local"
+
+
+class HostRoutingTransport(httpx.AsyncBaseTransport):
+    """Encaminha cada requisição para o app ASGI do host de destino."""
+
+    def __init__(self, apps: dict):
+        self._transports = {host: httpx.ASGITransport(app=app) for host, app in apps.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transports[request.url.host].handle_async_request(request)
+
+
+def configure_environment(db_path: str, extra_env: dict | None = None):
+    """Variáveis de ambiente lidas pelos serviços no import (antes de carregá-los)."""
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+        "SHORTENING_SERVICE_URL": f"http://{SHORTENING_HOST}",
+        "REDIRECTION_SERVICE_URL": f"http://{REDIRECTION_HOST}",
+        "BASE_URL": BASE_URL,
+        "SHORT_CODE_KEY": "benchmark-code-key",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    os.environ.update(extra_env or {})
+
+
+def _free_port() -> int:
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def _serve_tcp(app, port: int):
+    """Serve o app ASGI com uvicorn em 127.0.0.1:port (o lifespan é controlado pelo harness)."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off",
+                                           log_level="warning", access_log=False))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    try:
+        yield
+    finally:
+        server.should_exit = True
+        await task
+
+
+# Como o gateway fala com os serviços
+MODES = ("asgi", "tcp", "monolith")
+
+
+@asynccontextmanager
+async def running_stack(extra_env: dict | None = None, mode: str = "asgi"):
+    """
+    Sobe os três apps (com seus lifespans) sobre um SQLite temporário e
+    retorna um cliente httpx apontado para o gateway. `mode` escolhe o caminho
+    entre o gateway e os serviços: "asgi" (HTTP em memória, sem rede), "tcp"
+    (HTTP de verdade, serviços servidos por uvicorn em portas locais) ou
+    "monolith" (chamadas diretas, como em monolith/main.py).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    with tempfile.TemporaryDirectory(prefix="ushort-bench-") as tmp:
+        db_path = os.path.join(tmp, "ushort.db")
+        # WAL é persistido no arquivo: leitores não bloqueiam o escritor (mais próximo do Postgres)
+        with contextlib.closing(sqlite3.connect(db_path)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        configure_environment(db_path, extra_env)
+        ports = {}
+        if mode == "tcp":
+            ports = {"shortening": _free_port(), "redirection": _free_port()}
+            os.environ["SHORTENING_SERVICE_URL"] = f"http://127.0.0.1:{ports['shortening']}"
+            os.environ["REDIRECTION_SERVICE_URL"] = f"http://127.0.0.1:{ports['redirection']}"
+        shortening = load_service("shortening_service", "bench_shortening_app")
+        redirection = load_service("redirection_service", "bench_redirection_app")
+        gateway = load_service("api_gateway", "bench_gateway_app")
+        if mode == "monolith":
+            gateway.app.state.local_services = gateway.LocalServices(shortening, redirection)
+
+        async with contextlib.AsyncExitStack() as stack:
+            # O shortening_service cria as tabelas antes do redirection_service
+            await stack.enter_async_context(shortening.app.router.lifespan_context(shortening.app))
+            await stack.enter_async_context(redirection.app.router.lifespan_context(redirection.app))
+            if mode == "tcp":
+                await stack.enter_async_context(_serve_tcp(shortening.app, ports["shortening"]))
+                await stack.enter_async_context(_serve_tcp(redirection.app, ports["redirection"]))
+            await stack.enter_async_context(gateway.app.router.lifespan_context(gateway.app))
+
+            if mode == "asgi":
+                # Troca antes de fechar: tarefas de fundo do gateway já podem estar usando o cliente.
+                # O cliente novo mantém as métricas e a política de resiliência do gateway.
+                original_client = gateway.app.state.http_client
+                gateway.install_http_client(gateway.app, HostRoutingTransport({
+                    SHORTENING_HOST: shortening.app,
+                    REDIRECTION_HOST: redirection.app,
+                }))
+                await original_client.aclose()
+
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=gateway.app), base_url=BASE_URL
+            ) as client:
+                yield client
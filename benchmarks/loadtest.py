@@ -0,0 +1,208 @@
+"""
+Teste de carga reproduzível do µShort, sem Docker nem Postgres.
+
+Sobe o gateway e os dois serviços em processo (ver harness.py), cria um
+conjunto inicial de links e executa uma carga mista de encurtamentos e
+redirecionamentos com concorrência configurável. Os redirecionamentos escolhem
+códigos com distribuição Zipf (poucos links muito quentes, cauda longa fria).
+
+Relata throughput e latências p50/p95/p99 de `POST /api/shorten` e
+`GET /{short_code}` e salva o resultado em JSON, que pode ser comparado com
+uma execução anterior via --compare.
+
+Uso:
+    python benchmarks/loadtest.py --requests 5000 --concurrency 32 --output results.json
+    python benchmarks/loadtest.py --compare results.json
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+class ZipfSampler:
+    """Sorteia índices em [0, n) com P(k) proporcional a 1 / (k + 1) ** s."""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self._cumulative = list(itertools.accumulate(1.0 / (k + 1) ** s for k in range(n)))
+        self._rng = rng
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self._cumulative, self._rng.random() * self._cumulative[-1])
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+    }
+
+
+async def seed_links(client, count: int) -> list[str]:
+    """Cria o conjunto inicial de links pelo endpoint em lote e retorna os códigos."""
+    codes = []
+    for start in range(0, count, 1000):
+        urls = [f"https://example.com/seed/{i}" for i in range(start, min(count, start + 1000))]
+        response = await client.post("/api/shorten/batch", json=urls)
+        response.raise_for_status()
+        for result in response.json()["results"]:
+            codes.append(result["short_url"].rsplit("/", 1)[-1])
+    return codes
+
+
+async def run_workload(client, codes: list[str], args) -> dict:
+    rng = random.Random(args.seed)
+    zipf = ZipfSampler(len(codes), args.zipf_s, rng)
+    operations = ["shorten" if rng.random() < args.shorten_ratio else "redirect" for _ in range(args.requests)]
+    targets = [codes[zipf.sample()] for _ in range(args.requests)]
+
+    latencies = {"shorten": [], "redirect": []}
+    errors = {"shorten": 0, "redirect": 0}
+    next_index = itertools.count()
+
+    async def worker():
+        for i in iter(lambda: next(next_index), None):
+            if i >= args.requests:
+                return
+            op = operations[i]
+            started = time.perf_counter()
+            if op == "shorten":
+                response = await client.post("/api/shorten", json={"long_url": f"https://example.com/load/{i}"})
+                ok = response.status_code == 201
+            else:
+                response = await client.get(f"/{targets[i]}")
+                ok = response.status_code == 307
+            elapsed = time.perf_counter() - started
+            if ok:
+                latencies[op].append(elapsed)
+            else:
+                errors[op] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_s": elapsed,
+        "total_throughput_rps": args.requests / elapsed,
+        "shorten": summarize(latencies["shorten"], errors["shorten"], elapsed),
+        "redirect": summarize(latencies["redirect"], errors["redirect"], elapsed),
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=harness.ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _parse_env(pairs: list[str]) -> dict:
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return env
+
+
+async def main_async(args) -> dict:
+    async with harness.running_stack(_parse_env(args.env), mode=args.mode) as client:
+        codes = await seed_links(client, args.keys)
+        if args.warmup:
+            warmup_args = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+            await run_workload(client, codes, warmup_args)
+        results = await run_workload(client, codes, args)
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "shorten_ratio": args.shorten_ratio,
+            "keys": args.keys,
+            "zipf_s": args.zipf_s,
+            "seed": args.seed,
+            "mode": args.mode,
+            "env": _parse_env(args.env),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git_revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None):
+    results = report["results"]
+    print(f"Total: {results['total_throughput_rps']:.1f} req/s em {results['elapsed_s']:.2f}s")
+    for op in ("shorten", "redirect"):
+        data = results[op]
+        line = (f"{op:>9}: {data['count']:6d} ok {data['errors']:4d} erros  "
+                f"{data['throughput_rps']:8.1f} req/s  p50 {data['p50_ms']:7.2f}ms  "
+                f"p95 {data['p95_ms']:7.2f}ms  p99 {data['p99_ms']:7.2f}ms")
+        if baseline:
+            base = baseline["results"][op]
+            if base["throughput_rps"] and base["p99_ms"]:
+                line += (f"  (req/s {data['throughput_rps'] / base['throughput_rps'] - 1:+.1%}, "
+                         f"p99 {data['p99_ms'] / base['p99_ms'] - 1:+.1%})")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="Requisições medidas")
+    parser.add_argument("--warmup", type=int, default=500, help="Requisições de aquecimento (não medidas)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--shorten-ratio", type=float, default=0.1, help="Fração de encurtamentos na carga")
+    parser.add_argument("--keys", type=int, default=2000, help="Links criados antes da carga")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Expoente Zipf dos redirecionamentos (0 = uniforme)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Variável de ambiente extra para os serviços (repetível)")
+    parser.add_argument("--mode", choices=harness.MODES, default="asgi",
+                        help="Caminho gateway → serviços: HTTP em memória, TCP local ou monolito")
+    parser.add_argument("--output", help="Arquivo JSON para salvar o resultado")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Resultado salvo em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
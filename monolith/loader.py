@@ -0,0 +1,26 @@
+"""
+Carrega o pacote `app` de um serviço com outro nome (os três se chamam `app` no disco).
+
+Usado pelo monolito (monolith/main.py) e pelo harness dos benchmarks (benchmarks/harness.py).
+"""
+import importlib
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_service(directory: str, package_name: str):
+    """Importa `<directory>/app` como o pacote `package_name` e retorna o módulo main."""
+    # Recarrega do zero a cada chamada: a configuração é lida das variáveis de ambiente no import
+    for name in [name for name in sys.modules if name == package_name or name.startswith(f"{package_name}.")]:
+        del sys.modules[name]
+    package_dir = os.path.join(ROOT, directory, "app")
+    spec = importlib.util.spec_from_file_location(
+        package_name, os.path.join(package_dir, "__init__.py"), submodule_search_locations=[package_dir]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[package_name] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module(f"{package_name}.main")
@@ -0,0 +1,39 @@
+"""
+Modo monolito: API Gateway, Shortening e Redirection Service em um único processo.
+
+O gateway chama a lógica dos serviços diretamente (ver api_gateway/app/local_services.py),
+sem o salto HTTP interno; as rotas públicas continuam as mesmas. Os três pacotes se
+chamam `app` no disco, então cada um é importado com outro nome. A topologia de
+microsserviços não muda: ela continua sendo o `uvicorn app.main:app` de cada serviço.
+
+Executar (na raiz do repositório, com as mesmas variáveis de ambiente dos serviços):
+    uvicorn monolith.main:app --host 0.0.0.0 --port 8000
+"""
+import os
+from contextlib import asynccontextmanager
+
+from monolith.loader import load_service
+
+# O gateway registra essas URLs nas métricas e avisa se faltarem; no monolito elas não são usadas
+os.environ.setdefault("SHORTENING_SERVICE_URL", "http://shortening.internal")
+os.environ.setdefault("REDIRECTION_SERVICE_URL", "http://redirection.internal")
+
+shortening = load_service("shortening_service", "ushort_shortening")
+redirection = load_service("redirection_service", "ushort_redirection")
+gateway = load_service("api_gateway", "ushort_gateway")
+
+gateway_lifespan = gateway.app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # O Shortening Service cria as tabelas antes do Redirection Service
+    async with shortening.app.router.lifespan_context(shortening.app), \
+            redirection.app.router.lifespan_context(redirection.app), \
+            gateway_lifespan(app):
+        yield
+
+
+gateway.app.state.local_services = gateway.LocalServices(shortening, redirection)
+gateway.app.router.lifespan_context = lifespan
+app = gateway.app
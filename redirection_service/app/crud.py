@@ -1,9 +1,13 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from . import models
+from . import database, models
 
 
+@database.timed_query("get_url_by_short_code")
 async def get_url_by_short_code(db: AsyncSession, short_code: str) -> models.URLMap | None:
     """Busca um mapeamento de URL pelo código curto."""
     result = await db.execute(
@@ -11,3 +15,63 @@ async def get_url_by_short_code(db: AsyncSession, short_code: str) -> models.URL
     )
     # first() retorna o primeiro resultado ou None se não houver nenhum
     return result.scalars().first()
+
+
+@database.timed_query("record_clicks")
+async def record_clicks(db: AsyncSession, clicks: list[models.ClickAggregate]):
+    """Soma agregados de cliques na tabela link_clicks com um upsert multi-linha."""
+    if not clicks:
+        return
+    stmt = database.dialect_insert(models.LinkClicks).values([
+        {
+            "short_code": click.short_code,
+            "click_count": click.count,
+            "first_click_at": datetime.fromtimestamp(click.first_at, timezone.utc),
+            "last_click_at": datetime.fromtimestamp(click.last_at, timezone.utc),
+        }
+        for click in clicks
+    ])
+    table = models.LinkClicks.__table__
+    # SQLite não tem least/greatest; min/max com vários argumentos fazem o mesmo
+    least, greatest = (func.min, func.max) if database.DIALECT == "sqlite" else (func.least, func.greatest)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.short_code],
+        set_={
+            "click_count": table.c.click_count + stmt.excluded.click_count,
+            "first_click_at": least(table.c.first_click_at, stmt.excluded.first_click_at),
+            "last_click_at": greatest(table.c.last_click_at, stmt.excluded.last_click_at),
+        },
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+@database.timed_query("list_codes_after")
+async def list_codes_after(db: AsyncSession, after_id: int, limit: int) -> list[tuple[int, str]]:
+    """Página de (id, short_code) com id > after_id, em ordem de id (paginação por chave)."""
+    result = await db.execute(
+        select(models.URLMap.id, models.URLMap.short_code)
+        .where(models.URLMap.id > after_id)
+        .order_by(models.URLMap.id)
+        .limit(limit)
+    )
+    return result.all()
+
+
+@database.timed_query("most_clicked_codes")
+async def most_clicked_codes(db: AsyncSession, limit: int) -> list[str]:
+    """Códigos com mais cliques (tabela link_clicks), do mais para o menos clicado."""
+    result = await db.execute(
+        select(models.LinkClicks.short_code).order_by(models.LinkClicks.click_count.desc()).limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+@database.timed_query("get_long_urls")
+async def get_long_urls(db: AsyncSession, short_codes: list[str]) -> dict[str, tuple]:
+    """{short_code: (long_url, expires_at, redirect_policy)} dos códigos existentes entre os informados."""
+    result = await db.execute(
+        select(models.URLMap.short_code, models.URLMap.long_url, models.URLMap.expires_at, models.URLMap.redirect_policy)
+        .where(models.URLMap.short_code.in_(short_codes))
+    )
+    return {short_code: tuple(values) for short_code, *values in result}
@@ -1,10 +1,20 @@
+import asyncio
+import itertools
 import os
-import sys
+from typing import Awaitable, Callable, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import declarative_base
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+from . import metrics
+from .logs import logger
+
 # Carrega .env para desenvolvimento local (ignorado no Cloud Run se não presente)
 load_dotenv()
 
@@ -18,49 +28,248 @@ DB_PORT_LOCAL = os.getenv("DATABASE_PORT", "5432")  # Para dev local (Docker)
 DB_NAME = os.getenv("POSTGRES_DB", "ushort_db")  # Default para dev local
 INSTANCE_CONNECTION_NAME = os.getenv("CLOUD_SQL_CONNECTION_NAME")  # Virá do Cloud Run
 
+# URL completa explícita (ex: sqlite+aiosqlite:///... nos benchmarks locais); ignora as variáveis acima
+DATABASE_URL_OVERRIDE = os.getenv("SQLALCHEMY_DATABASE_URL")
+
 DATABASE_URL = None
 
+if DATABASE_URL_OVERRIDE:
+    DATABASE_URL = DATABASE_URL_OVERRIDE
+    logger.info("Usando SQLALCHEMY_DATABASE_URL explícita.")
+
 # Verifica se está rodando no Cloud Run e se o nome da conexão SQL foi fornecido
-if os.getenv('K_SERVICE') and INSTANCE_CONNECTION_NAME:
+elif os.getenv('K_SERVICE') and INSTANCE_CONNECTION_NAME:
     # Formato para Socket Unix no Cloud Run
     socket_dir = "/cloudsql"
     DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_NAME}?host={socket_dir}/{INSTANCE_CONNECTION_NAME}"
-    print(f"INFO: Configurando conexão via Cloud Run Socket Unix.", file=sys.stderr)
+    logger.info("Configurando conexão via Cloud Run Socket Unix.")
 
 else:
     # Formato padrão para desenvolvimento local (Docker Compose) ou outra conexão TCP
     if not DB_PASSWORD:
-        print("AVISO: Senha do DB (DB_PASSWORD) não encontrada no ambiente local!", file=sys.stderr)
+        logger.warning("Senha do DB (DB_PASSWORD) não encontrada no ambiente local!")
         # A conexão provavelmente falhará sem senha localmente
     DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST_LOCAL}:{DB_PORT_LOCAL}/{DB_NAME}"
-    print(f"INFO: Configurando conexão padrão (local/TCP).", file=sys.stderr)
+    logger.info("Configurando conexão padrão (local/TCP).")
 
 # Validação final
 if not DATABASE_URL:
-    print("ERRO CRÍTICO: Não foi possível determinar a DATABASE_URL!", file=sys.stderr)
+    logger.critical("Não foi possível determinar a DATABASE_URL!")
     raise ValueError("DATABASE_URL não pôde ser construída.")
 
-if not DB_PASSWORD and not os.getenv('K_SERVICE'):  # Checa senha faltando localmente
-    print("AVISO SEVERO: DB_PASSWORD não definida no ambiente local. A conexão falhará.", file=sys.stderr)
+if not DB_PASSWORD and not os.getenv('K_SERVICE') and not DATABASE_URL_OVERRIDE:  # Checa senha faltando localmente
+    logger.warning("DB_PASSWORD não definida no ambiente local. A conexão falhará.")
+
+# Réplicas de leitura: URLs completas separadas por vírgula (vazio = todas as leituras no primário)
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+READ_REPLICA_STRATEGY = os.getenv("READ_REPLICA_STRATEGY", "round_robin").lower()  # ou "least_loaded"
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "10"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "0"))  # Segundos de atraso aceitos (0 = não verifica)
+
+# Conexões abertas por engine no startup (0 desativa); o pool padrão do SQLAlchemy guarda 5
+DB_POOL_WARM_SIZE = int(os.getenv("DB_POOL_WARM_SIZE", "5"))
 
 # --- Configuração SQLAlchemy ---
 
 Base = declarative_base()
 
+
+def _create_engine(url: str):
+    # echo=True pode ser útil para debug, mas removido para prod
+    return create_async_engine(
+        url, echo=False, pool_recycle=1800,  # pool_recycle é bom para conexões longas
+        # SQLite (stand-in local): espera o lock de escrita em vez de falhar na hora
+        connect_args={"timeout": 30} if url.startswith("sqlite") else {},
+    )
+
+
 # Cria a engine com a URL construída
 try:
-    # echo=True pode ser útil para debug, mas removido para prod
-    engine = create_async_engine(DATABASE_URL, echo=False, pool_recycle=1800)  # pool_recycle é bom para conexões longas
+    engine = _create_engine(DATABASE_URL)
 except Exception as e:
-    print(f"ERRO CRÍTICO: Falha ao criar SQLAlchemy engine com URL calculada: {e}", file=sys.stderr)
+    logger.critical(f"Falha ao criar SQLAlchemy engine com URL calculada: {e}")
     # Imprime a URL (sem senha) para debug SE falhar
     safe_url = DATABASE_URL.replace(f":{DB_PASSWORD}@", ":***@") if DB_PASSWORD else DATABASE_URL
-    print(f"URL utilizada (senha omitida): {safe_url}", file=sys.stderr)
+    logger.info(f"URL utilizada (senha omitida): {safe_url}")
     raise e
 
 # Fábrica de Sessões Assíncronas
 async_session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Dialeto em uso: "postgresql" em produção, "sqlite" no stand-in local dos benchmarks
+DIALECT = engine.dialect.name
+
+
+def dialect_insert(table):
+    """insert() com suporte a ON CONFLICT/RETURNING no dialeto em uso (Postgres ou SQLite)."""
+    if DIALECT == "sqlite":
+        return sqlite_insert(table)
+    return pg_insert(table)
+
+
+# --- Métricas do Banco ---
+DB_QUERY_LATENCY = metrics.Histogram(
+    "db_query_duration_seconds", "Duração das operações de banco (funções do crud).", ("operation",)
+)
+DB_POOL = metrics.Gauge(
+    "db_pool_connections", "Conexões do pool da engine SQLAlchemy por estado.", ("state",),
+    collect=lambda: metrics.sqlalchemy_pool_stats(engine),
+)
+
+
+def timed_query(operation: str):
+    """Decorator que mede a duração de uma operação do crud."""
+    return metrics.timed(DB_QUERY_LATENCY, operation)
+
+
+# --- Réplicas de Leitura ---
+
+# Erros que indicam réplica indisponível (ela sai da rotação até o próximo health check bem-sucedido).
+# DBAPIError cobre também os erros do driver sem classe própria no SQLAlchemy, como o
+# "canceling statement due to conflict with recovery" de uma réplica hot standby.
+REPLICA_ERRORS = (OSError, DBAPIError, asyncio.TimeoutError)
+
+# Atraso de replicação: 0 no primário; no Postgres em recovery, idade da última transação aplicada
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+
+class Replica:
+    """Uma réplica de leitura com engine própria e estado de saúde."""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = _create_engine(url)
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        self.healthy = True
+        self.lag = 0.0
+        self.in_flight = 0
+        self.failures = 0
+
+
+class ReplicaRouter:
+    """Escolhe a réplica saudável de cada leitura (round-robin ou menos ocupada)."""
+
+    def __init__(self, urls: list[str], strategy: str = "round_robin"):
+        self.replicas = [Replica(str(i), url) for i, url in enumerate(urls)]
+        self.strategy = strategy
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+
+    def pick(self) -> Replica | None:
+        """Réplica para a próxima leitura, ou None se não houver nenhuma saudável."""
+        if self.strategy == "least_loaded":
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            return min(healthy, key=lambda replica: replica.in_flight) if healthy else None
+        for _ in range(len(self.replicas)):
+            replica = next(self._cycle)
+            if replica.healthy:
+                return replica
+        return None
+
+    def mark_failed(self, replica: Replica, error: Exception):
+        if replica.healthy:
+            logger.warning(f"Read replica {replica.name} removed from rotation: {error}")
+        replica.healthy = False
+        replica.failures += 1
+
+    async def check(self, replica: Replica):
+        """Health check: conecta, mede o atraso (Postgres) e atualiza a rotação."""
+        try:
+            async with replica.engine.connect() as conn:
+                if replica.engine.dialect.name == "postgresql":
+                    replica.lag = float(await asyncio.wait_for(conn.scalar(text(REPLICA_LAG_SQL)), timeout=5))
+                else:
+                    await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=5)
+        except REPLICA_ERRORS as e:
+            self.mark_failed(replica, e)
+            return
+        lagging = REPLICA_MAX_LAG > 0 and replica.lag > REPLICA_MAX_LAG
+        if lagging and replica.healthy:
+            logger.warning(f"Read replica {replica.name} removed from rotation: lag {replica.lag:.1f}s")
+        elif not lagging and not replica.healthy:
+            logger.info(f"Read replica {replica.name} back in rotation.")
+        replica.healthy = not lagging
+
+    async def run_health_checks(self, interval: float):
+        while True:
+            try:
+                await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            except Exception as e:
+                # Um erro inesperado não pode encerrar os health checks de vez
+                logger.error(f"Read replica health check failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            replica.name: {
+                "healthy": replica.healthy,
+                "lag": replica.lag,
+                "in_flight": replica.in_flight,
+                "failures": replica.failures,
+            }
+            for replica in self.replicas
+        }
+
+
+replica_router = ReplicaRouter(READ_REPLICA_URLS, READ_REPLICA_STRATEGY)
+if READ_REPLICA_URLS:
+    logger.info(f"{len(READ_REPLICA_URLS)} read replica(s) configured ({READ_REPLICA_STRATEGY}).")
+
+DB_REPLICA_READS = metrics.Counter(
+    "db_replica_reads_total", "Leituras roteadas por destino (réplica ou primário) e motivo.", ("target", "reason")
+)
+DB_REPLICA_STATE = metrics.Gauge(
+    "db_replica_state", "Saúde (1/0), atraso em segundos e leituras em andamento por réplica.", ("replica", "stat"),
+    collect=lambda: {
+        (name, stat): float(value)
+        for name, values in replica_router.stats().items()
+        for stat, value in values.items() if stat != "failures"
+    },
+)
+
+
+def start_replica_health_checks() -> asyncio.Task | None:
+    """Inicia os health checks periódicos das réplicas (chamar no lifespan)."""
+    if not replica_router.replicas:
+        return None
+    return asyncio.create_task(replica_router.run_health_checks(REPLICA_HEALTH_INTERVAL))
+
+
+T = TypeVar("T")
+
+
+async def read_from_replica(fn: Callable[[AsyncSession], Awaitable[T]], fallback_on_none: bool = True) -> T:
+    """
+    Executa a leitura fn(session) em uma réplica. Se a réplica falhar, ou se
+    retornar None com fallback_on_none (o registro pode ser novo demais para ter
+    sido replicado), repete no primário. Sem réplicas, lê direto do primário.
+    """
+    replica = replica_router.pick()
+    if replica is not None:
+        replica.in_flight += 1
+        try:
+            async with replica.session_factory() as session:
+                result = await fn(session)
+            if result is not None or not fallback_on_none:
+                DB_REPLICA_READS.inc(replica.name, "ok")
+                return result
+            DB_REPLICA_READS.inc("primary", "replica_not_found")
+        except REPLICA_ERRORS as e:
+            replica_router.mark_failed(replica, e)
+            DB_REPLICA_READS.inc("primary", "replica_error")
+        finally:
+            replica.in_flight -= 1
+    elif replica_router.replicas:
+        DB_REPLICA_READS.inc("primary", "no_healthy_replica")
+    async with async_session_factory() as session:
+        return await fn(session)
+
 
 # --- Funções de Sessão ---
 
@@ -93,19 +302,22 @@ async def get_session() -> AsyncSession:
             await session.close()
 
 
-# --- Adicionar a função init_db de volta ---
-async def init_db():
-    """Cria as tabelas no banco de dados se não existirem."""
-    print("INFO: Running init_db() - attempting to create tables...", file=sys.stderr)
-    async with engine.begin() as conn:
-        try:
-            # run_sync executa Base.metadata.create_all de forma síncrona
-            # dentro do contexto assíncrono da conexão.
-            # checkfirst=True (padrão) evita erro se tabela já existir.
-            await conn.run_sync(Base.metadata.create_all)
-            print("INFO: Base.metadata.create_all executed.", file=sys.stderr)
-        except Exception as e:
-            print(f"ERROR during metadata.create_all: {e}", file=sys.stderr)
-            # Decide se quer relançar o erro ou apenas logar
-            # raise e
-# --- Fim da adição ---
+# --- Aquecimento do Pool ---
+# O schema é criado/atualizado por app.migrate (alembic), não mais por create_all.
+
+async def warm_pool(session_factory, warm: Callable[[AsyncSession], Awaitable] | None = None,
+                    size: int = DB_POOL_WARM_SIZE):
+    """
+    Abre `size` conexões do pool em paralelo antes de o serviço ficar pronto e
+    executa em cada uma a consulta do caminho quente (`warm(session)`, ou SELECT 1),
+    para que nem a conexão nem o prepared statement do asyncpg fiquem para a
+    primeira requisição.
+    """
+    async def open_one():
+        async with session_factory() as session:
+            if warm is None:
+                await session.execute(text("SELECT 1"))
+            else:
+                await warm(session)
+
+    await asyncio.gather(*(open_one() for _ in range(size)))
@@ -0,0 +1,63 @@
+import os
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from . import database, metrics
+from .logs import logger
+
+# Caminho de leitura enxuto: asyncpg direto, sem ORM, sem unit-of-work e sem commit.
+# Usa um pool próprio, separado da engine SQLAlchemy, para poder comparar os dois.
+FAST_LOOKUP_POOL_MIN = int(os.getenv("FAST_LOOKUP_POOL_MIN", "1"))
+FAST_LOOKUP_POOL_MAX = int(os.getenv("FAST_LOOKUP_POOL_MAX", "10"))  # 0 desativa o pool
+
+LOOKUP_SQL = "SELECT long_url, expires_at, redirect_policy FROM url_mappings WHERE short_code = $1"
+
+FAST_POOL = metrics.Gauge("fast_lookup_pool_connections", "Conexões do pool asyncpg do caminho rápido por estado.", ("state",))
+
+
+def pool_stats(pool: asyncpg.Pool) -> dict:
+    idle = pool.get_idle_size()
+    return {("idle",): idle, ("active",): pool.get_size() - idle}
+
+
+def _connect_kwargs(database_url=None) -> dict:
+    """Converte uma URL do SQLAlchemy (padrão: DATABASE_URL) em parâmetros do asyncpg."""
+    url = make_url(database_url if database_url is not None else database.DATABASE_URL)
+    kwargs = {
+        "user": url.username,
+        "password": url.password,
+        "database": url.database or database.DB_NAME,
+        "port": url.port,
+    }
+    # No Cloud Run o host é o socket Unix passado na query string (?host=/cloudsql/...)
+    socket_host = url.query.get("host")
+    kwargs["host"] = socket_host if socket_host else url.host
+    return kwargs
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Prepara a consulta de lookup em cada conexão nova do pool."""
+    # fetchrow com o mesmo texto SQL reaproveita o prepared statement do cache da conexão
+    await conn.fetchrow(LOOKUP_SQL, "")
+
+
+async def create_pool() -> asyncpg.Pool | None:
+    """Cria o pool asyncpg do caminho rápido (ou None se desativado ou fora do Postgres)."""
+    if FAST_LOOKUP_POOL_MAX <= 0 or database.DIALECT != "postgresql":
+        return None
+    logger.info(f"Creating asyncpg fast-lookup pool (min={FAST_LOOKUP_POOL_MIN}, max={FAST_LOOKUP_POOL_MAX})")
+    return await asyncpg.create_pool(
+        min_size=min(FAST_LOOKUP_POOL_MIN, FAST_LOOKUP_POOL_MAX),
+        max_size=FAST_LOOKUP_POOL_MAX,
+        init=_init_connection,
+        max_inactive_connection_lifetime=1800,
+        **_connect_kwargs(),
+    )
+
+
+@database.timed_query("fast_lookup.get_long_url")
+async def get_long_url(pool: asyncpg.Pool, short_code: str) -> asyncpg.Record | None:
+    """Busca (long_url, expires_at, redirect_policy) com a consulta preparada; None se o código não existir."""
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(LOOKUP_SQL, short_code)
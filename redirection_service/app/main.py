@@ -1,38 +1,137 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 import asyncio  # Adicionar
-import random  # Adicionar
-import sys
+import json
+import time
+from datetime import datetime, timezone
 
 # Removi os prints de debug do database.py, presumindo que não são mais necessários
-from . import crud, models, database # Remover , utils
+from . import crud, models, database, fast_lookup, logs, metrics, migrate, sharding # Remover , utils
+from .cache import RedirectCache
+from .logs import logger
+from .notifications import ChangeListener
+from .shared_cache import SharedRedirectCache, default_path
+from .singleflight import SingleFlight
+from .reaper import REAPER_ENABLED, ExpiryReaper
+from .snapshot import SnapshotStore
+
+# Backend do /lookup: "sqlalchemy" (padrão) ou "asyncpg" (caminho rápido)
+LOOKUP_BACKEND = os.getenv("LOOKUP_BACKEND", "sqlalchemy").lower()
+
+# Cache de lookups em memória. Com o LISTEN ativo (Postgres), criações chegam por NOTIFY
+# e invalidam as entradas, então o TTL pode ser longo.
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "100000"))  # 0 desativa
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "3600"))
+LOOKUP_CACHE_NEGATIVE_TTL = float(os.getenv("LOOKUP_CACHE_NEGATIVE_TTL", "60"))
+LOOKUP_CACHE_WARM_COUNT = int(os.getenv("LOOKUP_CACHE_WARM_COUNT", "1000"))  # Códigos mais clicados carregados no startup
+# "memory" (um cache por worker) ou "shared" (uma tabela em memória compartilhada por todos os workers do host)
+LOOKUP_CACHE_BACKEND = os.getenv("LOOKUP_CACHE_BACKEND", "memory").lower()
+LOOKUP_CACHE_SHARED_PATH = os.getenv("LOOKUP_CACHE_SHARED_PATH", "")  # Vazio = default_path, resolvido no lifespan
+
+# Snapshot mmap consultado antes do banco (vazio = desativado) e intervalo de verificação de arquivo novo
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+SNAPSHOT_RELOAD_INTERVAL = float(os.getenv("SNAPSHOT_RELOAD_INTERVAL", "30"))
+
+
+async def _warm_pools():
+    """
+    Abre as conexões do banco principal, dos shards e das réplicas antes de o
+    serviço ficar pronto, já preparando a consulta de lookup do ORM.
+    """
+    factories = {database.engine: database.async_session_factory}
+    for shard in sharding.all_shards():
+        factories.setdefault(shard.engine, shard.session_factory)
+    for replica in database.replica_router.replicas:
+        factories.setdefault(replica.engine, replica.session_factory)
+    warm = lambda db: crud.get_url_by_short_code(db, "")
+    await asyncio.gather(*(database.warm_pool(factory, warm) for factory in factories.values()))
 
 
 # Context Manager para ciclo de vida da aplicação FastAPI
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # --- ADICIONAR SLEEP ALEATÓRIO ---
-    startup_delay = random.uniform(0.1, 1.5)  # Espera entre 0.1 e 1.5 segundos
-    print(f"{app.title}: Waiting {startup_delay:.2f}s before DB init...")
-    await asyncio.sleep(startup_delay)
-    # --- FIM DO SLEEP ---
-
-    print(f"{app.title}: Initializing database...")
+    # Schema migrado sob advisory lock (app.migrate), sem delay aleatório
+    logger.info(f"{app.title}: Checking database schema...")
     try:
-        await database.init_db()
-        print(f"{app.title}: Database initialized.")
+        await migrate.ensure_all_schemas()
+        await _warm_pools()
+        logger.info(f"{app.title}: Database ready.")
     except Exception as e:
         # Logar o erro se a inicialização falhar, mas tentar continuar se possível
         # Ou relançar para parar a aplicação: raise e
-        print(f"ERROR during {app.title} DB initialization: {e}", file=sys.stderr)
+        logger.error(f"Error during {app.title} DB initialization: {e}")
         # Dependendo da criticidade, você pode querer parar a aplicação aqui
         # raise e
 
+    replica_health_task = database.start_replica_health_checks()
+    app.state.lookup_flight = SingleFlight()
+    warm_cache = LOOKUP_CACHE_MAX_ENTRIES > 0 and LOOKUP_CACHE_WARM_COUNT > 0
+    if LOOKUP_CACHE_BACKEND == "shared" and LOOKUP_CACHE_MAX_ENTRIES > 0:
+        app.state.lookup_cache = SharedRedirectCache(
+            LOOKUP_CACHE_SHARED_PATH or default_path("ushorter-lookup-cache"),
+            max_entries=LOOKUP_CACHE_MAX_ENTRIES,
+            ttl=LOOKUP_CACHE_TTL,
+            negative_ttl=LOOKUP_CACHE_NEGATIVE_TTL,
+        )
+        # Só o worker que criou a tabela a aquece; os demais (e os reiniciados) já a encontram quente
+        warm_cache = warm_cache and app.state.lookup_cache.created
+    else:
+        app.state.lookup_cache = RedirectCache(
+            max_entries=LOOKUP_CACHE_MAX_ENTRIES,
+            ttl=LOOKUP_CACHE_TTL,
+            negative_ttl=LOOKUP_CACHE_NEGATIVE_TTL,
+        )
+    app.state.change_listener = ChangeListener(app.state.lookup_cache)
+    app.state.change_listener.start()
+    if warm_cache:
+        try:
+            await _warm_cache(app.state.lookup_cache, min(LOOKUP_CACHE_WARM_COUNT, LOOKUP_CACHE_MAX_ENTRIES))
+        except Exception as e:
+            logger.error(f"Error warming lookup cache: {e}")
+
+    app.state.fast_pool = None
+    try:
+        app.state.fast_pool = await fast_lookup.create_pool()
+        if app.state.fast_pool is not None:
+            fast_lookup.FAST_POOL.set_function(lambda: fast_lookup.pool_stats(app.state.fast_pool))
+    except Exception as e:
+        logger.error(f"Error creating asyncpg fast-lookup pool: {e}")
+
+    app.state.snapshot = None
+    snapshot_watcher = None
+    if SNAPSHOT_PATH:
+        app.state.snapshot = SnapshotStore(SNAPSHOT_PATH)
+        try:
+            if app.state.snapshot.reload():
+                logger.info(f"{app.title}: Snapshot loaded with {app.state.snapshot.current.count} codes.")
+            else:
+                logger.warning(f"{app.title}: Snapshot {SNAPSHOT_PATH} not found, using database only.")
+        except Exception as e:
+            logger.error(f"Error loading snapshot: {e}")
+        snapshot_watcher = asyncio.create_task(app.state.snapshot.watch(SNAPSHOT_RELOAD_INTERVAL))
+
+    app.state.reaper = ExpiryReaper() if REAPER_ENABLED else None
+    if app.state.reaper is not None:
+        app.state.reaper.start()
+
+    logger.info(f"{app.title}: Ready {metrics.mark_startup('ready'):.3f}s after process start.")
     yield
     # Código a ser executado APÓS a aplicação finalizar (shutdown)
-    print(f"{app.title}: Closing down...")
+    logger.info(f"{app.title}: Closing down...")
+    if app.state.reaper is not None:
+        await app.state.reaper.stop()
+    await app.state.change_listener.stop()
+    if replica_health_task is not None:
+        replica_health_task.cancel()
+        await database.replica_router.dispose()
+    if snapshot_watcher is not None:
+        snapshot_watcher.cancel()
+        app.state.snapshot.close()
+    if app.state.fast_pool is not None:
+        await app.state.fast_pool.close()
 
 
 app = FastAPI(
@@ -41,28 +140,327 @@ app = FastAPI(
     version="0.1.0",
     lifespan=lifespan
 )
+app.include_router(logs.admin_router("/admin"))
+app.add_middleware(metrics.MetricsMiddleware)
+
+SINGLEFLIGHT_STATS = metrics.Gauge("redirection_singleflight", "Contadores de coalescência de lookups.", ("stat",))
+SINGLEFLIGHT_STATS.set_function(
+    lambda: {(key,): value for key, value in app.state.lookup_flight.stats().items()}
+)
+LOOKUP_CACHE_STATS = metrics.Gauge("redirection_lookup_cache", "Contadores do cache de lookups.", ("stat",))
+LOOKUP_CACHE_STATS.set_function(
+    lambda: {(key,): value for key, value in app.state.lookup_cache.stats().items()}
+)
+CHANGE_LISTENER_STATS = metrics.Gauge("redirection_change_listener", "Estado da conexão LISTEN e eventos recebidos.", ("stat",))
+CHANGE_LISTENER_STATS.set_function(
+    lambda: {(key,): value for key, value in app.state.change_listener.stats().items()}
+)
+SNAPSHOT_STATS = metrics.Gauge("redirection_snapshot", "Estado e contadores do snapshot mmap.", ("stat",))
+SNAPSHOT_STATS.set_function(
+    lambda: {(key,): value for key, value in app.state.snapshot.stats().items()} if app.state.snapshot else {}
+)
+REAPER_STATS = metrics.Gauge("redirection_reaper", "Execuções e remoções do reaper de links expirados.", ("stat",))
+REAPER_STATS.set_function(
+    lambda: {(key,): value for key, value in app.state.reaper.stats().items()} if app.state.reaper else {}
+)
+
+
+async def _warm_cache(cache: RedirectCache, count: int):
+    """Carrega no cache os códigos mais clicados (tabela link_clicks)."""
+    codes = await database.read_from_replica(lambda db: crud.most_clicked_codes(db, count), fallback_on_none=False)
+    long_urls: dict[str, tuple] = {}
+    for shard, shard_codes in sharding.group_by_shard(codes, lambda code: code).items():
+        if sharding.ENABLED:
+            async with shard.session_factory() as db:
+                long_urls.update(await crud.get_long_urls(db, shard_codes))
+        else:
+            long_urls.update(await database.read_from_replica(
+                lambda db: crud.get_long_urls(db, shard_codes), fallback_on_none=False
+            ))
+    # Do menos para o mais clicado: os mais quentes ficam no fim da LRU
+    for short_code in reversed(codes):
+        if short_code in long_urls:
+            long_url, expires_at, redirect_policy = long_urls[short_code]
+            ttl = cache.ttl if expires_at is None else min(cache.ttl, _epoch(expires_at) - time.time())
+            cache.set(short_code, (long_url, _epoch(expires_at), redirect_policy), ttl=ttl)
+    logger.info(f"Cache de lookups aquecido com {len(long_urls)} códigos.")
+
+
+# Resultado de um lookup: (URL longa, expiração em epoch ou None, política de redirecionamento ou None)
+Mapping = tuple[str, float | None, str | None]
+
+
+def _epoch(value: datetime | None) -> float | None:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)  # O SQLite devolve a data sem fuso (gravada em UTC)
+    return value.timestamp()
+
+
+async def _fetch_long_url_fast(pool, short_code: str) -> Mapping | None:
+    """Lookup pelo pool asyncpg (caminho rápido)."""
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Fast lookup pool is not available")
+    row = await fast_lookup.get_long_url(pool, short_code)
+    return (row[0], _epoch(row[1]), row[2]) if row is not None else None
+
+
+async def _fetch_long_url_orm(short_code: str) -> Mapping | None:
+    """Caminho original via SQLAlchemy ORM."""
+    # Sessão somente leitura (sem o commit automático de database.get_db): no shard dono do código
+    # ou numa réplica se houver; "não encontrado" na réplica é repetido no primário (código recém-criado)
+    if sharding.ENABLED:
+        db_url_map = await sharding.lookup(short_code, lambda db: crud.get_url_by_short_code(db, short_code))
+    else:
+        db_url_map = await database.read_from_replica(lambda db: crud.get_url_by_short_code(db, short_code))
+    if db_url_map is None:
+        return None
+    return db_url_map.long_url, _epoch(db_url_map.expires_at), db_url_map.redirect_policy
+
+
+def _check_expiry(short_code: str, mapping: Mapping, source: str, cache: RedirectCache) -> Mapping:
+    """Links expirados viram 410 (e ficam no cache como GONE)."""
+    expires_at = mapping[1]
+    if expires_at is not None and expires_at <= time.time():
+        cache.set_gone(short_code)
+        logs.log_request("Code expired", short_code=short_code, backend=source)
+        raise HTTPException(status_code=410, detail="Short URL has expired")
+    logs.log_request("Code found", short_code=short_code, backend=source)
+    return mapping
+
+
+async def lookup_mapping(state, short_code: str, backend: str) -> Mapping:
+    """
+    Busca primeiro no snapshot mmap e no cache em memória (sem I/O); o que não
+    estiver neles segue para o banco, coalescendo requisições simultâneas.
+    Código inexistente ou expirado vira HTTPException (404/410).
+    Também chamada direto pelo gateway no modo monolito (`state` = app.state).
+    """
+    cache: RedirectCache = state.lookup_cache
+    snapshot: SnapshotStore | None = state.snapshot
+    mapping = snapshot.get(short_code) if snapshot is not None else None
+    if mapping is not None:
+        return _check_expiry(short_code, mapping, "snapshot", cache)
+
+    cached = cache.get(short_code)
+    if cached is RedirectCache.NOT_FOUND:
+        raise HTTPException(status_code=404, detail="Short code not found")
+    if cached is RedirectCache.GONE:
+        raise HTTPException(status_code=410, detail="Short URL has expired")
+    if cached is not None:
+        return _check_expiry(short_code, cached, "cache", cache)
+
+    flight: SingleFlight = state.lookup_flight
+    generation = cache.generation
+    if backend == "asyncpg" and not sharding.ENABLED:  # O pool asyncpg aponta só para o banco principal
+        pool = state.fast_pool
+        mapping = await flight.do(f"asyncpg:{short_code}", lambda: _fetch_long_url_fast(pool, short_code))
+    else:
+        mapping = await flight.do(f"orm:{short_code}", lambda: _fetch_long_url_orm(short_code))
+
+    if mapping is None:
+        if cache.generation == generation:
+            # Uma invalidação durante a consulta pode ser justamente a criação deste código
+            cache.set_not_found(short_code)
+        logs.log_request("Code not found", short_code=short_code)
+        raise HTTPException(status_code=404, detail="Short code not found")
+
+    expires_at = mapping[1]
+    # A entrada nunca vive além da expiração do link
+    ttl = cache.ttl if expires_at is None else min(cache.ttl, expires_at - time.time())
+    cache.set(short_code, mapping, ttl=ttl)
+    return _check_expiry(short_code, mapping, backend, cache)
+
+
+async def _lookup(request: Request, short_code: str, backend: str):
+    long_url, expires_at, redirect_policy = await lookup_mapping(request.app.state, short_code, backend)
+    # A URL no banco já foi validada ao ser criada
+    return JSONResponse({"long_url": long_url, "expires_at": expires_at, "redirect_policy": redirect_policy})
+
+
+@app.get("/internal/lookup/{short_code}")
+async def get_long_url_internal(request: Request, short_code: str):
+    """
+    Contrato interno com o gateway: a URL (validada ao ser criada) vai em texto
+    puro no corpo; a expiração, se houver, em X-Expires-At (epoch) e a política
+    de redirecionamento, se não for a padrão, em X-Redirect-Policy. Sem JSON.
+    """
+    long_url, expires_at, redirect_policy = await lookup_mapping(request.app.state, short_code, LOOKUP_BACKEND)
+    headers = {}
+    if expires_at is not None:
+        headers["X-Expires-At"] = repr(expires_at)
+    if redirect_policy is not None:
+        headers["X-Redirect-Policy"] = redirect_policy
+    return Response(content=long_url, media_type="text/plain", headers=headers)
+
+
+@app.get("/lookup-fast/{short_code}", response_model=models.OriginalURL)
+async def get_long_url_fast(request: Request, short_code: str):
+    """Mesma busca do /lookup, sempre pelo caminho rápido (asyncpg), para comparação."""
+    return await _lookup(request, short_code, "asyncpg")
 
 
 @app.get("/lookup/{short_code}", response_model=models.OriginalURL)
 async def get_long_url(
-        short_code: str,
-        db: AsyncSession = Depends(database.get_db)
+        request: Request,
+        short_code: str
 ):
     """
     Busca a URL longa correspondente ao short_code fornecido.
     Retorna a URL original ou 404 se não encontrada.
     """
-    print(f"Redirection Service looking up: {short_code}")  # Log
-    db_url_map = await crud.get_url_by_short_code(db, short_code)
+    return await _lookup(request, short_code, LOOKUP_BACKEND)
 
-    if db_url_map is None:
-        print(f"Redirection Service: Code {short_code} not found.")  # Log
-        raise HTTPException(status_code=404, detail="Short code not found")
 
-    print(f"Redirection Service found: {short_code} -> {db_url_map.long_url}")  # Log
-    return models.OriginalURL(long_url=db_url_map.long_url)
+# Linhas por INSERT ao gravar agregados de cliques
+CLICKS_CHUNK_SIZE = int(os.getenv("CLICKS_CHUNK_SIZE", "1000"))
+
+
+@app.post("/clicks", status_code=204)
+async def record_clicks(
+        clicks: list[models.ClickAggregate],
+        db: AsyncSession = Depends(database.get_db)
+):
+    """Recebe agregados de cliques do gateway e os grava em lote."""
+    # O upsert não aceita o mesmo código duas vezes no mesmo INSERT
+    merged: dict[str, models.ClickAggregate] = {}
+    for click in clicks:
+        current = merged.get(click.short_code)
+        if current is None:
+            merged[click.short_code] = click
+        else:
+            current.count += click.count
+            current.first_at = min(current.first_at, click.first_at)
+            current.last_at = max(current.last_at, click.last_at)
+    rows = list(merged.values())
+    for start in range(0, len(rows), CLICKS_CHUNK_SIZE):
+        await crud.record_clicks(db, rows[start:start + CLICKS_CHUNK_SIZE])
+
+
+# Tamanho máximo de página do GET /codes
+CODES_PAGE_MAX = int(os.getenv("CODES_PAGE_MAX", "50000"))
+# Linha vazia enviada pelo GET /codes/stream sem eventos, para o gateway detectar conexões mortas
+CODE_STREAM_HEARTBEAT = float(os.getenv("CODE_STREAM_HEARTBEAT", "10"))
+
+
+@app.get("/codes/shards")
+async def list_code_shards():
+    """Shards de url_mappings; os ids do GET /codes são sequenciais dentro de cada shard."""
+    return {"shards": [shard.name for shard in sharding.all_shards()]}
+
+
+@app.get("/codes")
+async def list_codes(after_id: int = 0, limit: int = 10000, shard: str = sharding.DEFAULT_SHARD.name):
+    """
+    Códigos emitidos com id > after_id em um shard, para o gateway montar seu
+    filtro de códigos existentes. Pagine passando o last_id da resposta como after_id.
+    """
+    limit = max(1, min(limit, CODES_PAGE_MAX))
+    target = sharding.get_shard(shard)
+    if target is None:
+        raise HTTPException(status_code=404, detail=f"Unknown shard: {shard}")
+    if sharding.ENABLED:
+        async with target.session_factory() as db:
+            rows = await crud.list_codes_after(db, after_id, limit)
+    else:
+        rows = await database.read_from_replica(
+            lambda db: crud.list_codes_after(db, after_id, limit), fallback_on_none=False
+        )
+    return {"codes": [code for _, code in rows], "last_id": rows[-1][0] if rows else after_id}
+
+
+@app.get("/codes/stream")
+async def stream_codes(request: Request):
+    """
+    Códigos criados a partir de agora, em NDJSON ({"codes": [...]} por evento do
+    LISTEN; {} na inscrição e a cada CODE_STREAM_HEARTBEAT segundos sem eventos).
+    O stream termina se a escuta cair ou o cliente ficar para trás: eventos podem
+    ter se perdido e o cliente deve ressincronizar pelo GET /codes.
+    Sem LISTEN ativo responde 501 (e não 503, que abriria o circuit breaker do gateway).
+    """
+    listener: ChangeListener = request.app.state.change_listener
+    queue = listener.subscribe()
+    if queue is None:
+        raise HTTPException(status_code=501, detail="Change stream unavailable")
+
+    async def events():
+        try:
+            yield b"{}\n"
+            while True:
+                try:
+                    codes = await asyncio.wait_for(queue.get(), CODE_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b"{}\n"
+                    continue
+                if codes is None:
+                    return
+                yield json.dumps({"codes": codes}).encode() + b"\n"
+        finally:
+            listener.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.get("/stats/singleflight")
+async def singleflight_stats(request: Request):
+    """Contadores de coalescência dos lookups concorrentes."""
+    return request.app.state.lookup_flight.stats()
+
+
+@app.get("/stats/cache")
+async def cache_stats(request: Request):
+    """Contadores do cache de lookups e da conexão LISTEN que o invalida."""
+    return {
+        **request.app.state.lookup_cache.stats(),
+        "listener": request.app.state.change_listener.stats(),
+    }
+
+
+@app.get("/stats/replicas")
+async def replica_stats():
+    """Saúde, atraso e carga de cada réplica de leitura."""
+    return database.replica_router.stats()
+
+
+@app.get("/stats/reaper")
+async def reaper_stats(request: Request):
+    """Execuções do reaper de links expirados e total de linhas removidas."""
+    reaper: ExpiryReaper | None = request.app.state.reaper
+    return reaper.stats() if reaper is not None else {"enabled": 0}
+
+
+@app.get("/stats/snapshot")
+async def snapshot_stats(request: Request):
+    """Estado do snapshot mmap (códigos carregados, hits, misses e recargas)."""
+    snapshot: SnapshotStore | None = request.app.state.snapshot
+    return snapshot.stats() if snapshot is not None else {"loaded": 0}
+
+
+@app.post("/admin/snapshot/reload")
+async def reload_snapshot(request: Request, x_admin_token: str | None = Header(None)):
+    """Força a troca pelo snapshot atual do disco sem esperar o próximo intervalo (exige X-Admin-Token)."""
+    if not logs.ADMIN_TOKEN or x_admin_token != logs.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    snapshot: SnapshotStore | None = request.app.state.snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=409, detail="Snapshot is disabled (SNAPSHOT_PATH not set)")
+    try:
+        reloaded = snapshot.reload()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"reloaded": reloaded, **snapshot.stats()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas do serviço no formato texto do Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/health", status_code=200)
 async def health_check():
     return {"status": "ok"}
+
+
+logger.info(f"main.py module loaded ({metrics.mark_startup('imported'):.3f}s after process start).")
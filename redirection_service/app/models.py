@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Index
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, Index, LargeBinary, text
 from pydantic import BaseModel, HttpUrl
 from .database import Base
 
@@ -12,11 +12,44 @@ class URLMap(Base):
     id = Column(Integer, primary_key=True, index=True)
     short_code = Column(String, unique=True, index=True, nullable=False)
     long_url = Column(String, nullable=False)
+    # Preenchido pelo shortening_service no modo de deduplicação
+    long_url_hash = Column(LargeBinary(32), unique=True, index=True, nullable=True)
+    # Links sem expiração ficam com NULL; o índice parcial só cobre os que expiram (usado pelo reaper)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Política de cache do redirecionamento (NULL = temporary, o padrão); ver RedirectPolicy no Shortening Service
+    redirect_policy = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_url_mappings_expires_at", "expires_at",
+            postgresql_where=text("expires_at IS NOT NULL"), sqlite_where=text("expires_at IS NOT NULL"),
+        ),
+    )
 
 
 # Index('ix_url_mappings_short_code', URLMap.short_code)
 
+
+# Contadores agregados de cliques por código (alimentados em lote pelo gateway)
+class LinkClicks(Base):
+    __tablename__ = 'link_clicks'
+
+    short_code = Column(String, primary_key=True)
+    click_count = Column(BigInteger, nullable=False, default=0)
+    first_click_at = Column(DateTime(timezone=True), nullable=False)
+    last_click_at = Column(DateTime(timezone=True), nullable=False)
+
 # --- Pydantic Models ---
 # Modelo usado na resposta do endpoint /lookup/{short_code}
 class OriginalURL(BaseModel):
     long_url: HttpUrl
+    expires_at: float | None = None  # Epoch em segundos; usado pelo gateway para limitar o TTL do cache
+    redirect_policy: str | None = None  # None = temporary
+
+
+# Agregado de cliques enviado pelo gateway para POST /clicks
+class ClickAggregate(BaseModel):
+    short_code: str
+    count: int
+    first_at: float  # Epoch em segundos
+    last_at: float
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+
+import asyncpg
+
+from . import database, fast_lookup, sharding
+from .cache import RedirectCache
+from .logs import logger
+
+# Canal em que o shortening_service publica os códigos criados/alterados (pg_notify)
+CHANGES_CHANNEL = os.getenv("URL_CHANGES_CHANNEL", "url_mapping_changes")
+LISTEN_RECONNECT_DELAY = float(os.getenv("LISTEN_RECONNECT_DELAY", "5"))
+LISTEN_HEALTH_INTERVAL = float(os.getenv("LISTEN_HEALTH_INTERVAL", "30"))
+CODE_STREAM_MAX_PENDING = int(os.getenv("CODE_STREAM_MAX_PENDING", "10000"))  # Eventos por assinante antes de derrubá-lo
+
+
+class ChangeListener:
+    """
+    Mantém uma conexão asyncpg dedicada com LISTEN no canal de alterações em
+    cada shard (o NOTIFY é publicado na transação do shard que recebeu o INSERT)
+    e invalida no cache os códigos recebidos. Eventos enviados enquanto uma
+    conexão estava caída se perdem, então o cache é limpo a cada reconexão.
+
+    Os códigos criados também são repassados aos assinantes (subscribe), como o
+    filtro de códigos do gateway via GET /codes/stream. A fila de um assinante
+    termina com None quando a conexão cai ou quando ele fica para trás: a partir
+    daí ele perdeu eventos e precisa se inscrever de novo.
+    """
+
+    def __init__(self, cache: RedirectCache):
+        self._cache = cache
+        self._tasks: list[asyncio.Task] = []
+        self._connected_shards: set[str] = set()
+        self.connected = False  # Todas as conexões (uma por shard) escutando
+        self.connections = 0
+        self.events = 0
+        self.invalidations = 0
+        self.errors = 0
+        self._subscribers: set[asyncio.Queue] = set()
+        self.dropped_subscribers = 0
+
+    def start(self):
+        """Inicia a escuta (apenas no Postgres)."""
+        if database.DIALECT != "postgresql":
+            logger.info("LISTEN/NOTIFY indisponível fora do Postgres; cache depende só do TTL.")
+            return
+        self._tasks = [
+            asyncio.create_task(self._run(shard.name, fast_lookup._connect_kwargs(shard.engine.url)))
+            for shard in sharding.all_shards()
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def subscribe(self) -> asyncio.Queue | None:
+        """Fila com as listas de códigos criados daqui em diante; None se a escuta não está ativa."""
+        if not self.connected:
+            return None
+        queue = asyncio.Queue(CODE_STREAM_MAX_PENDING)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _close_subscriber(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():  # Abre espaço para o None (o assinante vai se reinscrever de qualquer jeito)
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            self.errors += 1
+            logger.warning(f"Invalid change notification payload: {payload[:200]}")
+            return
+        self.events += 1
+        codes = event.get("codes", [])
+        for code in codes:
+            self._cache.invalidate(code)
+            self.invalidations += 1
+        if event.get("op") == "created" and codes:
+            for queue in list(self._subscribers):
+                try:
+                    queue.put_nowait(codes)
+                except asyncio.QueueFull:
+                    self.dropped_subscribers += 1
+                    self._close_subscriber(queue)
+
+    async def _run(self, shard: str, connect_kwargs: dict):
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(**connect_kwargs)
+                await conn.add_listener(CHANGES_CHANNEL, self._on_notification)
+                if reconnecting:
+                    self._cache.clear()
+                reconnecting = True
+                self._connected_shards.add(shard)
+                self.connected = len(self._connected_shards) == len(self._tasks)
+                self.connections += 1
+                logger.info(f"Escutando alterações no canal '{CHANGES_CHANNEL}' (shard {shard}).")
+                # Conexão ociosa: um SELECT periódico detecta quedas que não fecham o socket
+                while True:
+                    await asyncio.sleep(LISTEN_HEALTH_INTERVAL)
+                    await asyncio.wait_for(conn.fetchval("SELECT 1"), timeout=LISTEN_HEALTH_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error in change listener connection (shard {shard}): {e}")
+            finally:
+                if shard in self._connected_shards:
+                    # Os eventos deste shard se perdem até a reconexão: os assinantes precisam saber
+                    for queue in list(self._subscribers):
+                        self._close_subscriber(queue)
+                self._connected_shards.discard(shard)
+                self.connected = False
+                if conn is not None:
+                    conn.terminate()
+            await asyncio.sleep(LISTEN_RECONNECT_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "connected": int(self.connected),
+            "connected_shards": len(self._connected_shards),
+            "connections": self.connections,
+            "events": self.events,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "subscribers": len(self._subscribers),
+            "dropped_subscribers": self.dropped_subscribers,
+        }
@@ -0,0 +1,102 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+
+from . import metrics, models, sharding
+from .logs import logger
+
+# Remove em segundo plano os links expirados há mais de REAPER_GRACE_SECONDS.
+# Até lá eles continuam no banco e o lookup responde 410 (em vez de 404).
+REAPER_ENABLED = os.getenv("REAPER_ENABLED", "true").lower() in ("1", "true", "yes")
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+REAPER_GRACE_SECONDS = float(os.getenv("REAPER_GRACE_SECONDS", "86400"))
+REAPER_BATCH_PAUSE = float(os.getenv("REAPER_BATCH_PAUSE", "0.05"))  # Pausa entre lotes (folga para o tráfego)
+
+REAPED = metrics.Counter("redirection_reaper_deleted_total", "Links expirados removidos pelo reaper.", ("shard",))
+
+
+class ExpiryReaper:
+    """
+    Apaga os links expirados em lotes pequenos (cada um em sua própria transação),
+    usando o índice parcial de expires_at. Com várias instâncias rodando, o
+    FOR UPDATE SKIP LOCKED faz cada uma pegar linhas diferentes em vez de esperar.
+    """
+
+    def __init__(self, interval: float = REAPER_INTERVAL, batch_size: int = REAPER_BATCH_SIZE,
+                 grace: float = REAPER_GRACE_SECONDS, pause: float = REAPER_BATCH_PAUSE):
+        self._interval = interval
+        self._batch_size = batch_size
+        self._grace = grace
+        self._pause = pause
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.deleted = 0
+        self.errors = 0
+        self.last_run_at = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _reap_batch(self, shard: sharding.Shard, cutoff: datetime) -> int:
+        table = models.URLMap.__table__
+        expired_ids = (
+            select(table.c.id)
+            .where(table.c.expires_at.is_not(None), table.c.expires_at < cutoff)
+            .limit(self._batch_size)
+            .with_for_update(skip_locked=True)  # Ignorado pelo SQLite
+        )
+        async with shard.session_factory() as db:
+            result = await db.execute(delete(table).where(table.c.id.in_(expired_ids)))
+            await db.commit()
+        return result.rowcount
+
+    async def reap(self) -> int:
+        """Remove todos os links vencidos há mais que a carência; retorna quantos foram apagados."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self._grace)
+        total = 0
+        for shard in sharding.all_shards():
+            while True:
+                deleted = await self._reap_batch(shard, cutoff)
+                if deleted:
+                    REAPED.inc(shard.name, amount=deleted)
+                    total += deleted
+                if deleted < self._batch_size:
+                    break
+                await asyncio.sleep(self._pause)
+        self.runs += 1
+        self.deleted += total
+        self.last_run_at = datetime.now(timezone.utc).timestamp()
+        if total:
+            logger.info(f"Reaper removeu {total} links expirados.")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error reaping expired links: {e}")
+            await asyncio.sleep(self._interval)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "errors": self.errors,
+            "last_run_at": self.last_run_at,
+            "grace_seconds": self._grace,
+        }
@@ -0,0 +1,251 @@
+"""
+Sharding de url_mappings entre vários bancos por hashing consistente do short_code.
+
+Cada código pertence a exatamente um shard, então um lookup consulta um único
+banco (sem fan-out). O banco principal (database.engine) continua guardando a
+sequence de códigos, os cliques e demais tabelas auxiliares.
+
+SHARD_MAP="s0=postgresql+asyncpg://...,s1=postgresql+asyncpg://..." ativa o
+sharding; vazio = um único shard "default" no banco principal.
+
+Rebalanceamento online ao adicionar shards:
+    1. Publicar SHARD_MAP com o mapa novo e SHARD_MAP_PREVIOUS com o antigo
+       (lookups não encontrados no dono novo são repetidos no dono antigo).
+    2. python -m app.sharding copy      # copia em lotes as linhas que mudaram de dono
+    3. Remover SHARD_MAP_PREVIOUS.
+    4. python -m app.sharding cleanup   # apaga as linhas dos shards que não são mais donos
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import sys
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import database, models
+from .logs import logger
+
+SHARD_MAP = os.getenv("SHARD_MAP", "")
+SHARD_MAP_PREVIOUS = os.getenv("SHARD_MAP_PREVIOUS", "")  # Só durante um rebalanceamento
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))  # Pontos de cada shard no anel
+
+T = TypeVar("T")
+
+
+def parse_shard_map(spec: str) -> dict[str, str]:
+    """'nome=url,nome=url' -> {nome: url}."""
+    shards = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, separator, url = entry.partition("=")
+        if not separator or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid SHARD_MAP entry: {entry!r} (expected name=url)")
+        shards[name.strip()] = url.strip()
+    return shards
+
+
+class Shard:
+    """Um banco que guarda parte de url_mappings."""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    def __repr__(self):
+        return f"Shard({self.name!r})"
+
+
+# Engines compartilhadas entre o mapa atual e o anterior (mesma URL = mesmo pool)
+_engines = {database.DATABASE_URL: database.engine}
+
+
+def _engine_for(url: str):
+    if url not in _engines:
+        _engines[url] = database._create_engine(url)
+    return _engines[url]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class ShardRing:
+    """Anel de hashing consistente com nós virtuais: adicionar um shard move só ~1/N dos códigos."""
+
+    def __init__(self, shard_urls: dict[str, str], vnodes: int = SHARD_VNODES):
+        if not shard_urls:
+            raise ValueError("Shard map is empty")
+        self.shards = [Shard(name, _engine_for(url)) for name, url in shard_urls.items()]
+        points = sorted((_hash(f"{shard.name}#{i}"), shard) for shard in self.shards for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, short_code: str) -> Shard:
+        index = bisect.bisect(self._hashes, _hash(short_code)) % len(self._hashes)
+        return self._owners[index]
+
+    def get(self, name: str) -> Shard | None:
+        return next((shard for shard in self.shards if shard.name == name), None)
+
+
+ENABLED = bool(SHARD_MAP)
+ring = ShardRing(parse_shard_map(SHARD_MAP)) if ENABLED else None
+previous_ring = ShardRing(parse_shard_map(SHARD_MAP_PREVIOUS)) if ENABLED and SHARD_MAP_PREVIOUS else None
+DEFAULT_SHARD = Shard("default", database.engine)
+
+if ENABLED:
+    logger.info(f"Sharding ativo com {len(ring.shards)} shards: {[shard.name for shard in ring.shards]}")
+
+
+def shard_for(short_code: str) -> Shard:
+    """Shard dono do código (o banco principal se o sharding estiver desativado)."""
+    return ring.shard_for(short_code) if ENABLED else DEFAULT_SHARD
+
+
+def all_shards() -> list[Shard]:
+    return ring.shards if ENABLED else [DEFAULT_SHARD]
+
+
+def get_shard(name: str) -> Shard | None:
+    return ring.get(name) if ENABLED else (DEFAULT_SHARD if name == DEFAULT_SHARD.name else None)
+
+
+def group_by_shard(items: list, code: Callable) -> dict[Shard, list]:
+    """Agrupa itens pelo shard dono de code(item), preservando a ordem."""
+    groups: dict[Shard, list] = {}
+    for item in items:
+        groups.setdefault(shard_for(code(item)), []).append(item)
+    return groups
+
+
+async def lookup(short_code: str, fn: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """
+    Executa a leitura fn(session) no shard dono do código. Durante um
+    rebalanceamento, um resultado None é repetido no dono pelo mapa anterior.
+    """
+    owner = shard_for(short_code)
+    async with owner.session_factory() as session:
+        result = await fn(session)
+    if result is None and previous_ring is not None:
+        previous_owner = previous_ring.shard_for(short_code)
+        if previous_owner.engine is not owner.engine:
+            async with previous_owner.session_factory() as session:
+                result = await fn(session)
+    return result
+
+
+# --- Ferramenta de rebalanceamento ---
+
+def _insert_ignore(engine, table):
+    insert = sqlite_insert if engine.dialect.name == "sqlite" else pg_insert
+    return insert(table)
+
+
+async def _scan(shard: Shard, batch_size: int):
+    """Percorre url_mappings do shard em lotes por id (paginação por chave)."""
+    table = models.URLMap.__table__
+    last_id = 0
+    while True:
+        async with shard.engine.connect() as conn:
+            rows = (await conn.execute(
+                select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            )).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield rows
+
+
+async def copy_moved_rows(batch_size: int = 1000) -> dict:
+    """
+    Copia para o dono novo as linhas cujo dono mudou entre SHARD_MAP_PREVIOUS e SHARD_MAP.
+
+    Qualquer conflito de unicidade é ignorado no INSERT. Uma linha recusada cujo
+    short_code já está no destino (cópia repetida) é contada em `already_present`.
+    As demais bateram no índice único de long_url_hash (linhas gravadas com
+    SHORTEN_DEDUP antes do sharding: a mesma URL já tem outro código no destino)
+    e são gravadas de novo sem o hash, contadas em `hash_cleared`: o código
+    continua redirecionando, só deixa de ser o devolvido pela deduplicação. Sem isso, o cleanup apagaria a única cópia do código.
+    """
+    if not ENABLED or previous_ring is None:
+        raise RuntimeError("SHARD_MAP and SHARD_MAP_PREVIOUS must both be set to copy rows")
+    table = models.URLMap.__table__
+    columns = [column.name for column in table.columns if column.name != "id"]  # id é local de cada shard
+    stats = {"copied": 0, "already_present": 0, "hash_cleared": 0}
+    for source in previous_ring.shards:
+        scanned = 0
+        started = time.perf_counter()
+        async for rows in _scan(source, batch_size):
+            scanned += len(rows)
+            moved: dict[Shard, list[dict]] = {}
+            for row in rows:
+                target = ring.shard_for(row["short_code"])
+                if target.engine is not source.engine:
+                    moved.setdefault(target, []).append({column: row[column] for column in columns})
+            for target, values in moved.items():
+                async with target.engine.begin() as conn:
+                    stmt = _insert_ignore(target.engine, table).values(values)
+                    stmt = stmt.on_conflict_do_nothing().returning(table.c.short_code)
+                    inserted = set((await conn.execute(stmt)).scalars())
+                    refused = [value for value in values if value["short_code"] not in inserted]
+                    if refused:
+                        present = set((await conn.execute(
+                            select(table.c.short_code).where(table.c.short_code.in_([value["short_code"] for value in refused]))
+                        )).scalars())
+                        hash_conflicts = [{**value, "long_url_hash": None} for value in refused
+                                          if value["short_code"] not in present]
+                        if hash_conflicts:
+                            await conn.execute(_insert_ignore(target.engine, table).values(hash_conflicts)
+                                               .on_conflict_do_nothing())
+                        stats["already_present"] += len(present)
+                        stats["hash_cleared"] += len(hash_conflicts)
+                stats["copied"] += len(values) - len(refused)
+            print(f"[copy] {source.name}: {scanned} linhas lidas, {stats['copied']} copiadas, "
+                  f"{stats['already_present']} já presentes, {stats['hash_cleared']} sem hash de dedup "
+                  f"({scanned / (time.perf_counter() - started):.0f} linhas/s)", file=sys.stderr)
+    return stats
+
+
+async def delete_unowned_rows(batch_size: int = 1000) -> int:
+    """Apaga de cada shard as linhas que pertencem a outro shard pelo SHARD_MAP atual."""
+    if not ENABLED:
+        raise RuntimeError("SHARD_MAP must be set to clean up shards")
+    if previous_ring is not None:
+        raise RuntimeError("Remove SHARD_MAP_PREVIOUS (and redeploy) before cleaning up")
+    table = models.URLMap.__table__
+    deleted = 0
+    for shard in ring.shards:
+        async for rows in _scan(shard, batch_size):
+            foreign = [row["short_code"] for row in rows if ring.shard_for(row["short_code"]).engine is not shard.engine]
+            if foreign:
+                async with shard.engine.begin() as conn:
+                    await conn.execute(delete(table).where(table.c.short_code.in_(foreign)))
+                deleted += len(foreign)
+        print(f"[cleanup] {shard.name}: {deleted} linhas removidas até agora", file=sys.stderr)
+    return deleted
+
+
+def main(argv: list[str]):
+    if not argv or argv[0] not in ("copy", "cleanup"):
+        print("Uso: python -m app.sharding copy|cleanup [tamanho_do_lote]", file=sys.stderr)
+        sys.exit(2)
+    batch_size = int(argv[1]) if len(argv) > 1 else 1000
+    if argv[0] == "copy":
+        stats = asyncio.run(copy_moved_rows(batch_size))
+        print(f"{stats['copied']} linhas copiadas, {stats['already_present']} já presentes, "
+              f"{stats['hash_cleared']} copiadas sem hash de dedup", file=sys.stderr)
+    else:
+        count = asyncio.run(delete_unowned_rows(batch_size))
+        print(f"{count} linhas removidas", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,372 @@
+"""
+Cache de lookups em memória compartilhada entre os workers do uvicorn de um host.
+
+Com --workers N, o RedirectCache (um OrderedDict por processo) é duplicado N
+vezes e aquecido N vezes. Este backend guarda a tabela em um arquivo mapeado em
+memória (por padrão em /dev/shm, ou seja, RAM), aberto por todos os workers: a
+memória não cresce com o número de workers, e um worker novo (ou reiniciado)
+já encontra o cache quente.
+
+Layout: tabela hash de endereçamento aberto, de tamanho fixo, com sondagem
+linear limitada a PROBE_LIMIT slots. Cada slot tem tamanho fixo:
+    crc32 (I) | época (I) | estado (B) | tamanho do código (B) | tamanho da URL (H)
+    | política de redirecionamento (B) | prazo no cache (d, epoch) | expiração do link (d, 0 = não expira)
+    | código (KEY_BYTES) | URL (SHARED_CACHE_MAX_URL_BYTES)
+
+Leituras não usam lock: o slot é copiado e o crc32 é conferido, então uma
+leitura que cruza com uma escrita vira um miss. Escritas pegam um lock fcntl
+dos stripes que cobrem a janela de sondagem, então dois workers nunca gravam a
+mesma janela ao mesmo tempo. clear() só incrementa a época do cabeçalho, e os
+slots de épocas anteriores passam a valer como vazios.
+
+O cabeçalho guarda também o processo mestre (uvicorn --workers) que usa a
+tabela: o primeiro worker de um mestre novo (um deploy ou reinício do serviço)
+troca a época, e entradas de outra implantação nunca são servidas.
+"""
+import fcntl
+import glob
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+from .cache import RedirectCache
+
+# URLs maiores que isso não entram no cache compartilhado (seguem para o banco)
+SHARED_CACHE_MAX_URL_BYTES = int(os.getenv("SHARED_CACHE_MAX_URL_BYTES", "512"))
+SHARED_CACHE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+# Sufixo do nome padrão do arquivo, por implantação; vazio = PID do processo mestre (ver default_path)
+SHARED_CACHE_NAMESPACE = os.getenv("SHARED_CACHE_NAMESPACE", "")
+
+MAGIC = b"USHC"
+VERSION = 3  # 2: política de redirecionamento no slot; 3: mestre dono no cabeçalho
+HEADER = struct.Struct("<4sIIIII")  # magic | versão | slots | largura da URL | época | mestre dono
+EPOCH_OFFSET = 16
+OWNER_OFFSET = 20
+HEADER_SIZE = 64
+SLOT_HEAD = struct.Struct("<IIBBHBdd")
+KEY_BYTES = 32
+PROBE_LIMIT = 8
+STRIPE_SLOTS = 64  # Slots por stripe de lock (>= PROBE_LIMIT: uma janela cobre no máximo 2 stripes)
+EPOCH_LOCK = 1 << 30  # Byte do lock do clear(), fora da faixa dos stripes
+IN_USE_LOCK = EPOCH_LOCK + 1  # Lock compartilhado mantido por quem tem a tabela aberta (ver default_path)
+
+EMPTY, TOMBSTONE, MAPPING, NOT_FOUND, GONE = range(5)
+POLICIES = (None, "cacheable", "permanent")  # None = temporary
+
+
+class SharedRedirectCache:
+    """
+    Mesma interface do RedirectCache, com os dados em um arquivo mmap
+    compartilhado. O primeiro worker cria o arquivo (ou o esvazia, se era de
+    outro mestre) e fica com `created`; os demais o reabrem.
+    Os contadores (hits, misses...) são de cada processo.
+    """
+
+    NOT_FOUND = RedirectCache.NOT_FOUND
+    GONE = RedirectCache.GONE
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0,
+                 max_url_bytes: int = SHARED_CACHE_MAX_URL_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.url_bytes = max_url_bytes
+        self.slot_size = SLOT_HEAD.size + KEY_BYTES + max_url_bytes
+        # Folga de 25% para a sondagem; os últimos PROBE_LIMIT slots evitam dar a volta na tabela
+        self.slots = math.ceil(max_entries * 4 / 3) + PROBE_LIMIT
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.oversize = 0
+        self.generation = 0
+        self.created = False
+        self._fd, self._mm = self._attach()
+        # Liberado pelo kernel quando o processo termina, em qualquer namespace de PID
+        fcntl.lockf(self._fd, fcntl.LOCK_SH, 1, IN_USE_LOCK)
+
+    def _attach(self):
+        size = HEADER_SIZE + self.slots * self.slot_size
+        expected = (MAGIC, VERSION, self.slots, self.url_bytes)
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            fd = None
+        if fd is not None:
+            if os.fstat(fd).st_size == size:
+                mm = _map(fd, size)
+                if HEADER.unpack_from(mm, 0)[:4] == expected:
+                    self._claim(fd, mm)
+                    return fd, mm
+                mm.close()
+            # Outro tamanho ou versão: um arquivo novo substitui o antigo (quem ainda o usa segue nele até reiniciar)
+            os.close(fd)
+        return self._create(size, replace=fd is not None)
+
+    def _create(self, size: int, replace: bool):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".shared-cache-")
+        try:
+            # Reserva a memória agora: no tmpfs cheio o erro sai no startup, e não como SIGBUS numa escrita
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            mm = _map(fd, size)
+            HEADER.pack_into(mm, 0, MAGIC, VERSION, self.slots, self.url_bytes, 0, _master_token())
+            if replace:
+                os.replace(tmp_path, self.path)
+            else:
+                try:
+                    os.link(tmp_path, self.path)  # Atômico: só um worker cria o arquivo
+                except FileExistsError:
+                    mm.close()
+                    os.close(fd)
+                    return self._attach()
+                finally:
+                    os.unlink(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            os.close(fd)
+            raise
+        self.created = True
+        return fd, mm
+
+    def _claim(self, fd: int, mm: mmap.mmap):
+        """Tabela de outro mestre (implantação anterior): troca a época e assume o cabeçalho."""
+        token = _master_token()
+        with _FileLock(fd, EPOCH_LOCK, 1):
+            if struct.unpack_from("<I", mm, OWNER_OFFSET)[0] == token:
+                return
+            epoch = struct.unpack_from("<I", mm, EPOCH_OFFSET)[0]
+            struct.pack_into("<II", mm, EPOCH_OFFSET, (epoch + 1) & 0xFFFFFFFF, token)
+        self.created = True
+
+    def _home(self, key: bytes) -> int:
+        return zlib.crc32(key) % (self.slots - PROBE_LIMIT)
+
+    def _epoch(self) -> int:
+        return struct.unpack_from("<I", self._mm, EPOCH_OFFSET)[0]
+
+    def _read(self, index: int, key: bytes, epoch: int):
+        """(estado, prazo, expiração do link, política, URL) se o slot guarda `key` íntegro na época atual, senão None."""
+        mm, offset = self._mm, HEADER_SIZE + index * self.slot_size
+        crc, slot_epoch, state, key_len, url_len, policy, deadline, link_expiry = SLOT_HEAD.unpack_from(mm, offset)
+        if state <= TOMBSTONE or slot_epoch != epoch or key_len != len(key) or url_len > self.url_bytes:
+            return None
+        body_start = offset + SLOT_HEAD.size
+        if mm[body_start:body_start + key_len] != key:
+            return None
+        url_start = body_start + KEY_BYTES
+        if zlib.crc32(mm[offset + 4:url_start + url_len]) != crc:
+            return None  # Escrita em andamento (ou slot corrompido): trata como miss
+        return state, deadline, link_expiry, policy, mm[url_start:url_start + url_len]
+
+    def get(self, short_code: str):
+        """Retorna o valor guardado, NOT_FOUND, GONE ou None se não houver entrada válida."""
+        key = short_code.encode()
+        if len(key) <= KEY_BYTES:
+            epoch = self._epoch()
+            home = self._home(key)
+            for index in range(home, home + PROBE_LIMIT):
+                if self._mm[HEADER_SIZE + index * self.slot_size + 8] == EMPTY:
+                    break
+                entry = self._read(index, key, epoch)
+                if entry is None:
+                    continue
+                state, deadline, link_expiry, policy, url = entry
+                if deadline <= time.time():
+                    self.expirations += 1
+                    break
+                if state == NOT_FOUND:
+                    self.negative_hits += 1
+                    return self.NOT_FOUND
+                if state == GONE:
+                    self.negative_hits += 1
+                    return self.GONE
+                self.hits += 1
+                return url.decode(), (link_expiry or None), POLICIES[policy]
+        self.misses += 1
+        return None
+
+    def set(self, short_code: str, mapping: tuple[str, float | None, str | None], ttl: float | None = None):
+        """Armazena um mapeamento encontrado: (URL, expiração em epoch ou None, política ou None)."""
+        long_url, link_expiry, policy = mapping
+        self._store(short_code, MAPPING, long_url, link_expiry or 0.0, self.ttl if ttl is None else ttl,
+                    POLICIES.index(policy) if policy in POLICIES else 0)
+
+    def set_not_found(self, short_code: str):
+        """Armazena um resultado negativo (código inexistente)."""
+        self._store(short_code, NOT_FOUND, "", 0.0, self.negative_ttl)
+
+    def set_gone(self, short_code: str):
+        """Armazena um link expirado (410) pelo mesmo tempo de um resultado negativo."""
+        self._store(short_code, GONE, "", 0.0, self.negative_ttl)
+
+    def _store(self, short_code: str, state: int, long_url: str, link_expiry: float, ttl: float, policy: int = 0):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        key, url = short_code.encode(), long_url.encode()
+        if len(key) > KEY_BYTES or len(url) > self.url_bytes:
+            self.oversize += 1
+            return
+        now = time.time()
+        body = SLOT_HEAD.pack(0, self._epoch(), state, len(key), len(url), policy, now + ttl, link_expiry)[4:]
+        body += key.ljust(KEY_BYTES, b"\0") + url
+        slot = struct.pack("<I", zlib.crc32(body)) + body
+        home = self._home(key)
+        with self._lock_window(home):
+            epoch = self._epoch()
+            target = free = None
+            oldest, oldest_deadline = home, math.inf
+            for index in range(home, home + PROBE_LIMIT):
+                entry = self._read(index, key, epoch)
+                if entry is not None:
+                    target = index
+                    break
+                offset = HEADER_SIZE + index * self.slot_size
+                _, slot_epoch, slot_state, _, _, _, deadline, _ = SLOT_HEAD.unpack_from(self._mm, offset)
+                if free is None and (slot_state <= TOMBSTONE or slot_epoch != epoch or deadline <= now):
+                    free = index
+                if slot_state == EMPTY:
+                    break  # A chave não pode estar depois de um slot vazio
+                if deadline < oldest_deadline:
+                    oldest, oldest_deadline = index, deadline
+            if target is None:
+                target = free
+            if target is None:
+                target = oldest  # Janela cheia: sai o que expiraria primeiro
+                self.evictions += 1
+            offset = HEADER_SIZE + target * self.slot_size
+            self._mm[offset:offset + len(slot)] = slot
+
+    def invalidate(self, short_code: str):
+        """Remove um código do cache, se presente."""
+        key = short_code.encode()
+        self.generation += 1
+        if len(key) > KEY_BYTES:
+            return
+        home = self._home(key)
+        with self._lock_window(home):
+            epoch = self._epoch()
+            for index in range(home, home + PROBE_LIMIT):
+                if self._read(index, key, epoch) is not None:
+                    self._mm[HEADER_SIZE + index * self.slot_size + 8] = TOMBSTONE
+
+    def clear(self):
+        """Invalida todas as entradas (de todos os workers) trocando a época."""
+        self.generation += 1
+        with _FileLock(self._fd, EPOCH_LOCK, 1):
+            struct.pack_into("<I", self._mm, EPOCH_OFFSET, (self._epoch() + 1) & 0xFFFFFFFF)
+
+    def _lock_window(self, home: int) -> "_FileLock":
+        first, last = home // STRIPE_SLOTS, (home + PROBE_LIMIT - 1) // STRIPE_SLOTS
+        return _FileLock(self._fd, first, last - first + 1)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def __len__(self):
+        """Slots ocupados (inclui entradas vencidas que ainda não foram sobrescritas)."""
+        start = HEADER_SIZE + 8
+        states = self._mm[start:start + self.slots * self.slot_size:self.slot_size]
+        return len(states) - states.count(EMPTY) - states.count(TOMBSTONE)
+
+    def stats(self) -> dict:
+        """Contadores deste worker; size e memory_bytes são da tabela compartilhada."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "oversize": self.oversize,
+            "slots": self.slots,
+            "memory_bytes": HEADER_SIZE + self.slots * self.slot_size,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+class _FileLock:
+    """Lock fcntl (entre processos) em uma faixa de bytes do arquivo do cache."""
+
+    def __init__(self, fd: int, start: int, length: int):
+        self._fd, self._start, self._length = fd, start, length
+
+    def __enter__(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self._length, self._start)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, self._length, self._start)
+
+
+def _map(fd: int, size: int) -> mmap.mmap:
+    return mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+
+
+def _master_pid() -> int:
+    """PID do mestre do uvicorn --workers (ou do próprio processo, sem workers)."""
+    parent = multiprocessing.parent_process()
+    return parent.pid if parent is not None else os.getpid()
+
+
+def _master_token() -> int:
+    """Identifica o mestre pelo PID e, no Linux, pelo instante em que começou (PIDs são reutilizados)."""
+    pid = _master_pid()
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat:
+            started = stat.read().rsplit(b")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        started = b""
+    return zlib.crc32(f"{pid}:".encode() + started)
+
+
+def _in_use(path: str) -> bool:
+    """True se algum processo ainda tem a tabela aberta (segura o lock IN_USE_LOCK)."""
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, IN_USE_LOCK)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def default_path(name: str) -> str:
+    """
+    Caminho do arquivo do cache em /dev/shm (ou no diretório temporário, fora do
+    Linux), único por implantação: `<name>-<SHARED_CACHE_NAMESPACE>` ou, sem ele,
+    `<name>-pid<PID do mestre>`. No segundo caso, os arquivos de outros mestres que
+    nenhum processo tem aberto são apagados (senão cada reinício deixaria uma tabela
+    na RAM). Chamar só no startup de quem usa o backend shared.
+    """
+    if SHARED_CACHE_NAMESPACE:
+        return os.path.join(SHARED_CACHE_DIR, f"{name}-{SHARED_CACHE_NAMESPACE}")
+    prefix = os.path.join(SHARED_CACHE_DIR, f"{name}-pid")
+    path = f"{prefix}{_master_pid()}"
+    for stale in glob.glob(glob.escape(prefix) + "*"):
+        # O arquivo do próprio mestre pode ter acabado de ser criado por outro worker, ainda sem o lock
+        if stale != path and stale[len(prefix):].isdigit() and not _in_use(stale):
+            try:
+                os.unlink(stale)
+            except FileNotFoundError:
+                pass
+    return path
@@ -0,0 +1,283 @@
+"""
+Snapshot binário, somente leitura e mapeado em memória, dos mapeamentos de URL.
+
+Formato (little-endian):
+    cabeçalho   MAGIC (4s) | versão (I) | largura do código (I) | quantidade (Q) | maior id incluído (Q)
+    códigos     quantidade * largura bytes, ordenados bytewise, completados com b"\\0"
+    offsets     (quantidade + 1) * Q, posição de cada URL dentro do blob
+    expirações  quantidade * Q, expires_at de cada código em epoch (0 = não expira)
+    políticas   quantidade * B, índice da redirect_policy de cada código em POLICIES
+    blob        URLs longas em UTF-8, concatenadas
+
+Vários workers do uvicorn mapeiam o mesmo arquivo e compartilham uma única cópia
+no page cache. A busca é binária sobre o array de códigos, sem I/O de rede.
+
+Gerar um snapshot (dentro de redirection_service/):
+    python -m app.snapshot build /data/url_snapshot.bin
+"""
+import asyncio
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+MAGIC = b"USNP"
+VERSION = 3  # 2: inclui a expiração de cada código; 3: inclui a política de redirecionamento
+HEADER = struct.Struct("<4sIIQQ")
+OFFSET = struct.Struct("<Q")
+POLICIES = (None, "cacheable", "permanent")  # None = temporary
+
+
+class Snapshot:
+    """Um arquivo de snapshot aberto via mmap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.code_width, self.count, self.max_id = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"Invalid snapshot file: {path}")
+        self._codes_start = HEADER.size
+        self._offsets_start = self._codes_start + self.count * self.code_width
+        self._expires_start = self._offsets_start + (self.count + 1) * OFFSET.size
+        self._policies_start = self._expires_start + self.count * OFFSET.size
+        self._blob_start = self._policies_start + self.count
+
+    def get(self, short_code: str) -> tuple[str, float | None, str | None] | None:
+        """Busca binária pelo código; retorna (URL longa, expiração, política) ou None se não estiver no snapshot."""
+        key = short_code.encode()
+        width = self.code_width
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b"\0")
+        mm, start = self._mm, self._codes_start
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            position = start + mid * width
+            candidate = mm[position:position + width]
+            if candidate < key:
+                low = mid + 1
+            elif candidate > key:
+                high = mid
+            else:
+                url_start, url_end = struct.unpack_from("<QQ", mm, self._offsets_start + mid * OFFSET.size)
+                (expires_at,) = OFFSET.unpack_from(mm, self._expires_start + mid * OFFSET.size)
+                long_url = mm[self._blob_start + url_start:self._blob_start + url_end].decode()
+                return long_url, (expires_at or None), POLICIES[mm[self._policies_start + mid]]
+        return None
+
+    def close(self):
+        self._mm.close()
+
+
+class SnapshotStore:
+    """
+    Mantém o snapshot atual e troca por um novo de forma atômica quando o
+    arquivo no caminho configurado é substituído (os.replace pelo build).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.current: Snapshot | None = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def get(self, short_code: str) -> tuple[str, float | None, str | None] | None:
+        snapshot = self.current
+        if snapshot is None:
+            return None
+        mapping = snapshot.get(short_code)
+        if mapping is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return mapping
+
+    def reload(self) -> bool:
+        """Abre o arquivo se ele mudou desde a última carga; retorna True se houve troca."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self.current is not None and self.current.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return False
+        new_snapshot = Snapshot(self.path)
+        old_snapshot, self.current = self.current, new_snapshot
+        # As buscas são síncronas (sem await no meio), então nenhuma está usando o mmap antigo
+        if old_snapshot is not None:
+            old_snapshot.close()
+        self.reloads += 1
+        return True
+
+    async def watch(self, interval: float):
+        """Verifica periodicamente se há um snapshot novo no disco."""
+        from .logs import logger
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.reload():
+                    logger.info(f"Snapshot recarregado: {self.current.count} códigos")
+            except Exception as e:
+                logger.error(f"Error reloading snapshot: {e}")
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+    def stats(self) -> dict:
+        return {
+            "loaded": int(self.current is not None),
+            "codes": self.current.count if self.current else 0,
+            "max_id": self.current.max_id if self.current else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
+
+
+def _url_table():
+    from . import models
+    return models.URLMap.__table__
+
+
+def _expires_epoch(expires_at: datetime | None) -> int:
+    """Expiração em epoch inteiro (arredondada para cima, para nunca antecipar o fim); 0 se não expira."""
+    if expires_at is None:
+        return 0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)  # SQLite devolve a data sem fuso (gravada em UTC)
+    return math.ceil(expires_at.timestamp())
+
+
+async def _open_consistent(stack: AsyncExitStack, shard):
+    """
+    Conexão do shard numa transação REPEATABLE READ (no Postgres), aberta até o fim
+    do build: largura, maior id e linhas saem da mesma foto do banco.
+    """
+    conn = await stack.enter_async_context(shard.engine.connect())
+    if shard.engine.dialect.name == "postgresql":
+        await conn.execution_options(isolation_level="REPEATABLE READ")
+    await stack.enter_async_context(conn.begin())
+    return conn
+
+
+async def _stream_sorted(conn, batch_size: int):
+    """(short_code, long_url, expires_at, redirect_policy) de um shard em ordem bytewise do código."""
+    table = _url_table()
+    code_column = table.c.short_code
+    if conn.dialect.name == "postgresql":
+        code_column = code_column.collate("C")  # Ordem bytewise, igual à busca binária
+    stream = await conn.stream(
+        select(table.c.short_code, table.c.long_url, table.c.expires_at, table.c.redirect_policy)
+        .order_by(code_column).execution_options(yield_per=batch_size)
+    )
+    async for row in stream:
+        yield row.short_code, row.long_url, row.expires_at, row.redirect_policy
+
+
+async def _merge_sorted(streams: list):
+    """Intercala streams assíncronos já ordenados (um por shard) mantendo a ordem global."""
+    heap = []
+    for index, stream in enumerate(streams):
+        first = await anext(stream, None)
+        if first is not None:
+            heap.append((first[0].encode(), index, first))
+    heapq.heapify(heap)
+    while heap:
+        _, index, item = heap[0]
+        yield item
+        following = await anext(streams[index], None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (following[0].encode(), index, following))
+
+
+async def build_snapshot(output_path: str, batch_size: int = 10000) -> int:
+    """
+    Gera um snapshot lendo url_mappings em streaming (memória constante) de
+    todos os shards e substitui o arquivo de destino atomicamente. Retorna a
+    quantidade de códigos. Cada shard é lido numa única transação, então um
+    código inserido durante o build não muda a largura calculada no início.
+    """
+    from . import sharding
+
+    table = _url_table()
+    async with AsyncExitStack() as stack:
+        connections = [await _open_consistent(stack, shard) for shard in sharding.all_shards()]
+        width, max_id = 1, 0
+        for conn in connections:
+            shard_width, shard_max_id = (await conn.execute(select(
+                func.coalesce(func.max(func.length(table.c.short_code)), 1), func.coalesce(func.max(table.c.id), 0)
+            ))).one()
+            width, max_id = max(width, shard_width), max(max_id, shard_max_id)
+        return await _write_snapshot(output_path, connections, width, max_id, batch_size)
+
+
+async def _write_snapshot(output_path: str, connections: list, width: int, max_id: int, batch_size: int) -> int:
+    """Escreve as partes do arquivo em temporários e troca o destino atomicamente."""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    count = 0
+    blob_size = 0
+    with tempfile.TemporaryFile(dir=directory) as codes_file, \
+            tempfile.TemporaryFile(dir=directory) as offsets_file, \
+            tempfile.TemporaryFile(dir=directory) as expires_file, \
+            tempfile.TemporaryFile(dir=directory) as policies_file, \
+            tempfile.TemporaryFile(dir=directory) as blob_file:
+        offsets_file.write(OFFSET.pack(0))
+        streams = [_stream_sorted(conn, batch_size) for conn in connections]
+        async for short_code, long_url, expires_at, redirect_policy in _merge_sorted(streams):
+            encoded_code, encoded_url = short_code.encode(), long_url.encode()
+            if len(encoded_code) > width:
+                # Deslocaria todos os slots seguintes do array de largura fixa
+                raise RuntimeError(f"Code {short_code!r} is longer than the snapshot width {width}")
+            codes_file.write(encoded_code.ljust(width, b"\0"))
+            expires_file.write(OFFSET.pack(_expires_epoch(expires_at)))
+            # Política desconhecida (versão mais nova do serviço) vale como a padrão
+            policies_file.write(bytes((POLICIES.index(redirect_policy) if redirect_policy in POLICIES else 0,)))
+            blob_file.write(encoded_url)
+            blob_size += len(encoded_url)
+            offsets_file.write(OFFSET.pack(blob_size))
+            count += 1
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, VERSION, width, count, max_id))
+                for part in (codes_file, offsets_file, expires_file, policies_file, blob_file):
+                    part.seek(0)
+                    while chunk := part.read(1 << 20):
+                        out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, output_path)  # Troca atômica: leitores veem o arquivo antigo ou o novo
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return count
+
+
+def main(argv: list[str]):
+    if len(argv) != 2 or argv[0] != "build":
+        print("Uso: python -m app.snapshot build <arquivo>", file=sys.stderr)
+        sys.exit(2)
+    count = asyncio.run(build_snapshot(argv[1]))
+    print(f"Snapshot gerado em {argv[1]} com {count} códigos", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
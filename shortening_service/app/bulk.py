@@ -0,0 +1,463 @@
+"""
+Importação e exportação em massa de url_mappings (CSV ou NDJSON), em streaming.
+
+O arquivo é lido em blocos de --batch-size linhas. A validação das URLs e a
+geração dos códigos (a permutação de utils.code_from_id) rodam em processos
+worker em paralelo, com no máximo 2 blocos por worker em andamento, então a
+memória não cresce com o tamanho do arquivo. No Postgres cada bloco entra por
+COPY em uma tabela temporária (no stand-in SQLite, por executemany) e segue
+para url_mappings com um único INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+
+Formato (o mesmo da exportação, então um export pode ser reimportado):
+    CSV      cabeçalho com long_url e, opcionalmente, short_code, expires_at e redirect_policy
+    NDJSON   um objeto {"long_url", "short_code"?, "expires_at"?, "redirect_policy"?} por linha
+             (ou só a URL como string JSON)
+expires_at aceita ISO 8601 (sem fuso = UTC) ou epoch em segundos.
+
+Códigos informados são mantidos. Um código que já existe no banco (ou que se
+repete no arquivo) não é importado e vai para o relatório --rejects, junto com
+as linhas inválidas. Linhas sem código recebem um código novo da sequence.
+
+Uso (dentro de shortening_service/, com as mesmas variáveis do serviço; "-" = stdin/stdout,
+.gz = comprimido):
+    python -m app.bulk import links.csv [--workers 8] [--batch-size 10000] [--rejects rejeitados.csv]
+    python -m app.bulk export backup.ndjson.gz
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import get_args
+
+import orjson
+from pydantic import HttpUrl, TypeAdapter, ValidationError
+from sqlalchemy import DateTime, String, column, insert, select, table, text
+
+from . import crud, database, migrate, models, sharding, utils
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "10000"))  # Linhas por bloco enviado aos workers
+PROGRESS_INTERVAL = 2.0  # Segundos entre as linhas de progresso no stderr
+
+COLUMNS = ("short_code", "long_url", "expires_at", "redirect_policy")
+# Códigos importados precisam ser seguros no caminho da URL (outros encurtadores usam - e _)
+CODE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+_TZ_HOURS_ONLY = re.compile(r"[+-]\d\d$")  # "+00" (formato do Postgres) -> "+00:00"
+
+_http_url_adapter = TypeAdapter(HttpUrl)
+
+# Linha válida: (linha no arquivo, código ou None, URL normalizada, expiração ou None, política ou None)
+Row = tuple[int, str | None, str, datetime | None, str | None]
+
+
+# --- Arquivos ---
+
+def detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    raise ValueError(f"Cannot infer the format of {path!r}; use --format csv|ndjson")
+
+
+def _open(path: str, mode: str):
+    """Abre o arquivo (ou stdin/stdout com "-"), descomprimindo/comprimindo .gz."""
+    binary = "b" in mode
+    if path == "-":
+        stream = sys.stdin if "r" in mode else sys.stdout
+        return open(stream.fileno(), mode, closefd=False, **({} if binary else {"newline": ""}))
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, **({} if binary else {"newline": "", "encoding": "utf-8"}))
+    return open(path, mode, **({} if binary else {"newline": "", "encoding": "utf-8"}))
+
+
+def _csv_chunks(stream, batch_size: int):
+    """Blocos [(linha, campos)] do CSV, junto com a posição de cada coluna de COLUMNS."""
+    reader = csv.reader(stream)
+    header = [name.strip().lower() for name in next(reader, [])]
+    if "long_url" not in header:
+        raise ValueError("The CSV header must include a long_url column")
+    columns = tuple(header.index(name) if name in header else None for name in COLUMNS)
+    chunk = []
+    for record in reader:
+        if not record:
+            continue
+        chunk.append((reader.line_num, record))
+        if len(chunk) >= batch_size:
+            yield columns, chunk
+            chunk = []
+    if chunk:
+        yield columns, chunk
+
+
+def _ndjson_chunks(stream, batch_size: int):
+    chunk = []
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        chunk.append((line_no, line))
+        if len(chunk) >= batch_size:
+            yield None, chunk
+            chunk = []
+    if chunk:
+        yield None, chunk
+
+
+# --- Validação (roda nos processos worker) ---
+
+def _parse_expiry(value) -> datetime | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace(".", "", 1).isdigit()):
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    if not isinstance(value, str):
+        raise ValueError("expires_at must be an ISO 8601 date or an epoch")
+    value = value.strip().replace("Z", "+00:00")
+    if _TZ_HOURS_ONLY.search(value):
+        value += ":00"
+    expires_at = datetime.fromisoformat(value)
+    if expires_at.tzinfo is None:
+        return expires_at.replace(tzinfo=timezone.utc)  # Sem fuso = UTC
+    return expires_at.astimezone(timezone.utc)
+
+
+def _validate(line: int, short_code, long_url, expires_at, redirect_policy) -> Row:
+    if short_code in (None, ""):
+        short_code = None
+    elif not isinstance(short_code, str) or not CODE_PATTERN.fullmatch(short_code):
+        raise ValueError(f"Invalid short_code {short_code!r}")
+    url = str(_http_url_adapter.validate_python(long_url))
+    expires_at = _parse_expiry(expires_at)
+    # Mesmas regras do models.URLBase: "temporary" (ou vazio) é gravado como NULL
+    if redirect_policy in (None, "", "temporary"):
+        redirect_policy = None
+    elif redirect_policy not in get_args(models.RedirectPolicy):
+        raise ValueError(f"Invalid redirect_policy {redirect_policy!r}")
+    elif redirect_policy == "permanent" and expires_at is not None:
+        raise ValueError("Permanent links cannot expire")
+    return line, short_code, url, expires_at, redirect_policy
+
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return f"Invalid URL: {error.errors()[0]['msg']}"
+    return str(error) or type(error).__name__
+
+
+def parse_chunk(fmt: str, columns: tuple | None, records: list) -> tuple[list[Row], list[tuple[int, str]]]:
+    """Valida um bloco de registros brutos; retorna (linhas válidas, [(linha, erro)])."""
+    rows, errors = [], []
+    for line, record in records:
+        try:
+            if fmt == "ndjson":
+                data = orjson.loads(record)
+                if isinstance(data, str):
+                    data = {"long_url": data}
+                if not isinstance(data, dict):
+                    raise ValueError("Each line must be a JSON object or a URL string")
+                values = tuple(data.get(name) for name in COLUMNS)
+            else:
+                values = tuple(
+                    record[index] if index is not None and index < len(record) else None for index in columns
+                )
+            rows.append(_validate(line, *values))
+        except ValueError as e:  # Inclui ValidationError e erros de JSON
+            errors.append((line, _error_message(e)))
+    return rows, errors
+
+
+def codes_for_ids(ids: list[int]) -> list[str]:
+    return [utils.code_from_id(code_id) for code_id in ids]
+
+
+# --- Escrita ---
+
+# Tabela temporária (por conexão) onde cada bloco é carregado antes de ir para url_mappings
+STAGING_DDL = {
+    "postgresql": "CREATE TEMP TABLE IF NOT EXISTS bulk_import_staging "
+                  "(short_code text, long_url text, expires_at timestamptz, redirect_policy text) ON COMMIT DELETE ROWS",
+    "sqlite": "CREATE TEMP TABLE IF NOT EXISTS bulk_import_staging "
+              "(short_code VARCHAR, long_url VARCHAR, expires_at DATETIME, redirect_policy VARCHAR)",
+}
+_staging = table(
+    "bulk_import_staging",
+    column("short_code", String), column("long_url", String), column("expires_at", DateTime(timezone=True)),
+    column("redirect_policy", String),
+)
+# Conflito no short_code: a linha fica de fora e o código não volta no RETURNING.
+# (O "WHERE true" evita a ambiguidade do SQLite entre ON CONFLICT e JOIN ... ON)
+MERGE_STAGING_SQL = text(
+    "INSERT INTO url_mappings (short_code, long_url, expires_at, redirect_policy) "
+    "SELECT short_code, long_url, expires_at, redirect_policy FROM bulk_import_staging WHERE true "
+    "ON CONFLICT (short_code) DO NOTHING RETURNING short_code"
+)
+
+
+async def _insert_on(session_factory, rows: list[Row]) -> set[str]:
+    """
+    Carrega as linhas na tabela temporária (COPY binário no Postgres, executemany
+    no SQLite) e as move para url_mappings com um único INSERT ... SELECT.
+    Retorna os códigos inseridos (os demais já existiam).
+    """
+    async with session_factory() as db:
+        dialect = db.bind.dialect.name
+        await db.execute(text(STAGING_DDL[dialect]))
+        if dialect == "postgresql":
+            raw = await (await db.connection()).get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                "bulk_import_staging", columns=COLUMNS,
+                records=[row[1:] for row in rows],
+            )
+        else:
+            await db.execute(insert(_staging), [
+                dict(zip(COLUMNS, row[1:])) for row in rows
+            ])
+        inserted = set((await db.execute(MERGE_STAGING_SQL)).scalars().all())
+        if dialect != "postgresql":
+            await db.execute(text("DELETE FROM bulk_import_staging"))
+        await crud.publish_changes(db, "created", list(inserted))
+        await db.commit()
+        return inserted
+
+
+async def _insert(rows: list[Row]) -> set[str]:
+    if not sharding.ENABLED:
+        return await _insert_on(database.async_session_factory, rows)
+    groups = sharding.group_by_shard(rows, lambda row: row[1])
+    parts = await asyncio.gather(*(_insert_on(shard.session_factory, part) for shard, part in groups.items()))
+    return set().union(*parts)
+
+
+class Importer:
+    """Leva os blocos validados ao banco, gera os códigos que faltam e contabiliza o progresso."""
+
+    def __init__(self, pool: ProcessPoolExecutor | None, workers: int, rejects):
+        self._pool = pool
+        self._workers = max(1, workers)
+        self._rejects = csv.writer(rejects) if rejects is not None else None
+        if self._rejects is not None:
+            self._rejects.writerow(("line", "short_code", "long_url", "reason"))
+        self.read = 0
+        self.inserted = 0
+        self.generated = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self._started = time.perf_counter()
+        self._last_progress = 0.0
+
+    async def run(self, fn, *args):
+        """Executa fn no pool de workers (ou no próprio processo com --workers 0)."""
+        if self._pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def _reject(self, line: int, short_code: str | None, long_url: str | None, reason: str):
+        if self._rejects is not None:
+            self._rejects.writerow((line, short_code or "", long_url or "", reason))
+
+    async def _new_codes(self, count: int) -> list[str]:
+        async with database.get_session() as db:
+            ids = await crud.reserve_code_ids(db, count)
+        step = -(-len(ids) // self._workers)
+        parts = await asyncio.gather(*(self.run(codes_for_ids, ids[i:i + step]) for i in range(0, len(ids), step)))
+        return [code for part in parts for code in part]
+
+    async def write(self, rows: list[Row], errors: list[tuple[int, str]]):
+        self.read += len(rows) + len(errors)
+        self.invalid += len(errors)
+        for line, message in errors:
+            self._reject(line, None, None, message)
+
+        # Códigos repetidos dentro do bloco: vale a primeira ocorrência
+        explicit, missing, seen = [], [], set()
+        for row in rows:
+            if row[1] is None:
+                missing.append(row)
+            elif row[1] in seen:
+                self.conflicts += 1
+                self._reject(row[0], row[1], row[2], "Duplicate short_code in file")
+            else:
+                seen.add(row[1])
+                explicit.append(row)
+
+        # Novas tentativas só para códigos gerados que colidiram com códigos existentes
+        for _ in range(utils.MAX_RETRIES):
+            generated = []
+            if missing:
+                codes = await self._new_codes(len(missing))
+                generated = [(row[0], code, *row[2:]) for row, code in zip(missing, codes)]
+            inserted = await _insert(explicit + generated)
+            for line, code, url, *_ in explicit:
+                if code not in inserted:
+                    self.conflicts += 1
+                    self._reject(line, code, url, "Short code already exists")
+            self.inserted += len(inserted)
+            self.generated += sum(1 for row in generated if row[1] in inserted)
+            explicit = []
+            missing = [(row[0], None, *row[2:]) for row in generated if row[1] not in inserted]
+            if not missing:
+                break
+        for line, _, url, _ in missing:
+            self.invalid += 1
+            self._reject(line, None, url, "Could not allocate a free short code")
+        self.progress()
+
+    def progress(self, final: bool = False):
+        now = time.perf_counter()
+        if not final and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        print(f"[import] {self.read} linhas lidas, {self.inserted} inseridas ({self.generated} com código novo), "
+              f"{self.conflicts} conflitos, {self.invalid} inválidas "
+              f"({self.read / max(now - self._started, 1e-9):.0f} linhas/s)", file=sys.stderr)
+
+    def stats(self) -> dict:
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "generated": self.generated,
+            "conflicts": self.conflicts,
+            "invalid": self.invalid,
+            "seconds": round(time.perf_counter() - self._started, 3),
+        }
+
+
+async def import_file(path: str, fmt: str | None = None, workers: int | None = None,
+                      batch_size: int = BULK_BATCH_SIZE, rejects_path: str | None = None) -> dict:
+    """Importa o arquivo para url_mappings; retorna os totais."""
+    fmt = detect_format(path, fmt)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    await migrate.ensure_all_schemas()
+    # spawn: os workers não herdam a thread de logging nem as conexões do processo principal
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) if workers > 0 else None
+    rejects = _open(rejects_path, "wt") if rejects_path else None
+    try:
+        importer = Importer(pool, workers, rejects)
+        chunks = _csv_chunks if fmt == "csv" else _ndjson_chunks
+        in_flight: list[asyncio.Future] = []
+        with _open(path, "rt" if fmt == "csv" else "rb") as stream:
+            for columns, records in chunks(stream, batch_size):
+                in_flight.append(asyncio.ensure_future(importer.run(parse_chunk, fmt, columns, records)))
+                # Memória constante: no máximo 2 blocos por worker em validação
+                if len(in_flight) >= 2 * max(1, workers):
+                    await importer.write(*await in_flight.pop(0))
+        for future in in_flight:
+            await importer.write(*await future)
+        importer.progress(final=True)
+        return importer.stats()
+    finally:
+        if rejects is not None:
+            rejects.close()
+        if pool is not None:
+            pool.shutdown()
+
+
+# --- Exportação ---
+
+def _format_expiry(expires_at: datetime | None) -> str | None:
+    if expires_at is None:
+        return None
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)  # SQLite guarda sem fuso (sempre UTC)
+    return expires_at.astimezone(timezone.utc).isoformat()
+
+
+# Consulta do COPY ... TO STDOUT; a expiração sai no mesmo formato de _format_expiry
+EXPORT_COPY_QUERY = (
+    "SELECT short_code, long_url, "
+    "to_char(expires_at AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US\"+00:00\"'), redirect_policy "
+    "FROM url_mappings"
+)
+
+
+async def _scan(shard: sharding.Shard, batch_size: int):
+    """Percorre url_mappings em lotes por id (paginação por chave)."""
+    table = models.URLMap.__table__
+    last_id = 0
+    while True:
+        async with shard.engine.connect() as conn:
+            rows = (await conn.execute(
+                select(table.c.id, table.c.short_code, table.c.long_url, table.c.expires_at, table.c.redirect_policy)
+                .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            )).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+async def export_file(path: str, fmt: str | None = None, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """Exporta url_mappings (todos os shards); retorna o número de linhas."""
+    fmt = detect_format(path, fmt)
+    await migrate.ensure_all_schemas()
+    exported = 0
+    started = time.perf_counter()
+    with _open(path, "wb") as out:
+        if fmt == "csv":
+            out.write(",".join(COLUMNS).encode() + b"\r\n")
+        for shard in sharding.all_shards():
+            if fmt == "csv" and shard.engine.dialect.name == "postgresql":
+                async with shard.engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    status = await raw.driver_connection.copy_from_query(EXPORT_COPY_QUERY, output=out, format="csv")
+                exported += int(status.split()[-1])  # "COPY <linhas>"
+            else:
+                async for rows in _scan(shard, batch_size):
+                    if fmt == "csv":
+                        buffer = io.StringIO()
+                        csv.writer(buffer).writerows(
+                            (row.short_code, row.long_url, _format_expiry(row.expires_at) or "", row.redirect_policy or "")
+                            for row in rows
+                        )
+                        out.write(buffer.getvalue().encode())
+                    else:
+                        out.write(b"".join(orjson.dumps({
+                            "short_code": row.short_code,
+                            "long_url": row.long_url,
+                            "expires_at": _format_expiry(row.expires_at),
+                            "redirect_policy": row.redirect_policy,
+                        }) + b"\n" for row in rows))
+                    exported += len(rows)
+                    print(f"[export] {shard.name}: {exported} linhas "
+                          f"({exported / (time.perf_counter() - started):.0f} linhas/s)", file=sys.stderr)
+    return exported
+
+
+def main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog="python -m app.bulk", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Importa um arquivo para url_mappings")
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=("csv", "ndjson"))
+    importer.add_argument("--workers", type=int, default=None, help="Processos de validação (padrão: CPUs; 0 = nenhum)")
+    importer.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    importer.add_argument("--rejects", help="CSV com as linhas não importadas e o motivo")
+    exporter = commands.add_parser("export", help="Exporta url_mappings para um arquivo")
+    exporter.add_argument("path")
+    exporter.add_argument("--format", choices=("csv", "ndjson"))
+    exporter.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        utils.check_code_key()
+        stats = asyncio.run(import_file(args.path, args.format, args.workers, args.batch_size, args.rejects))
+        print(json.dumps(stats), file=sys.stderr)
+    else:
+        count = asyncio.run(export_file(args.path, args.format, args.batch_size))
+        print(f"{count} linhas exportadas", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
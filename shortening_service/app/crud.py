@@ -1,11 +1,44 @@
+import json
+import os
+
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
 
-from . import models
+from . import database, models
+
+# Eventos de alteração publicados via NOTIFY (entregues só no commit); o redirection_service
+# escuta o canal e invalida seu cache de lookups. Sem efeito fora do Postgres.
+CHANGE_NOTIFY_ENABLED = os.getenv("CHANGE_NOTIFY_ENABLED", "true").lower() in ("1", "true", "yes")
+CHANGES_CHANNEL = os.getenv("URL_CHANGES_CHANNEL", "url_mapping_changes")
+NOTIFY_MAX_PAYLOAD = 7900  # O Postgres limita o payload do NOTIFY a 8000 bytes
+
+
+def _change_payloads(op: str, codes: list[str]) -> list[str]:
+    """Divide os códigos em payloads JSON {"op", "codes"} dentro do limite do NOTIFY."""
+    payloads, batch, size = [], [], 0
+    for code in codes:
+        if batch and size + len(code) + 3 > NOTIFY_MAX_PAYLOAD:
+            payloads.append(json.dumps({"op": op, "codes": batch}))
+            batch, size = [], 0
+        batch.append(code)
+        size += len(code) + 3
+    if batch:
+        payloads.append(json.dumps({"op": op, "codes": batch}))
+    return payloads
+
 
+async def publish_changes(db: AsyncSession, op: str, codes: list[str]):
+    """Enfileira eventos de alteração na transação atual (pg_notify só entrega após o commit)."""
+    if not CHANGE_NOTIFY_ENABLED or database.DIALECT != "postgresql" or not codes:
+        return
+    for payload in _change_payloads(op, codes):
+        await db.execute(select(func.pg_notify(CHANGES_CHANNEL, payload)))
 
+
+@database.timed_query("get_url_by_short_code")
 async def get_url_by_short_code(db: AsyncSession, short_code: str) -> models.URLMap | None:
     """Busca um mapeamento de URL pelo código curto."""
     result = await db.execute(
@@ -14,22 +47,146 @@ async def get_url_by_short_code(db: AsyncSession, short_code: str) -> models.URL
     return result.scalars().first()
 
 
+@database.timed_query("reserve_code_ids")
+async def reserve_code_ids(db: AsyncSession, count: int) -> list[int]:
+    """Reserva `count` IDs da sequence de códigos em uma única ida ao banco."""
+    if database.DIALECT != "postgresql":
+        return await _reserve_code_ids_counter(db, count)
+    result = await db.execute(
+        select(models.short_code_seq.next_value()).select_from(func.generate_series(1, count))
+    )
+    # A sequence começa em 1; os IDs de código começam em 0
+    return [value - 1 for value in result.scalars().all()]
+
+
+async def _reserve_code_ids_counter(db: AsyncSession, count: int) -> list[int]:
+    """Equivalente à sequence para bancos sem sequences: incrementa um contador com um upsert."""
+    counter = models.ShortCodeCounter.__table__
+    stmt = database.dialect_insert(counter).values(id=1, next_id=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[counter.c.id], set_={"next_id": counter.c.next_id + count}
+    ).returning(counter.c.next_id)
+    end = (await db.execute(stmt)).scalar_one()
+    await db.commit()
+    return list(range(end - count, end))
+
+
+@database.timed_query("create_url_mapping")
 async def create_url_mapping(db: AsyncSession, url_create: models.URLCreate) -> models.URLMap:
     """Cria um novo mapeamento de URL no banco."""
     # Cria a instância do modelo SQLAlchemy
     db_url_map = models.URLMap(
         short_code=url_create.short_code,
-        long_url=str(url_create.long_url)  # Armazena como string
+        long_url=str(url_create.long_url),  # Armazena como string
+        expires_at=url_create.expires_at,
+        redirect_policy=url_create.redirect_policy,
     )
     db.add(db_url_map)
     try:
+        await publish_changes(db, "created", [url_create.short_code])  # Faz o flush do INSERT antes
         await db.commit()
         await db.refresh(db_url_map)  # Atualiza o objeto com dados do DB (ex: ID)
         return db_url_map
     except IntegrityError:
         await db.rollback()
-        # Isso pode acontecer em uma condição de corrida rara se generate_unique_short_code falhar
+        # Só acontece se o código alocado coincidir com um código aleatório legado
         raise HTTPException(status_code=409, detail="Short code already exists (collision)")
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error during URL creation: {e}")
+
+
+@database.timed_query("create_url_mappings_bulk")
+async def create_url_mappings_bulk(db: AsyncSession, mappings: list[dict]) -> set[str]:
+    """
+    Insere vários mapeamentos ({"short_code", "long_url", "expires_at", "redirect_policy"}) com um único INSERT multi-linha.
+    Códigos que já existem são ignorados; retorna o conjunto de códigos efetivamente inseridos.
+    """
+    stmt = (
+        database.dialect_insert(models.URLMap)
+        .values(mappings)
+        .on_conflict_do_nothing(index_elements=[models.URLMap.short_code])
+        .returning(models.URLMap.short_code)
+    )
+    try:
+        result = await db.execute(stmt)
+        inserted = set(result.scalars().all())
+        await publish_changes(db, "created", list(inserted))
+        await db.commit()
+        return inserted
+    except Exception:
+        await db.rollback()
+        raise
+
+
+def _upsert_by_hash(mappings: list[dict]):
+    """
+    INSERT ... ON CONFLICT (long_url_hash) que devolve o short_code existente.
+    O DO UPDATE sem efeito é o que faz o RETURNING incluir a linha já existente.
+    """
+    stmt = database.dialect_insert(models.URLMap).values(mappings)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.URLMap.long_url_hash],
+        set_={"long_url_hash": stmt.excluded.long_url_hash},
+    ).returning(models.URLMap.short_code, models.URLMap.long_url_hash)
+
+
+@database.timed_query("create_or_get_url_mapping")
+async def create_or_get_url_mapping(db: AsyncSession, url_create: models.URLCreate, long_url_hash: bytes) -> str:
+    """
+    Modo de deduplicação: insere o mapeamento ou, se a URL já existir,
+    retorna o código existente. Verificação e inserção em uma única instrução.
+    """
+    stmt = _upsert_by_hash([{
+        "short_code": url_create.short_code,
+        "long_url": str(url_create.long_url),
+        "long_url_hash": long_url_hash,
+        "expires_at": None,  # A deduplicação só vale para links sem expiração e com a política padrão
+        "redirect_policy": None,
+    }])
+    try:
+        result = await db.execute(stmt)
+        short_code = result.first().short_code
+        await publish_changes(db, "created", [short_code])
+        await db.commit()
+        return short_code
+    except IntegrityError:
+        await db.rollback()
+        # Só acontece se o código alocado coincidir com um código aleatório legado
+        raise HTTPException(status_code=409, detail="Short code already exists (collision)")
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error during URL creation: {e}")
+
+
+@database.timed_query("upsert_url_mappings_bulk")
+async def upsert_url_mappings_bulk(db: AsyncSession, mappings: list[dict]) -> dict[bytes, str]:
+    """
+    Versão em lote de create_or_get_url_mapping. Os hashes devem ser únicos dentro
+    do lote. Retorna {long_url_hash: short_code} com códigos novos ou existentes.
+
+    O upsert só trata conflitos de long_url_hash: linhas cujo código alocado
+    coincide com um código legado ficam de fora do resultado (o chamador tenta de
+    novo com outros códigos), como no create_url_mappings_bulk. Se um desses
+    códigos for gravado entre a verificação e o INSERT, nada é salvo e o lote
+    inteiro volta para nova tentativa.
+    """
+    taken = set((await db.execute(
+        select(models.URLMap.short_code).where(models.URLMap.short_code.in_([row["short_code"] for row in mappings]))
+    )).scalars())
+    rows = [row for row in mappings if row["short_code"] not in taken]
+    if not rows:
+        await db.rollback()
+        return {}
+    try:
+        result = await db.execute(_upsert_by_hash(rows))
+        codes = {row.long_url_hash: row.short_code for row in result}
+        await publish_changes(db, "created", list(codes.values()))
+        await db.commit()
+        return codes
+    except IntegrityError:
+        await db.rollback()
+        return {}
+    except Exception:
+        await db.rollback()
+        raise
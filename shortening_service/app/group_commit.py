@@ -0,0 +1,99 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from . import metrics
+from .logs import logger
+
+# Grava um grupo de itens em uma única transação; retorna um resultado por item
+# (um Exception no lugar do resultado falha só aquele item)
+FlushFn = Callable[[list], Awaitable[list]]
+
+GROUP_SIZE = metrics.Histogram(
+    "shorten_group_commit_size", "Requisições gravadas por commit no modo group-commit.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+
+
+class GroupCommitter:
+    """
+    Junta requisições concorrentes que chegam dentro de uma janela curta (ou até
+    max_batch itens) e grava todas em uma única transação. Cada chamador só é
+    liberado depois do commit do grupo; se o grupo falhar, todos recebem o erro.
+    """
+
+    def __init__(self, flush: FlushFn, window: float = 0.002, max_batch: int = 256):
+        self._flush = flush
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self.groups = 0
+        self.items = 0
+        self.failed_groups = 0
+
+    async def submit(self, item) -> Any:
+        """Enfileira o item no grupo atual e aguarda o resultado após o commit."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._run(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]):
+        GROUP_SIZE.observe(len(batch))
+        self.groups += 1
+        self.items += len(batch)
+        try:
+            results = await self._flush([item for item, _ in batch])
+            if len(results) != len(batch):
+                # Sem um resultado por item não dá para saber de quem é cada um: o grupo todo falha
+                raise RuntimeError(f"Group flush returned {len(results)} results for {len(batch)} items")
+        except asyncio.CancelledError:
+            # Flush cancelado (ex.: desligamento): nenhum chamador fica esperando para sempre
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Shorten group flush was cancelled"))
+            raise
+        except Exception as e:
+            self.failed_groups += 1
+            logger.error(f"Error committing shorten group of {len(batch)}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue  # Chamador desistiu (cancelado); o item foi gravado mesmo assim
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """Grava o grupo pendente e aguarda os que estão em andamento (desligamento)."""
+        self._start_flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "groups": self.groups,
+            "items": self.items,
+            "failed_groups": self.failed_groups,
+            "avg_group_size": self.items / self.groups if self.groups else 0.0,
+            "pending": len(self._pending),
+        }
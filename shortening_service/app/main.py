@@ -1,13 +1,17 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import HttpUrl, TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 import asyncio
-import random
-import sys
+from datetime import datetime, timezone
 
 # Importa módulos locais do serviço
-from . import crud, models, utils, database
+from . import crud, models, utils, database, logs, metrics, migrate, sharding
+from .group_commit import GroupCommitter
+from .logs import logger
 
 # Carrega variáveis de ambiente do .env
 from dotenv import load_dotenv
@@ -17,47 +21,72 @@ load_dotenv()
 # --- Leitura e Verificação do BASE_URL ---
 BASE_URL = os.getenv("BASE_URL")
 if not BASE_URL:
-    print("ERRO CRÍTICO: Variável de ambiente BASE_URL não definida!", file=sys.stderr)
+    logger.critical("Variável de ambiente BASE_URL não definida!")
     # Em um cenário real, seria melhor lançar um erro aqui:
     # raise ValueError("BASE_URL environment variable not set")
     # Para este exemplo, usamos um fallback com aviso:
     BASE_URL = "http://localhost:8000"
-    print(f"AVISO: BASE_URL não definida, usando fallback: {BASE_URL}", file=sys.stderr)
+    logger.warning(f"BASE_URL não definida, usando fallback: {BASE_URL}")
 else:
-    print(f"INFO: BASE_URL definida como: {BASE_URL}", file=sys.stderr)
+    logger.info(f"BASE_URL definida como: {BASE_URL}")
 
 
 # --- Fim da Leitura do BASE_URL ---
 
+# Limites do endpoint em lote
+BATCH_MAX_ITEMS = int(os.getenv("SHORTEN_BATCH_MAX_ITEMS", "50000"))
+BATCH_CHUNK_SIZE = int(os.getenv("SHORTEN_BATCH_CHUNK_SIZE", "1000"))  # Linhas por INSERT
+
+# Modo de deduplicação: a mesma URL longa sempre retorna o mesmo código
+DEDUP_ENABLED = os.getenv("SHORTEN_DEDUP", "false").lower() in ("1", "true", "yes")
+
+# Group-commit: /shorten concorrentes dentro da janela (ou até o tamanho máximo) vão em uma única transação
+GROUP_COMMIT_ENABLED = os.getenv("SHORTEN_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("SHORTEN_GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("SHORTEN_GROUP_COMMIT_MAX_BATCH", "256"))
+
+_http_url_adapter = TypeAdapter(HttpUrl)
+
+
+async def _warm_pools():
+    """Abre as conexões do banco principal e de cada shard antes de o serviço ficar pronto."""
+    factories = {database.engine: database.async_session_factory}
+    for shard in sharding.all_shards():
+        factories.setdefault(shard.engine, shard.session_factory)
+    await asyncio.gather(*(database.warm_pool(factory) for factory in factories.values()))
+
 
 # --- Definição do Context Manager lifespan ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Context manager para ações de inicialização e finalização da aplicação.
-    Inclui um delay aleatório para mitigar race conditions na criação do DB.
+    O schema é migrado sob advisory lock (app.migrate): instâncias que sobem
+    juntas esperam só pela verificação de versão, sem delay aleatório.
     """
     # Obter o título da aplicação para logs mais claros
     app_title = app.title if hasattr(app, 'title') else "FastAPI App"
+    utils.check_code_key()
+    if DEDUP_ENABLED and sharding.ENABLED:
+        # long_url_hash só é único dentro de cada banco: com shards, a mesma URL ganharia um código por shard
+        raise RuntimeError("SHORTEN_DEDUP is not supported with SHARD_MAP (long_url_hash is unique per shard only)")
 
-    # --- ADICIONAR SLEEP ALEATÓRIO ---
-    startup_delay = random.uniform(0.1, 1.5)  # Espera entre 0.1 e 1.5 segundos
-    print(f"{app_title}: Waiting {startup_delay:.2f}s before DB init...", file=sys.stderr)
-    await asyncio.sleep(startup_delay)
-    # --- FIM DO SLEEP ---
-
-    print(f"{app_title}: Initializing database...", file=sys.stderr)
+    logger.info(f"{app_title}: Checking database schema...")
     try:
-        await database.init_db()
-        print(f"{app_title}: Database initialized.", file=sys.stderr)
+        await migrate.ensure_all_schemas()
+        await _warm_pools()
+        logger.info(f"{app_title}: Database ready.")
     except Exception as e:
-        print(f"ERROR during {app_title} DB initialization: {e}", file=sys.stderr)
+        logger.error(f"Error during {app_title} DB initialization: {e}")
         # Considerar relançar o erro em produção: raise e
 
+    logger.info(f"{app_title}: Ready {metrics.mark_startup('ready'):.3f}s after process start.")
     yield  # Aplicação roda aqui
 
     # Código a ser executado APÓS a aplicação finalizar (shutdown)
-    print(f"{app_title}: Closing down...", file=sys.stderr)
+    logger.info(f"{app_title}: Closing down...")
+    if group_committer is not None:
+        await group_committer.drain()
     # Código de limpeza (ex: fechar pool de conexão) iria aqui se necessário
 
 
@@ -74,9 +103,111 @@ app = FastAPI(
 )
 
 
+app.include_router(logs.admin_router("/admin"))
+app.add_middleware(metrics.MetricsMiddleware)
+
 # --- Fim da Criação do FastAPI ---
 
 
+# --- Alocador de Códigos Curtos ---
+async def _reserve_code_ids(count: int) -> list[int]:
+    """Reserva um bloco de IDs da sequence em uma sessão própria."""
+    async with database.get_session() as session:
+        return await crud.reserve_code_ids(session, count)
+
+
+code_allocator = utils.CodeAllocator(_reserve_code_ids)
+
+
+async def _save_mapping(db: AsyncSession, url_create: models.URLCreate, long_url_hash: bytes | None) -> str:
+    """Salva um mapeamento e retorna o código (o existente, no modo de deduplicação)."""
+    if long_url_hash is not None:
+        return await crud.create_or_get_url_mapping(db, url_create, long_url_hash)
+    return (await crud.create_url_mapping(db, url_create)).short_code
+
+
+async def _bulk_by_shard(db: AsyncSession, insert_fn, mappings: list[dict]):
+    """
+    Executa um INSERT em lote do crud no banco da requisição ou, com sharding,
+    um por shard em paralelo, juntando os resultados (set ou dict).
+    """
+    if not sharding.ENABLED:
+        return await insert_fn(db, mappings)
+
+    async def insert_on(shard: sharding.Shard, rows: list[dict]):
+        async with shard.session_factory() as shard_db:
+            return await insert_fn(shard_db, rows)
+
+    groups = sharding.group_by_shard(mappings, lambda mapping: mapping["short_code"])
+    parts = await asyncio.gather(*(insert_on(shard, rows) for shard, rows in groups.items()))
+    merged = type(parts[0])() if parts else set()
+    for part in parts:
+        merged.update(part)
+    return merged
+
+
+async def shorten_url(long_url: str, expires_at: datetime | None, db: AsyncSession,
+                      redirect_policy: str | None = None) -> str:
+    """
+    Gera um código único, salva o mapeamento e retorna a URL curta completa.
+    Recebe dados já validados e normalizados (pelo /shorten ou pelo gateway),
+    então nada aqui é validado de novo.
+    """
+    if group_committer is not None:
+        try:
+            full_short_url = await group_committer.submit((long_url, expires_at, redirect_policy))
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save URL mapping: {e}")
+        logs.log_request("Created short URL", short_url=full_short_url, group_commit=True)
+        return full_short_url
+
+    # 1-3. Alocar um código (sem consultar o banco) e salvar com um único INSERT
+    # (ou upsert pelo hash da URL no modo de deduplicação).
+    # Só há nova tentativa se o código coincidir com um código aleatório legado.
+    # Links com expiração nunca são deduplicados (não devem reaproveitar um link permanente, nem o contrário),
+    # e o mesmo vale para links com uma política de redirecionamento própria.
+    dedup = DEDUP_ENABLED and expires_at is None and redirect_policy is None
+    long_url_hash = utils.url_hash(long_url) if dedup else None
+    for attempt in range(utils.MAX_RETRIES):
+        try:
+            short_code = await code_allocator.next_code()
+        except Exception as e:
+            logger.error(f"Error allocating short code: {e}")  # Adiciona log
+            raise HTTPException(status_code=500, detail=f"Failed to generate unique code: {e}")
+
+        url_create_data = models.URLCreate.model_construct(
+            long_url=long_url,
+            short_code=short_code,
+            expires_at=expires_at,
+            redirect_policy=redirect_policy,
+        )
+
+        try:
+            if sharding.ENABLED:
+                async with sharding.shard_for(short_code).session_factory() as shard_db:
+                    saved_code = await _save_mapping(shard_db, url_create_data, long_url_hash)
+            else:
+                saved_code = await _save_mapping(db, url_create_data, long_url_hash)
+            break
+        except HTTPException as http_exc:
+            # Repassa exceções HTTP conhecidas do CRUD; 409 tenta o próximo código
+            if http_exc.status_code != 409 or attempt == utils.MAX_RETRIES - 1:
+                raise http_exc
+            logger.warning(f"Short code {short_code} collided with an existing code, retrying.")
+        except Exception as e:
+            # Captura outras exceções inesperadas do CRUD
+            logger.error(f"Error creating URL mapping: {e}")  # Adiciona log
+            raise HTTPException(status_code=500, detail=f"Failed to save URL mapping: {e}")
+
+    # 4. Construir a URL curta completa (BASE_URL é definida no nível do módulo)
+    full_short_url = f"{BASE_URL}/{saved_code}"
+    logs.log_request("Created short URL", short_code=saved_code)
+
+    return full_short_url
+
+
 # --- Definição das Rotas da API ---
 @app.post("/shorten", response_model=models.URLShortResponse, status_code=201)
 async def create_short_url(
@@ -87,37 +218,192 @@ async def create_short_url(
     Recebe uma URL longa e retorna a URL curta correspondente.
     Gera um código único, salva no banco e retorna a URL completa.
     """
-    # 1. Gerar código único
-    try:
-        short_code = await utils.generate_unique_short_code(db)
-    except Exception as e:
-        # Captura a exceção de generate_unique_short_code
-        print(f"ERROR generating unique code: {e}", file=sys.stderr)  # Adiciona log
-        raise HTTPException(status_code=500, detail=f"Failed to generate unique code: {e}")
-
-    # 2. Preparar dados para criação no DB
-    url_create_data = models.URLCreate(
-        long_url=url_item.long_url,
-        short_code=short_code
+    full_short_url = await shorten_url(str(url_item.long_url), url_item.expires_at, db, url_item.redirect_policy)
+    return models.URLShortResponse(short_url=full_short_url)
+
+
+@app.post("/internal/shorten", status_code=201)
+async def create_short_url_internal(
+        request: Request,
+        db: AsyncSession = Depends(database.get_db)
+):
+    """
+    Contrato interno com o gateway: corpo orjson {"long_url": str, "expires_at": epoch | null,
+    "redirect_policy"?: str} já validado e normalizado na entrada do sistema. Nada é validado de novo aqui.
+    """
+    payload = orjson.loads(await request.body())
+    expires_at = payload.get("expires_at")
+    full_short_url = await shorten_url(
+        payload["long_url"],
+        datetime.fromtimestamp(expires_at, timezone.utc) if expires_at is not None else None,
+        db,
+        payload.get("redirect_policy"),
     )
+    return ORJSONResponse({"short_url": full_short_url}, status_code=201)
 
-    # 3. Tentar criar o mapeamento no DB
+
+async def _read_batch_items(request: Request) -> list:
+    """
+    Lê o corpo do lote: uma lista JSON (de strings ou {"long_url": ...}),
+    um objeto {"long_urls": [...]} ou NDJSON (uma entrada por linha).
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
     try:
-        db_url_map = await crud.create_url_mapping(db, url_create_data)
-    except HTTPException as http_exc:
-        # Repassa exceções HTTP conhecidas do CRUD (ex: 409, 500)
-        raise http_exc
-    except Exception as e:
-        # Captura outras exceções inesperadas do CRUD
-        print(f"ERROR creating URL mapping: {e}", file=sys.stderr)  # Adiciona log
-        raise HTTPException(status_code=500, detail=f"Failed to save URL mapping: {e}")
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            return [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        data = orjson.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+    if isinstance(data, dict):
+        data = data.get("long_urls")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a list of URLs")
+    return data
 
-    # 4. Construir a URL curta completa (BASE_URL é definida no nível do módulo)
-    full_short_url = f"{BASE_URL}/{db_url_map.short_code}"
-    print(f"INFO: Created short URL: {full_short_url} for {url_item.long_url}", file=sys.stderr)  # Adiciona log
 
-    # 5. Retornar a resposta
-    return models.URLShortResponse(short_url=full_short_url)
+# Item válido do lote: (posição na entrada, URL longa, expiração ou None, política de redirecionamento ou None)
+BatchItem = tuple[int, str, datetime | None, str | None]
+
+
+def _batch_result(index: int, short_url: str | None = None, error: str | None = None) -> dict:
+    """Item de models.URLBatchResponse como dict: a URL curta é montada aqui e não precisa de nova validação."""
+    return {"index": index, "short_url": short_url, "error": error}
+
+
+async def _save_batch_chunk(db: AsyncSession, chunk: list[BatchItem], results: list) -> list[BatchItem]:
+    """Insere um bloco do lote; retorna os itens que não puderam ser salvos."""
+    pending = chunk
+    # Novas tentativas só para códigos que colidiram com códigos legados
+    for _ in range(utils.MAX_RETRIES):
+        codes = await code_allocator.next_codes(len(pending))
+        inserted = await _bulk_by_shard(
+            db, crud.create_url_mappings_bulk,
+            [{"short_code": code, "long_url": url, "expires_at": expires_at, "redirect_policy": policy}
+             for (_, url, expires_at, policy), code in zip(pending, codes)],
+        )
+        retry = []
+        for item, code in zip(pending, codes):
+            if code in inserted:
+                results[item[0]] = _batch_result(item[0], short_url=f"{BASE_URL}/{code}")
+            else:
+                retry.append(item)
+        pending = retry
+        if not pending:
+            break
+    return pending
+
+
+async def _save_batch_chunk_dedup(db: AsyncSession, chunk: list[BatchItem], results: list) -> list[BatchItem]:
+    """Versão com deduplicação: um upsert pelo hash da URL para o bloco inteiro."""
+    # Links com expiração ou com política própria não são deduplicados
+    unique = [item for item in chunk if item[2] is not None or item[3] is not None]
+    pending = await _save_batch_chunk(db, unique, results) if unique else []
+    # URLs repetidas dentro do bloco viram uma única linha (o upsert não aceita duplicatas)
+    by_hash: dict[bytes, list[int]] = {}
+    urls: dict[bytes, str] = {}
+    for index, url, expires_at, policy in chunk:
+        if expires_at is not None or policy is not None:
+            continue
+        digest = utils.url_hash(url)
+        by_hash.setdefault(digest, []).append(index)
+        urls[digest] = url
+    remaining = list(by_hash)
+    # Novas tentativas só para códigos que colidiram com códigos legados
+    for _ in range(utils.MAX_RETRIES):
+        if not remaining:
+            break
+        codes = await code_allocator.next_codes(len(remaining))
+        saved = await _bulk_by_shard(db, crud.upsert_url_mappings_bulk, [
+            {"short_code": code, "long_url": urls[digest], "long_url_hash": digest, "expires_at": None, "redirect_policy": None}
+            for digest, code in zip(remaining, codes)
+        ])
+        for digest in remaining:
+            if digest in saved:
+                for index in by_hash[digest]:
+                    results[index] = _batch_result(index, short_url=f"{BASE_URL}/{saved[digest]}")
+        remaining = [digest for digest in remaining if digest not in saved]
+    return pending + [(index, urls[digest], None, None) for digest in remaining for index in by_hash[digest]]
+
+
+async def _commit_shorten_group(items: list[tuple[str, datetime | None, str | None]]) -> list:
+    """
+    Grava um grupo do modo group-commit pelo mesmo caminho do lote (um INSERT
+    multi-linha e um commit); recebe (URL, expiração, política) e retorna a URL
+    curta ou a exceção de cada item.
+    """
+    chunk = [(index, *item) for index, item in enumerate(items)]
+    results: list[dict | None] = [None] * len(chunk)
+    save_chunk = _save_batch_chunk_dedup if DEDUP_ENABLED else _save_batch_chunk
+    async with database.get_session() as db:
+        pending = await save_chunk(db, chunk, results)
+    for index, *_ in pending:
+        results[index] = HTTPException(status_code=409, detail="Short code already exists (collision)")
+    return [result["short_url"] if isinstance(result, dict) else result for result in results]
+
+
+group_committer = GroupCommitter(
+    _commit_shorten_group, window=GROUP_COMMIT_WINDOW_MS / 1000, max_batch=GROUP_COMMIT_MAX_BATCH
+) if GROUP_COMMIT_ENABLED else None
+
+GROUP_COMMIT_STATS = metrics.Gauge("shorten_group_commit", "Contadores do modo group-commit.", ("stat",))
+GROUP_COMMIT_STATS.set_function(
+    lambda: {(key,): value for key, value in group_committer.stats().items()} if group_committer else {}
+)
+
+
+@app.post("/shorten/batch", response_model=models.URLBatchResponse, status_code=200)
+async def create_short_urls_batch(
+        request: Request,
+        db: AsyncSession = Depends(database.get_db)
+):
+    """
+    Encurta um lote de URLs. Os códigos são alocados para o lote inteiro e salvos
+    com um INSERT multi-linha por bloco. Os resultados seguem a ordem da entrada,
+    com um erro por item que falhar.
+    """
+    items = await _read_batch_items(request)
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {BATCH_MAX_ITEMS} items)")
+
+    results: list[dict | None] = [None] * len(items)
+
+    # 1. Validar cada item individualmente
+    valid: list[BatchItem] = []
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, dict):
+                # Objetos aceitam os mesmos campos do /shorten (long_url, expires_at/expires_in, redirect_policy)
+                url_item = models.URLBase.model_validate(item)
+                valid.append((index, str(url_item.long_url), url_item.expires_at, url_item.redirect_policy))
+            else:
+                valid.append((index, str(_http_url_adapter.validate_python(item)), None, None))
+        except ValidationError as e:
+            results[index] = _batch_result(index, error=f"Invalid URL: {e.errors()[0]['msg']}")
+
+    # 2. Alocar códigos e inserir por blocos
+    save_chunk = _save_batch_chunk_dedup if DEDUP_ENABLED else _save_batch_chunk
+    for start in range(0, len(valid), BATCH_CHUNK_SIZE):
+        chunk = valid[start:start + BATCH_CHUNK_SIZE]
+        try:
+            pending = await save_chunk(db, chunk, results)
+            error = "Short code already exists (collision)"
+        except Exception as e:
+            logger.error(f"Error saving URL batch chunk: {e}")
+            pending = [item for item in chunk if results[item[0]] is None]
+            error = f"Failed to save URL mapping: {e}"
+        for index, *_ in pending:
+            results[index] = _batch_result(index, error=error)
+
+    logs.log_request("Batch processed", items=len(items), valid=len(valid))
+    # Mesmo formato de models.URLBatchResponse, serializado direto com orjson
+    return ORJSONResponse({"results": results})
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas do serviço no formato texto do Prometheus."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # Endpoint de health check (opcional, mas útil)
@@ -128,4 +414,4 @@ async def health_check():
 # --- Fim da Definição das Rotas ---
 
 # ... (final do arquivo, depois de todas as definições) ...
-print("INFO: main.py module loaded successfully.", file=sys.stderr)
\ No newline at end of file
+logger.info(f"main.py module loaded successfully ({metrics.mark_startup('imported'):.3f}s after process start).")
\ No newline at end of file
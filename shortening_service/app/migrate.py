@@ -0,0 +1,175 @@
+"""
+Migrações versionadas do schema (alembic), aplicadas no startup no lugar do create_all.
+
+O schema (url_mappings, link_clicks, sequence de códigos) é compartilhado pelo
+shortening_service e pelo redirection_service, que têm cópias idênticas de
+app/migrations: qualquer um dos dois pode aplicar a próxima revisão.
+
+No startup, para o banco principal e para cada shard:
+    1. Verificação barata: um SELECT em alembic_version (sem importar o alembic).
+       Já na revisão mais recente, não há mais nada a fazer.
+    2. Senão, a instância tenta o advisory lock do Postgres
+       (pg_try_advisory_lock, de sessão); quem consegue aplica as migrações,
+       uma transação por revisão, e libera o lock no fim. O lock é de sessão
+       porque uma revisão pode ter trechos fora de transação (autocommit_block,
+       ex.: CREATE INDEX CONCURRENTLY), que fazem commit no meio da migração.
+    3. As demais repetem só a verificação de versão a cada
+       MIGRATION_POLL_INTERVAL segundos até a migração terminar. O prazo
+       MIGRATION_TIMEOUT só vale enquanto ninguém segura o lock: uma migração
+       longa (ex.: CREATE INDEX CONCURRENTLY numa tabela grande) não derruba
+       as instâncias que esperam por ela.
+
+As revisões ficam em migrations/versions/<revisão>_<descrição>.py, com
+revisões numéricas sequenciais (0001, 0002, ...).
+
+Uso manual (ex: num job antes do deploy, com MIGRATE_ON_STARTUP=false nos serviços):
+    python -m app.migrate upgrade
+    python -m app.migrate current
+    python -m app.migrate revision "descrição da mudança"
+"""
+import asyncio
+import os
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from . import database, sharding
+from .logs import logger
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+MIGRATION_LOCK_ID = int(os.getenv("MIGRATION_LOCK_ID", "7134502"))  # Chave do advisory lock
+MIGRATION_POLL_INTERVAL = float(os.getenv("MIGRATION_POLL_INTERVAL", "0.1"))
+MIGRATION_TIMEOUT = float(os.getenv("MIGRATION_TIMEOUT", "60"))  # Espera máxima sem ninguém migrando
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+KNOWN_REVISIONS = sorted(
+    name.split("_", 1)[0] for name in os.listdir(os.path.join(MIGRATIONS_DIR, "versions"))
+    if name.endswith(".py") and name[0].isdigit()
+)
+HEAD_REVISION = KNOWN_REVISIONS[-1]
+
+
+async def current_revision(engine) -> str | None:
+    """Revisão aplicada no banco (None se ele nunca foi migrado)."""
+    async with engine.connect() as conn:
+        try:
+            return await conn.scalar(text("SELECT version_num FROM alembic_version"))
+        except DBAPIError:
+            return None  # Tabela alembic_version ainda não existe
+
+
+def _alembic_config(connection=None):
+    # Importado só quando há migração a aplicar (o alembic não pesa no startup normal)
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    return config
+
+
+def _upgrade(connection):
+    from alembic import command
+
+    command.upgrade(_alembic_config(connection), "head")
+
+
+async def _migrate_locked(engine) -> bool:
+    """Aplica as migrações se conseguir o lock; False se outra instância está migrando."""
+    postgres = engine.dialect.name == "postgresql"
+    async with engine.connect() as conn:
+        if postgres:
+            locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            await conn.commit()  # O lock é de sessão; o alembic abre as próprias transações
+            if not locked:
+                return False
+        try:
+            # O alembic relê a versão já com o lock (outra instância pode ter acabado de migrar)
+            await conn.run_sync(_upgrade)
+        finally:
+            if postgres:
+                await conn.rollback()
+                await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                await conn.commit()
+    return True
+
+
+async def _lock_held(engine) -> bool:
+    """True se alguma sessão segura o advisory lock das migrações (só Postgres)."""
+    if engine.dialect.name != "postgresql":
+        return False
+    async with engine.connect() as conn:
+        # Chave bigint em pg_locks: 32 bits altos em classid, baixos em objid, objsubid = 1
+        return await conn.scalar(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted"
+            " AND classid::bigint = :high AND objid::bigint = :low AND objsubid = 1)"
+        ), {"high": MIGRATION_LOCK_ID >> 32, "low": MIGRATION_LOCK_ID & 0xFFFFFFFF})
+
+
+async def ensure_schema(engine, label: str = "primary", migrate: bool = MIGRATE_ON_STARTUP):
+    """Garante que o banco está na revisão HEAD_REVISION, migrando (se `migrate`) ou esperando quem migra."""
+    deadline = time.monotonic() + MIGRATION_TIMEOUT
+    while True:
+        revision = await current_revision(engine)
+        if revision == HEAD_REVISION:
+            return
+        if revision is not None and revision not in KNOWN_REVISIONS:
+            # Banco já migrado por uma versão mais nova do serviço (deploy em andamento)
+            logger.warning(f"Database {label} is at revision {revision}, newer than {HEAD_REVISION}.")
+            return
+        if migrate and await _migrate_locked(engine):
+            logger.info(f"Database {label} migrated from revision {revision} to {HEAD_REVISION}.")
+            return
+        if time.monotonic() > deadline:
+            if not await _lock_held(engine):
+                raise TimeoutError(f"Database {label} still at revision {revision}, expected {HEAD_REVISION}")
+            # Outra instância ainda migra: o prazo recomeça
+            logger.info(f"Database {label}: migration still running elsewhere, waiting.")
+            deadline = time.monotonic() + MIGRATION_TIMEOUT
+        await asyncio.sleep(MIGRATION_POLL_INTERVAL)
+
+
+def _engines() -> dict:
+    """Banco principal e cada shard com engine própria (todos têm url_mappings)."""
+    engines = {database.engine: "primary"}
+    for shard in sharding.all_shards():
+        engines.setdefault(shard.engine, shard.name)
+    return engines
+
+
+async def ensure_all_schemas(migrate: bool = MIGRATE_ON_STARTUP):
+    # Um banco por vez: o contexto de migração do alembic (alembic.context/op) é global ao processo
+    for engine, label in _engines().items():
+        await ensure_schema(engine, label, migrate)
+
+
+# --- Linha de comando ---
+
+async def _print_current():
+    for engine, label in _engines().items():
+        print(f"{label}: {await current_revision(engine)} (head {HEAD_REVISION})")
+
+
+def _new_revision(message: str):
+    from alembic import command
+
+    rev_id = f"{int(HEAD_REVISION) + 1:04d}"
+    command.revision(_alembic_config(), message=message, rev_id=rev_id)
+
+
+def main(argv: list[str]):
+    if not argv or argv[0] not in ("upgrade", "current", "revision"):
+        print(__doc__)
+        sys.exit(1)
+    if argv[0] == "upgrade":
+        asyncio.run(ensure_all_schemas(migrate=True))
+    elif argv[0] == "current":
+        asyncio.run(_print_current())
+    else:
+        _new_revision(" ".join(argv[1:]) or "migration")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
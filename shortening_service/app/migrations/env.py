@@ -0,0 +1,13 @@
+from alembic import context
+
+# A conexão vem de app.migrate (que já segura o advisory lock, de sessão);
+# a URL do banco é a mesma de database.py, então não há alembic.ini.
+# Uma transação por revisão: autocommit_block só faz commit da revisão em andamento.
+connection = context.config.attributes.get("connection")
+if connection is None:
+    raise RuntimeError("Run migrations with `python -m app.migrate upgrade`.")
+
+context.configure(connection=connection, target_metadata=None, transaction_per_migration=True)
+
+with context.begin_transaction():
+    context.run_migrations()
@@ -0,0 +1,98 @@
+"""Schema inicial (equivalente ao antigo create_all dos dois serviços)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Idempotente: bancos criados pelo create_all (com ou sem as colunas adicionadas
+depois via ALTER TABLE, ver README) só recebem o que falta e passam a ser
+controlados pelo alembic a partir daqui.
+
+No Postgres, os índices de url_mappings são criados com CREATE INDEX
+CONCURRENTLY fora de transação (autocommit_block): num banco existente a
+tabela continua aceitando leituras e escritas enquanto o índice é montado.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if "url_mappings" not in tables:
+        op.create_table(
+            "url_mappings",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("short_code", sa.String, nullable=False),
+            sa.Column("long_url", sa.String, nullable=False),
+            sa.Column("long_url_hash", sa.LargeBinary(32), nullable=True),
+            sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        columns = {"long_url_hash", "expires_at"}
+        indexes = set()
+    else:
+        columns = {column["name"] for column in inspector.get_columns("url_mappings")}
+        indexes = {index["name"] for index in inspector.get_indexes("url_mappings")}
+    if "long_url_hash" not in columns:
+        op.add_column("url_mappings", sa.Column("long_url_hash", sa.LargeBinary(32), nullable=True))
+    if "expires_at" not in columns:
+        op.add_column("url_mappings", sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True))
+
+    _create_index(bind, indexes, "ix_url_mappings_id", "id")
+    _create_index(bind, indexes, "ix_url_mappings_short_code", "short_code", unique=True)
+    _create_index(bind, indexes, "ix_url_mappings_long_url_hash", "long_url_hash", unique=True)
+    _create_index(bind, indexes, "ix_url_mappings_expires_at", "expires_at", where="expires_at IS NOT NULL")
+
+    if "link_clicks" not in tables:
+        op.create_table(
+            "link_clicks",
+            sa.Column("short_code", sa.String, primary_key=True),
+            sa.Column("click_count", sa.BigInteger, nullable=False),
+            sa.Column("first_click_at", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("last_click_at", sa.DateTime(timezone=True), nullable=False),
+        )
+
+    # Contador que substitui a sequence no SQLite (stand-in dos benchmarks)
+    if "short_code_counter" not in tables:
+        op.create_table(
+            "short_code_counter",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("next_id", sa.BigInteger, nullable=False),
+        )
+
+    if bind.dialect.name == "postgresql":
+        op.execute("CREATE SEQUENCE IF NOT EXISTS url_short_code_seq")
+
+
+def _create_index(bind, indexes: set, name: str, column: str, unique: bool = False, where: str | None = None):
+    """Índice em url_mappings; no Postgres, CONCURRENTLY e sem depender do inspector."""
+    if bind.dialect.name != "postgresql":
+        if name not in indexes:
+            op.create_index(name, "url_mappings", [column], unique=unique,
+                            sqlite_where=sa.text(where) if where else None)
+        return
+    with op.get_context().autocommit_block():
+        # Um CONCURRENTLY interrompido deixa o índice inválido, que o IF NOT EXISTS pularia
+        valid = op.get_bind().scalar(sa.text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                     {"name": name})
+        if valid is False:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        op.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON url_mappings ({column})"
+            + (f" WHERE {where}" if where else "")
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP SEQUENCE IF EXISTS url_short_code_seq")
+    op.drop_table("short_code_counter")
+    op.drop_table("link_clicks")
+    op.drop_table("url_mappings")
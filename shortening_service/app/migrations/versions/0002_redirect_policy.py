@@ -0,0 +1,25 @@
+"""Política de cache do redirecionamento por link
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Coluna nullable, sem valor padrão: NULL = temporary (o comportamento de antes),
+então a migração não reescreve as linhas existentes.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("url_mappings", sa.Column("redirect_policy", sa.String, nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("url_mappings") as batch_op:
+        batch_op.drop_column("redirect_policy")
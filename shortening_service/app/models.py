@@ -1,5 +1,8 @@
-from sqlalchemy import Column, Integer, String, Index
-from pydantic import BaseModel, HttpUrl, Field
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, Index, LargeBinary, Sequence, text
+from pydantic import BaseModel, HttpUrl, Field, model_validator
 from .database import Base
 
 
@@ -12,15 +15,72 @@ class URLMap(Base):
     id = Column(Integer, primary_key=True, index=True)
     short_code = Column(String, unique=True, index=True, nullable=False)
     long_url = Column(String, nullable=False)  # String normal, validação Pydantic garante ser URL
+    # SHA-256 da URL normalizada; só preenchido no modo de deduplicação (índice de largura fixa)
+    long_url_hash = Column(LargeBinary(32), unique=True, index=True, nullable=True)
+    # Links sem expiração ficam com NULL; o índice parcial só cobre os que expiram (usado pelo reaper)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Política de cache do redirecionamento (NULL = temporary, o padrão); ver RedirectPolicy
+    redirect_policy = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_url_mappings_expires_at", "expires_at",
+            postgresql_where=text("expires_at IS NOT NULL"), sqlite_where=text("expires_at IS NOT NULL"),
+        ),
+    )
+
+
+# Sequence usada pelo CodeAllocator para reservar blocos de IDs de códigos curtos
+short_code_seq = Sequence('url_short_code_seq', metadata=Base.metadata)
+
+
+# Substitui a sequence quando o banco não tem sequences (SQLite usado nos benchmarks locais)
+class ShortCodeCounter(Base):
+    __tablename__ = 'short_code_counter'
+
+    id = Column(Integer, primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
 
 
 # Adiciona um índice explícito no short_code, além do unique constraint
 # Index('ix_url_mappings_short_code', URLMap.short_code)
 
 # --- Pydantic Models ---
+# Como o gateway responde aos redirecionamentos do link:
+#   temporary  307 sem cache (padrão; gravado como NULL)
+#   cacheable  307 com Cache-Control curto, nunca além da expiração (links que podem mudar ou expirar)
+#   permanent  301/308 com Cache-Control longo (links imutáveis; não podem expirar)
+RedirectPolicy = Literal["temporary", "cacheable", "permanent"]
+
+
 # Modelo para o corpo da requisição POST /shorten
 class URLBase(BaseModel):
     long_url: HttpUrl  # Valida se é uma URL válida
+    # Expiração opcional: data absoluta ou segundos a partir de agora (não os dois)
+    expires_at: datetime | None = None
+    expires_in: int | None = Field(None, gt=0)
+    redirect_policy: RedirectPolicy | None = None
+
+    @model_validator(mode="after")
+    def _resolve_expiry(self):
+        if self.expires_in is not None:
+            if self.expires_at is not None:
+                raise ValueError("Use either expires_at or expires_in, not both")
+            self.expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.expires_in)
+            self.expires_in = None
+        elif self.expires_at is not None:
+            if self.expires_at.tzinfo is None:
+                self.expires_at = self.expires_at.replace(tzinfo=timezone.utc)  # Sem fuso = UTC
+            # Sempre gravado em UTC (o SQLite guarda a data sem fuso)
+            self.expires_at = self.expires_at.astimezone(timezone.utc)
+            if self.expires_at <= datetime.now(timezone.utc):
+                raise ValueError("expires_at must be in the future")
+        if self.redirect_policy == "temporary":
+            self.redirect_policy = None
+        elif self.redirect_policy == "permanent" and self.expires_at is not None:
+            # Um redirecionamento permanente fica no cache do navegador, que não sabe da expiração
+            raise ValueError("Permanent links cannot expire")
+        return self
 
 
 # Modelo para a resposta da API (usado pelo Gateway)
@@ -31,3 +91,15 @@ class URLShortResponse(BaseModel):
 # Modelo interno usado pelo serviço de encurtamento ao criar
 class URLCreate(URLBase):
     short_code: str
+
+
+# --- Modelos do endpoint em lote (/shorten/batch) ---
+# Resultado de um item do lote, na mesma posição (index) da entrada
+class URLBatchItemResult(BaseModel):
+    index: int
+    short_url: HttpUrl | None = None
+    error: str | None = None
+
+
+class URLBatchResponse(BaseModel):
+    results: list[URLBatchItemResult]
@@ -1,27 +1,125 @@
-import secrets
-import string
-from sqlalchemy.ext.asyncio import AsyncSession
-from . import crud
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable
+
+from .logs import logger
 
 # Caracteres possíveis para o código curto (alfanumérico seguro para URL)
 # Exclui caracteres que podem ser confundidos (O, 0, I, l) - opcional
 # ALPHABET = string.ascii_letters + string.digits
 ALPHABET = "abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-CODE_LENGTH = 6  # Comprimento do código curto
-MAX_RETRIES = 10  # Tentativas máximas para evitar colisão
+CODE_LENGTH = 6  # Comprimento mínimo do código curto
+MAX_RETRIES = 10  # Tentativas máximas em caso de colisão com códigos legados (aleatórios)
+
+# Quantos IDs cada worker reserva da sequence do Postgres por ida ao banco
+CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "100"))
+# Chave da permutação: deve ser estável, trocá-la pode gerar códigos já emitidos.
+# A chave padrão é pública (quem a conhece reverte a permutação e enumera os códigos),
+# então só é aceita com APP_ENV=dev; ver check_code_key
+DEFAULT_CODE_KEY = "ushort-default-code-key"
+CODE_KEY = (os.getenv("SHORT_CODE_KEY") or DEFAULT_CODE_KEY).encode()
+APP_ENV = os.getenv("APP_ENV", "production").lower()
+DEV_ENVIRONMENTS = ("dev", "development", "local")
+
+_FEISTEL_ROUNDS = 4
+
+
+def check_code_key():
+    """
+    Chamada no startup: sem SHORT_CODE_KEY os códigos saem da chave padrão, que está
+    no código-fonte. Fora de dev (APP_ENV) isso é um erro; em dev, só um aviso.
+    """
+    if os.getenv("SHORT_CODE_KEY"):
+        return
+    message = ("SHORT_CODE_KEY is not set: short codes are derived from the public default key "
+               "and can be reversed to sequential IDs. Set a random, stable SHORT_CODE_KEY.")
+    if APP_ENV not in DEV_ENVIRONMENTS:
+        raise RuntimeError(f"{message} (set APP_ENV=dev to allow the default key in development)")
+    logger.warning("!" * 20 + f" {message} " + "!" * 20)
+
+
+def url_hash(long_url: str) -> bytes:
+    """SHA-256 da URL já normalizada (str(HttpUrl)), usado na deduplicação."""
+    return hashlib.sha256(long_url.encode()).digest()
+
+
+def encode_base(value: int, length: int) -> str:
+    """Codifica um inteiro no ALPHABET com largura fixa."""
+    base = len(ALPHABET)
+    chars = []
+    for _ in range(length):
+        value, rem = divmod(value, base)
+        chars.append(ALPHABET[rem])
+    if value:
+        raise ValueError("Value does not fit in the requested code length")
+    return ''.join(reversed(chars))
+
+
+def _feistel(value: int, half_bits: int, key: bytes) -> int:
+    """Uma passada de Feistel balanceada (bijeção em [0, 2**(2*half_bits)))."""
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for round_no in range(_FEISTEL_ROUNDS):
+        digest = hashlib.blake2b(
+            right.to_bytes(16, "big") + bytes((round_no,)), key=key, digest_size=16
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+    return (left << half_bits) | right
+
+
+def permute(value: int, domain: int, key: bytes = CODE_KEY) -> int:
+    """
+    Permutação com chave de [0, domain) nela mesma (Feistel + cycle walking).
+    Valores distintos geram resultados distintos, mas sem padrão sequencial visível.
+    """
+    half_bits = max(1, ((domain - 1).bit_length() + 1) // 2)
+    key = key + domain.to_bytes(16, "big")  # Uma permutação diferente por comprimento
+    value = _feistel(value, half_bits, key)
+    while value >= domain:
+        value = _feistel(value, half_bits, key)
+    return value
+
+
+def code_from_id(code_id: int) -> str:
+    """
+    Converte um ID sequencial (>= 0) em um código curto único.
+    Os primeiros len(ALPHABET)**CODE_LENGTH IDs usam CODE_LENGTH caracteres,
+    os seguintes usam um caractere a mais, e assim por diante.
+    """
+    if code_id < 0:
+        raise ValueError("code_id must be non-negative")
+    base = len(ALPHABET)
+    length = CODE_LENGTH
+    domain = base ** length
+    while code_id >= domain:
+        code_id -= domain
+        length += 1
+        domain = base ** length
+    return encode_base(permute(code_id, domain), length)
+
 
+class CodeAllocator:
+    """
+    Distribui códigos únicos sem consultar o banco a cada chamada.
+    Reserva blocos de IDs de uma sequence e os converte com code_from_id.
+    """
 
-async def generate_short_code() -> str:
-    """Gera um código curto aleatório."""
-    return ''.join(secrets.choice(ALPHABET) for _ in range(CODE_LENGTH))
+    def __init__(self, reserve_ids: Callable[[int], Awaitable[list[int]]], block_size: int = CODE_BLOCK_SIZE):
+        self._reserve_ids = reserve_ids
+        self.block_size = max(1, block_size)
+        self._ids: list[int] = []
+        self._lock = asyncio.Lock()
 
+    async def next_code(self) -> str:
+        """Retorna o próximo código livre, reservando um novo bloco se necessário."""
+        return (await self.next_codes(1))[0]
 
-async def generate_unique_short_code(db: AsyncSession) -> str:
-    """Gera um código curto e garante que ele seja único no banco."""
-    for _ in range(MAX_RETRIES):
-        code = await generate_short_code()
-        existing = await crud.get_url_by_short_code(db, code)
-        if not existing:
-            return code
-    # Se esgotar as tentativas (extremamente improvável com um bom tamanho/alfabeto)
-    raise Exception("Could not generate a unique short code after multiple retries.")
+    async def next_codes(self, count: int) -> list[str]:
+        """Retorna `count` códigos livres, em ordem."""
+        async with self._lock:
+            if len(self._ids) < count:
+                needed = max(self.block_size, count - len(self._ids))
+                self._ids.extend(await self._reserve_ids(needed))
+            taken, self._ids = self._ids[:count], self._ids[count:]
+        return [code_from_id(code_id) for code_id in taken]